@@ -1,16 +1,37 @@
 import os
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_from_directory
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, abort, Response, send_file, stream_with_context
 import logging
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import NotFound
+from werkzeug.datastructures import MultiDict
 import requests
+import io
 import json
+import hashlib
 from PIL import Image
 import datetime
 from flask_migrate import Migrate
 from flask_login import LoginManager, login_required, current_user, login_user, logout_user
-from utils import generate_batch_number, is_valid_image
+from sqlalchemy.orm import selectinload
 from models import db, product_categories, User
 from decorators import admin_required
+from page_cache import public_pages, conditional_response
+import cache_policy
+from asset_index import assets
+import pdf_delivery
+import product_listing
+import product_attributes
+import product_views
+import catalog_stats
+import settings_cache
+import bulk_edit
+import catalog_import
+import catalog_export
+import identifiers
+import blob_store
+import image_pipeline
+import image_resizer
+import image_worker
 
 app = Flask(__name__)
 migrate = Migrate(app, db)
@@ -138,14 +159,30 @@ else:
 
 app.config['UPLOAD_FOLDER'] = os.path.join('static', 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size 
-app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # Disable caching for development
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = None  # Cache-Control for files is set by cache_policy
 app.config['DEFAULT_IMAGE'] = 'img/no-image.png'  # Default image to use when one is missing
+app.config['SEARCH_PAGE_SIZE'] = 24  # Results per section on the public search page
+app.config['PUBLIC_BATCH_LOOKUP_LIMIT'] = 100  # Batch numbers per /api/public/batches request
+app.config['ADMIN_PAGE_SIZE'] = 30  # Product cards per page in the admin product list
+app.config['BULK_EDIT_LIMIT'] = 5000  # Products changed by one bulk edit request
+# PDF delivery: 'direct', or offload to a front proxy with 'x-accel-redirect' (nginx) / 'x-sendfile'
+app.config['PDF_DELIVERY'] = os.environ.get('PDF_DELIVERY', 'direct')
+app.config['PDF_ACCEL_REDIRECT_PREFIX'] = os.environ.get('PDF_ACCEL_REDIRECT_PREFIX', '/internal-pdfs/')
+# Uploaded images are processed by this many worker processes; 0 processes them in the request
+app.config['ASSET_INDEX_POLL_INTERVAL'] = 60  # Seconds between rescans for files written by other processes
+app.config['SUGGEST_REFRESH_INTERVAL'] = 300  # Seconds between search suggestion rebuilds, for other processes' writes
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', min(2, os.cpu_count() or 1)))
+# Disk space for images resized on demand by /img/<width>x<height>/<path>, least recently used evicted first
+app.config['RESIZE_CACHE_MAX_BYTES'] = int(os.environ.get('RESIZE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
 
 # Helper function to safely get image paths, falling back to default if image is missing
 def get_safe_image_path(image_path):
     """
     Returns a safe image path, checking if the file exists and falling back to default if not.
 
+    Existence is answered from the asset index, so rendering never touches the
+    filesystem; missing files are logged at most once per path every few minutes.
+
     Args:
         image_path: Relative path to the image file (usually from database)
 
@@ -156,39 +193,18 @@ def get_safe_image_path(image_path):
         # No image path provided, use default
         return app.config['DEFAULT_IMAGE']
 
-    # Check if we're in deployment or development
-    is_deployment = os.environ.get("REPLIT_DEPLOYMENT", "0") == "1"
-
-    # Construct full path using workspace root to check if file exists
-    workspace_root = os.getcwd()
-    full_path = os.path.join(workspace_root, 'static', image_path)
-
-    if os.path.isfile(full_path):
-        # File exists, return the correct relative path
+    if assets.exists(image_path):
         return image_path
-    else:
-        # Log the missing file with detailed information
-        app.logger.warning(f"Image file not found: {full_path}")
-        app.logger.warning(f"Original path requested: {image_path}")
-        app.logger.warning(f"Environment: {'Deployment' if is_deployment else 'Development'}")
-        app.logger.warning(f"Working directory: {workspace_root}")
-        app.logger.warning(f"Using default image: {app.config['DEFAULT_IMAGE']}")
-
-        # Attempt to create the directory if it doesn't exist
-        # This helps when moving between environments
-        try:
-            directory = os.path.dirname(full_path)
-            if not os.path.exists(directory):
-                os.makedirs(directory, exist_ok=True)
-                app.logger.info(f"Created missing directory: {directory}")
-        except Exception as e:
-            app.logger.error(f"Error creating directory: {str(e)}")
 
-        return app.config['DEFAULT_IMAGE']
+    assets.report_missing(image_path)
+    return app.config['DEFAULT_IMAGE']
+
+assets.init_app(app)
+cache_policy.init_app(app)
 
 @app.after_request
 def add_header(response):
-    response.headers['Cache-Control'] = 'no-store'
+    cache_policy.apply(app, request, response)
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
     response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
@@ -198,33 +214,13 @@ def add_header(response):
 @app.route('/static/pdfs/<path:filename>')
 def serve_pdf(filename):
     try:
-        # Get absolute path to PDF directory
-        workspace_root = os.getcwd()
-        pdf_dir = os.path.join(workspace_root, 'static', 'pdfs')
-        file_path = os.path.join(pdf_dir, filename)
-
-        app.logger.info(f"Attempting to serve PDF from: {file_path}")
-
-        if not os.path.exists(file_path):
-            app.logger.error(f"PDF not found at path: {file_path}")
-            return "PDF not found", 404
-
-        # Get file size for logging
-        file_size = os.path.getsize(file_path)
-        app.logger.info(f"Found PDF file ({file_size} bytes)")
-
+        pdf_dir = os.path.join(os.getcwd(), 'static', 'pdfs')
         download = request.args.get('download', '0') == '1'
-
-        # Use the relative path for send_from_directory
-        relative_pdf_dir = os.path.join('static', 'pdfs')
-
-        app.logger.info(f"Serving PDF with download={download}")
-        return send_from_directory(
-            relative_pdf_dir, 
-            filename,
-            as_attachment=download,
-            mimetype='application/pdf'
-        )
+        app.logger.debug(f"Serving PDF {filename} with download={download}")
+        return pdf_delivery.send_pdf(app, request, pdf_dir, filename, as_attachment=download)
+    except NotFound:
+        app.logger.error(f"PDF not found: {filename}")
+        return "PDF not found", 404
     except Exception as e:
         app.logger.error(f"Error serving PDF {filename}: {str(e)}")
         # Add stack trace for better debugging
@@ -233,7 +229,23 @@ def serve_pdf(filename):
         return f"Error accessing PDF: {str(e)}", 500
 
 
+@app.route('/img/<int:width>x<int:height>/<path:filename>')
+def resized_image(width, height, filename):
+    """An uploaded image resized to a layout's box; see image_resizer."""
+    try:
+        file, mimetype, etag = image_resizer.open_resized(app.static_folder, filename, width, height,
+                                                          request.accept_mimetypes)
+    except (ValueError, FileNotFoundError, Image.UnidentifiedImageError, Image.DecompressionBombError):
+        abort(404)
+    response = send_file(file, mimetype=mimetype, etag=etag, conditional=True, max_age=None)
+    response.vary.add('Accept')
+    return response
+
+
 db.init_app(app)
+image_worker.init_app(app)
+blob_store.init_app(app)
+image_resizer.init_app(app)
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -244,6 +256,16 @@ with app.app_context():
     import models
     db.create_all()
 
+    import batch_registry
+    batch_registry.ensure_populated()
+    product_attributes.ensure_populated()
+
+    import search_index
+    search_index.init_app(app)
+
+    from suggest_index import suggestions
+    suggestions.init_app(app)
+
 @app.route('/')
 def index():
     return render_template('search_home.html')
@@ -268,60 +290,239 @@ def admin_index(path):
 def page_not_found(e):
     return render_template('404.html'), 404
 
+def render_product_list():
+    """
+    Render one page of the admin product list for the current request.
+
+    With ?format=json only the product cards and the next cursor are returned,
+    which the page uses to lazy-load further pages.
+    """
+    filters = product_listing.parse_filters(request.args)
+    products, next_cursor = product_listing.page(filters, request.args.get('cursor'),
+                                                 app.config['ADMIN_PAGE_SIZE'])
+    filter_args = product_listing.filter_args(filters)
+
+    if request.args.get('format') == 'json':
+        html = render_template('_product_cards.html', products=products, filter_args=filter_args)
+        return jsonify({'html': html, 'next_cursor': next_cursor, 'count': len(products)})
+
+    categories = models.Category.query.order_by(models.Category.name).all()
+    return render_template('product_list.html',
+                          products=products,
+                          categories=categories,
+                          filter_args=filter_args,
+                          search_query=filters.q,
+                          selected_category=filters.category_id,
+                          square_filter=filters.square,
+                          attribute_filter=filter_args.get('attr', ''),
+                          sort=filters.sort,
+                          attribute_names=product_attributes.attribute_names(),
+                          next_cursor=next_cursor)
+
+
 @app.route('/vmc-admin/dashboard')
 @login_required
 def admin_dashboard():
-    category_id = request.args.get('category', type=int)
-    query = models.Product.query.order_by(models.Product.created_at.desc())
+    return render_product_list()
+
+def load_search_hits(model, hits, *options):
+    """Load the rows behind a page of search hits, preserving rank order."""
+    if not hits:
+        return []
+    query = model.query.options(*options).filter(model.id.in_([hit.ref_id for hit in hits]))
+    rows = {row.id: row for row in query}
+    return [rows[hit.ref_id] for hit in hits if hit.ref_id in rows]
 
-    if category_id:
-        query = query.join(models.Product.categories).filter(models.Category.id == category_id)
 
-    products = query.all()
-    categories = models.Category.query.order_by(models.Category.name).all()
-    return render_template('product_list.html', products=products, categories=categories, selected_category=category_id)
+def search_section(query, kind, cursor, per_page, attributes=()):
+    """
+    Fetch one keyset-paginated section of the search results, optionally
+    restricted by attribute filters.
+
+    Returns:
+        (SearchResults, next cursor) - the cursor is 'end' once the section is exhausted
+    """
+    if cursor == 'end':
+        return search_index.SearchResults([], 0), 'end'
+    results = search_index.search(query, kind, per_page + 1, search_index.parse_cursor(cursor), attributes)
+    hits = results.hits[:per_page]
+    next_cursor = search_index.hit_cursor(hits[-1]) if len(results.hits) > per_page else 'end'
+    return search_index.SearchResults(hits, results.total), next_cursor
+
 
 @app.route('/search')
 def search_results():
     query = request.args.get('q', '')
-    # Search current products
-    products = models.Product.query.filter(
-        (models.Product.title.ilike(f'%{query}%'))
-        | (models.Product.batch_number.ilike(f'%{query}%'))).all()
-
-    # Search batch history
-    batch_history = models.BatchHistory.query.filter(
-        models.BatchHistory.batch_number.ilike(f'%{query}%')
-    ).all()
+    per_page = app.config['SEARCH_PAGE_SIZE']
+    product_cursor = request.args.get('pc')
+    history_cursor = request.args.get('hc')
+    attributes = product_attributes.parse_filters(request.args.getlist('attr'))
+
+    # Ranked prefix search over current products and batch history, one page per section
+    product_results, next_product_cursor = search_section(query, search_index.KIND_PRODUCT, product_cursor,
+                                                          per_page, attributes)
+    history_results, next_history_cursor = search_section(query, search_index.KIND_HISTORY, history_cursor,
+                                                          per_page, attributes)
+
+    products = load_search_hits(models.Product, product_results.hits, selectinload(models.Product.image_variants))
+    batch_history = load_search_hits(models.BatchHistory, history_results.hits,
+                                     selectinload(models.BatchHistory.product),
+                                     selectinload(models.BatchHistory.pdfs))
+
+    # Label PDFs grouped by history id so the template never scans every PDF per row
+    history_pdfs = {
+        history.id: sorted(history.pdfs, key=lambda pdf: pdf.created_at or datetime.datetime.min)
+        for history in batch_history
+    }
 
+    has_next = next_product_cursor != 'end' or next_history_cursor != 'end'
     return render_template('search_results.html',
                            products=products,
                            batch_history=batch_history,
+                           history_pdfs=history_pdfs,
+                           product_total=product_results.total,
+                           history_total=history_results.total,
+                           is_first_page=not (product_cursor or history_cursor),
+                           has_next=has_next,
+                           next_product_cursor=next_product_cursor,
+                           next_history_cursor=next_history_cursor,
+                           attribute_filter=product_attributes.format_filters(attributes) or None,
                            query=query)
 
 
+@app.route('/api/search/suggest')
+def search_suggest():
+    """Type-ahead suggestions for the public search box, served from memory."""
+    query = request.args.get('q', '')[:64]
+    limit = min(request.args.get('limit', 8, type=int), 20)
+    return jsonify({
+        'query': query,
+        'suggestions': [{
+            'type': suggestion.kind,
+            'batch_number': suggestion.batch_number,
+            'title': suggestion.title,
+            'url': url_for('public_product_detail', batch_number=suggestion.batch_number),
+        } for suggestion in suggestions.suggest(query, limit)]
+    })
+
+
 @app.route('/batch/<batch_number>')
 def public_product_detail(batch_number):
-    # First try to find a current product
-    product = models.Product.query.filter_by(batch_number=batch_number).first()
-    if product:
-        return render_template('public_product_detail.html', 
-                             product=product, 
-                             is_historical=False)
+    # Repeat scans are answered from the rendered page cache
+    page = public_pages.get(batch_number)
+    if page is None:
+        token = public_pages.begin()
+
+        # Current and historical batches resolve through the registry's unique index
+        entry = batch_registry.resolve(batch_number)
+        if entry is None:
+            abort(404)
+
+        if not entry.is_historical:
+            body = render_template('public_product_detail.html', 
+                                 product=entry.product, 
+                                 is_historical=False)
+        else:
+            body = render_template('public_product_detail.html', 
+                                 product=entry.product,
+                                 batch_history=entry.batch_history,
+                                 is_historical=True)
+        page = public_pages.put(batch_number, entry.product_id, body, token)
+
+    return conditional_response(app, request, page)
+
+
+def public_batch_record(entry, label_pdfs):
+    """Compact JSON record for a resolved batch, with PDF URLs built like the public page."""
+    product = entry.product
+    history = entry.batch_history if entry.is_historical else None
+    batch_number = entry.batch_number
+    coa_pdf = history.coa_pdf if history is not None and history.coa_pdf else product.coa_pdf
+    coa_batch = history.batch_number if history is not None and history.coa_pdf else product.batch_number
+    return {
+        'batch_number': batch_number,
+        'is_historical': history is not None,
+        'title': product.title,
+        'category': product.categories[0].name if product.categories else 'Uncategorized',
+        'sku': product.sku,
+        'barcode': product.barcode,
+        'attributes': product.get_attributes(),
+        'coa_url': url_for('serve_pdf', filename=coa_batch + '/' + coa_pdf.split('/')[-1],
+                           download=1, _external=True) if coa_pdf else None,
+        'label_urls': [url_for('serve_pdf', filename=batch_number + '/' + pdf.filename.split('/')[-1],
+                               _external=True) for pdf in label_pdfs],
+        'page_url': url_for('public_product_detail', batch_number=batch_number, _external=True),
+    }
 
-    # If not found, look for historical record
-    history = models.BatchHistory.query.filter_by(batch_number=batch_number).first_or_404()
-    return render_template('public_product_detail.html', 
-                         product=history.product,
-                         batch_history=history,
-                         is_historical=True)
+
+@app.route('/api/public/batches', methods=['GET', 'POST'])
+def public_batch_lookup():
+    """
+    Resolve many batch numbers at once for scanner and retail integrations.
+
+    GET /api/public/batches?batch=AAA11111&batch=BBB22222 (or batches=AAA11111,BBB22222)
+    POST /api/public/batches with {"batch_numbers": ["AAA11111", "BBB22222"]}
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        requested = data.get('batch_numbers')
+        if not isinstance(requested, list):
+            return jsonify({'error': 'batch_numbers must be a list'}), 400
+    else:
+        requested = request.args.getlist('batch')
+        for value in request.args.getlist('batches'):
+            requested.extend(value.split(','))
+
+    # De-duplicate while keeping the caller's order
+    batch_numbers = list(dict.fromkeys(str(code).strip() for code in requested if str(code).strip()))
+    limit = app.config['PUBLIC_BATCH_LOOKUP_LIMIT']
+    if not batch_numbers:
+        return jsonify({'error': 'No batch numbers given'}), 400
+    if len(batch_numbers) > limit:
+        return jsonify({'error': f'At most {limit} batch numbers per request'}), 400
+
+    # Per-batch records are cached alongside the rendered pages and invalidated with them
+    variant = f"json:{request.host}"
+    records = {}
+    for batch_number in batch_numbers:
+        page = public_pages.get(batch_number, variant)
+        if page is not None:
+            records[batch_number] = page.body
+
+    misses = [batch_number for batch_number in batch_numbers if batch_number not in records]
+    if misses:
+        token = public_pages.begin()
+        entries = batch_registry.resolve_many(misses)
+
+        # Label PDFs for every resolved batch, grouped by batch, in two queries
+        products = {entry.product_id: entry.product for entry in entries.values()}
+        views = product_views.build_product_views(list(products.values()))
+        for batch_number, entry in entries.items():
+            view = views[entry.product_id]
+            if entry.is_historical:
+                label_pdfs = view.history_labels.get(entry.batch_history_id, [])
+            else:
+                label_pdfs = view.current_labels
+            body = json.dumps(public_batch_record(entry, label_pdfs))
+            records[batch_number] = public_pages.put(batch_number, entry.product_id, body, token, variant).body
+
+    found = [records[batch_number] for batch_number in batch_numbers if batch_number in records]
+    not_found = [batch_number for batch_number in batch_numbers if batch_number not in records]
+    body = (b'{"batches":[' + b','.join(found) + b'],"not_found":' +
+            json.dumps(not_found).encode('utf-8') + b'}')
+
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(hashlib.sha256(body).hexdigest()[:32])
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 @app.route('/vmc-admin/categories')
 @login_required
 def categories():
     categories = models.Category.query.order_by(models.Category.name).all()
-    return render_template('category_list.html', categories=categories)
+    return render_template('category_list.html', categories=categories, category_stats=catalog_stats.for_category)
 
 @app.route('/api/categories', methods=['POST'])
 @login_required
@@ -337,6 +538,7 @@ def create_category():
         category.description = data.get('description', '')
         db.session.add(category)
         db.session.commit()
+        catalog_stats.invalidate()
         return jsonify({'success': True})
     except Exception as e:
         db.session.rollback()
@@ -352,6 +554,7 @@ def update_category(category_id):
         category.name = data['name']
         category.description = data.get('description', '')
         db.session.commit()
+        public_pages.clear()  # Category names appear on every public page
         return jsonify({'success': True})
     except Exception as e:
         db.session.rollback()
@@ -365,6 +568,8 @@ def delete_category(category_id):
         category = models.Category.query.get_or_404(category_id)
         db.session.delete(category)
         db.session.commit()
+        public_pages.clear()
+        catalog_stats.invalidate()
         return jsonify({'success': True})
     except Exception as e:
         db.session.rollback()
@@ -414,32 +619,12 @@ def unsync_category(category_id):
 @app.route('/vmc-admin/products')
 @login_required
 def products():
-    category_id = request.args.get('category', type=int)
-    square_filter = request.args.get('square')
-
-    query = models.Product.query.order_by(models.Product.created_at.desc())
-
-    if category_id:
-        query = query.join(models.Product.categories).filter(models.Category.id == category_id)
-
-    # Apply Square sync status filter
-    if square_filter == 'synced':
-        query = query.filter(models.Product.square_catalog_id.isnot(None))
-    elif square_filter == 'unsynced':
-        query = query.filter(models.Product.square_catalog_id.is_(None))
-
-    products = query.all()
-    categories = models.Category.query.order_by(models.Category.name).all()
-    return render_template('product_list.html', 
-                          products=products, 
-                          categories=categories, 
-                          selected_category=category_id,
-                          square_filter=square_filter)
+    return render_product_list()
 
 
 def fetch_craftmypdf_templates():
     """Fetch templates from CraftMyPDF API"""
-    settings = models.Settings.get_settings()
+    settings = settings_cache.get()
     try:
         credentials = settings.get_craftmypdf_credentials()
         api_key = credentials['api_key']
@@ -499,7 +684,7 @@ def fetch_craftmypdf_templates():
 def create_product():
     templates = models.ProductTemplate.query.all()
     categories = models.Category.query.order_by(models.Category.name).all()
-    settings = models.Settings.get_settings()
+    settings = settings_cache.get()
     has_craftmypdf = bool(settings.craftmypdf_api_key)
     pdf_templates = fetch_craftmypdf_templates()
 
@@ -517,20 +702,25 @@ def create_product():
         attr_values = request.form.getlist('attr_value[]')
         attributes = {name: value for name, value in zip(attr_names, attr_values) if name}
 
-        # Generate UPC-A barcode number and SKU
-        from utils import generate_upc_barcode, generate_batch_number, generate_sku
-        barcode_number = generate_upc_barcode()
-        batch_number = request.form.get('batch_number')
-        barcode = request.form.get('barcode') # Added to handle manual entry
-        manual_sku = request.form.get('sku') # Added to handle manual SKU entry
-        if not batch_number:
-            batch_number = generate_batch_number()
-        sku = manual_sku or generate_sku()  # Use manual entry if available, otherwise auto-generated
+        # Identifiers entered manually must be free
+        conflicts = identifiers.conflicts({kind: request.form.get(kind) for kind in identifiers.KINDS})
+        if conflicts:
+            for kind, value in conflicts:
+                flash(f'{identifiers.LABELS[kind]} {value} is already in use', 'danger')
+            return render_template('product_create.html',
+                                   templates=templates,
+                                   categories=categories,
+                                   pdf_templates=pdf_templates)
+
+        # Allocate a free batch number, SKU and UPC-A barcode for any not entered manually
+        batch_number = request.form.get('batch_number') or identifiers.allocate_one('batch_number')
+        barcode = request.form.get('barcode') or identifiers.allocate_one('barcode')
+        sku = request.form.get('sku') or identifiers.allocate_one('sku')
 
         product = models.Product()
         product.title = title
         product.batch_number = batch_number
-        product.barcode = barcode or barcode_number # Use manual entry if available, otherwise auto-generated
+        product.barcode = barcode
         product.sku = sku
         product.cost = float(cost) if cost else None
         product.price = float(price) if price else None
@@ -540,6 +730,7 @@ def create_product():
         # Add to database to get product ID
         db.session.add(product)
         db.session.flush()
+        batch_registry.register_product(product)
 
         # Handle file uploads
         product_image = request.files.get('product_image')
@@ -556,8 +747,7 @@ def create_product():
             filename = secure_filename(coa_pdf.filename)
             batch_dir = os.path.join('pdfs', product.batch_number)
             filepath = os.path.join(batch_dir, filename)
-            os.makedirs(os.path.join('static', batch_dir), exist_ok=True)
-            coa_pdf.save(os.path.join('static', filepath))
+            blob_store.store(coa_pdf.stream, filepath)
             product.coa_pdf = filepath
 
         # Assign category
@@ -566,7 +756,12 @@ def create_product():
             if category:
                 product.categories = [category]
 
+        search_index.index_product(product)
         db.session.commit()
+        public_pages.invalidate(product.batch_number)
+        suggestions.index_product(product)
+        catalog_stats.invalidate()
+        image_worker.submit_deferred()
 
         # If this is running in production, trigger sync to development
         is_deployment = os.environ.get("REPLIT_DEPLOYMENT", "0") == "1"
@@ -621,7 +816,7 @@ def product_detail(product_id):
 @app.route('/api/generate_batch', methods=['POST'])
 @login_required
 def generate_batch():
-    return jsonify({'batch_number': generate_batch_number()})
+    return jsonify({'batch_number': identifiers.allocate_one('batch_number')})
 
 
 @app.route('/api/generate_pdf/<int:product_id>', methods=['POST'])
@@ -631,7 +826,7 @@ def generate_pdf(product_id):
         product = models.Product.query.get_or_404(product_id)
 
         # Get API key from environment
-        settings = models.Settings.get_settings()
+        settings = settings_cache.get()
         credentials = settings.get_craftmypdf_credentials()
         api_key = credentials['api_key']
         if not api_key:
@@ -755,22 +950,14 @@ def generate_pdf(product_id):
 
         # Create PDF record with timestamp
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        batch_dir = os.path.join('static', 'pdfs', product.batch_number)
         pdf_filename = f"label_{product.batch_number}_{timestamp}.pdf"
-        pdf_filepath = os.path.join(batch_dir, pdf_filename)
-
-        # Ensure batch directory exists
-        os.makedirs(batch_dir, exist_ok=True)
+        pdf_filepath = os.path.join('pdfs', product.batch_number, pdf_filename)
 
         # Download PDF
         pdf_response = requests.get(pdf_url, headers={'Accept': 'application/pdf'})
         if pdf_response.status_code == 200:
-            # Ensure directory exists
-            os.makedirs(os.path.dirname(pdf_filepath), exist_ok=True)
-
             # Save PDF
-            with open(pdf_filepath, 'wb') as f:
-                f.write(pdf_response.content)
+            blob_store.store(io.BytesIO(pdf_response.content), pdf_filepath)
 
             # Create PDF record with consistent URL structure
             pdf = models.GeneratedPDF()
@@ -837,14 +1024,13 @@ def delete_pdf(pdf_id):
         product = models.Product.query.get(pdf.product_id)
         if product:
             # Delete physical PDF file
-            pdf_path = os.path.join('static', 'pdfs', product.batch_number, pdf.filename)
-            if os.path.exists(pdf_path):
-                os.remove(pdf_path)
+            pdf_path = blob_store.pdf_path(pdf.filename, product.batch_number)
+            blob_store.release(pdf_path)
 
-                # Check if directory is empty and delete it
-                pdf_dir = os.path.dirname(pdf_path)
-                if os.path.exists(pdf_dir) and not os.listdir(pdf_dir):
-                    os.rmdir(pdf_dir)
+            # Check if directory is empty and delete it
+            pdf_dir = os.path.join('static', os.path.dirname(pdf_path))
+            if os.path.exists(pdf_dir) and not os.listdir(pdf_dir):
+                os.rmdir(pdf_dir)
 
         db.session.delete(pdf)
         db.session.commit()
@@ -893,6 +1079,7 @@ def create_template():
 
             db.session.add(template)
             db.session.commit()
+            catalog_stats.invalidate()
 
             flash('Template created successfully!', 'success')
             return redirect(url_for('template_list'))
@@ -923,13 +1110,20 @@ def unsync_all_products():
         from square_product_sync import delete_product_from_square
         products = models.Product.query.filter(models.Product.square_catalog_id.isnot(None)).all()
 
+        error = None
         for product in products:
             result = delete_product_from_square(product)
             if 'error' in result:
-                return jsonify({
-                    'success': False,
-                    'error': f"Error removing product {product.id}: {result['error']}"
-                }), 400
+                error = f"Error removing product {product.id}: {result['error']}"
+                break
+
+        # Each removal commits on its own; the products before a failure stay unsynced
+        catalog_stats.invalidate()
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
 
         return jsonify({'success': True})
 
@@ -984,6 +1178,7 @@ def duplicate_template(template_id):
 
         db.session.add(new_template)
         db.session.commit()
+        catalog_stats.invalidate()
 
         return jsonify({'success': True, 'new_template_id': new_template.id})
     except Exception as e:
@@ -998,6 +1193,7 @@ def delete_template(template_id):
         template = models.ProductTemplate.query.get_or_404(template_id)
         db.session.delete(template)
         db.session.commit()
+        catalog_stats.invalidate()
         return jsonify({'success': True})
     except Exception as e:
         db.session.rollback()
@@ -1011,11 +1207,24 @@ def edit_product(product_id):
     product = models.Product.query.get_or_404(product_id)
     templates = models.ProductTemplate.query.all()
     categories = models.Category.query.order_by(models.Category.name).all()
-    settings = models.Settings.get_settings()
+    settings = settings_cache.get()
     has_craftmypdf =bool(settings.craftmypdf_api_key)
     pdf_templates = fetch_craftmypdf_templates()
 
     if request.method == 'POST':
+        # Identifiers changed manually must be free
+        submitted = {kind: request.form.get(kind) for kind in identifiers.KINDS}
+        conflicts = identifiers.conflicts({kind: value for kind, value in submitted.items()
+                                           if value != getattr(product, kind)}, product_id=product.id)
+        if conflicts:
+            for kind, value in conflicts:
+                flash(f'{identifiers.LABELS[kind]} {value} is already in use', 'danger')
+            return render_template('product_edit.html',
+                                   product=product,
+                                   templates=templates,
+                                   categories=categories,
+                                   pdf_templates=pdf_templates)
+
         try:
             product.title = request.form['title']
             product.cost = float(request.form['cost']) if request.form.get('cost') else None
@@ -1023,7 +1232,7 @@ def edit_product(product_id):
 
             # Handle attributes
             if 'attributes_data' in request.form:
-                product.attributes = request.form['attributes_data']
+                product.set_attributes(request.form['attributes_data'])
             else:
                 # Fall back to processing individual inputs
                 attr_names = request.form.getlist('attr_name[]')
@@ -1037,6 +1246,8 @@ def edit_product(product_id):
                 batch_history.product_id = product.id
                 batch_history.batch_number = product.batch_number
                 batch_history.set_attributes(product.get_attributes())
+                db.session.add(batch_history)
+                db.session.flush()  # Assign an ID so PDFs and the registry can reference it
 
                 # Move generated PDFs to history
                 pdfs = models.GeneratedPDF.query.filter_by(product_id=product.id, batch_history_id=None).all()
@@ -1051,13 +1262,9 @@ def edit_product(product_id):
 
                         try:
                             if os.path.exists(old_filepath):
-                                os.makedirs(os.path.join('static', history_dir), exist_ok=True)
-                                import shutil
                                 try:
-                                    # Copy file first
-                                    shutil.copy2(old_filepath, os.path.join('static', new_filepath))
-                                    # Only remove original after successful copy
-                                    os.remove(old_filepath)
+                                    # Relink the stored file under its history name; no bytes are copied
+                                    blob_store.move(os.path.relpath(old_filepath, 'static'), new_filepath)
 
                                     # Update the PDF record
                                     pdf.batch_history_id = batch_history.id
@@ -1067,7 +1274,7 @@ def edit_product(product_id):
                                                         _external=True)
                                     db.session.flush()
                                     app.logger.info(f"Successfully moved PDF {pdf.filename} to batch history")
-                                except (shutil.Error, OSError) as e:
+                                except OSError as e:
                                     app.logger.error(f"Error moving PDF file: {str(e)}")
                                     raise
                         except Exception as e:
@@ -1092,16 +1299,12 @@ def edit_product(product_id):
                             new_coa_path = os.path.join('static', new_filepath)
 
                             if os.path.exists(old_coa_path) and old_coa_path != new_coa_path:
-                                os.makedirs(os.path.join('static', history_dir), exist_ok=True)
-                                import shutil
                                 try:
-                                    shutil.copy2(old_coa_path, new_coa_path)
-                                    # Only remove the old file after successful copy
-                                    os.remove(old_coa_path)
+                                    blob_store.move(old_coa, new_filepath)
                                     batch_history.coa_pdf = new_filepath
                                     product.coa_pdf = None
                                     app.logger.info(f"Successfully moved COA file for batch {batch_history.batch_number}")
-                                except (shutil.Error, OSError) as e:
+                                except OSError as e:
                                     app.logger.error(f"Error moving COA file: {str(e)}")
                                     raise
                         except Exception as e:
@@ -1114,9 +1317,10 @@ def edit_product(product_id):
                                                categories=categories,
                                                pdf_templates=pdf_templates)
 
-                db.session.add(batch_history)
                 product.batch_number = new_batch_number
                 product.coa_pdf = None  # Clear current COA
+                batch_registry.register_history(batch_history)
+                batch_registry.register_product(product)
             product.label_qty = int(request.form.get('label_qty', 4))
             product.template_id = request.form.get('template_id', None)
             if request.form.get('craftmypdf_template_id'):
@@ -1144,20 +1348,17 @@ def edit_product(product_id):
 
             # Handle product image with improved path handling
             if 'product_image' in request.files and request.files['product_image'].filename:
-                file = request.files['product_image']
-                if file and is_valid_image(file):
-                    if product.product_image:  # Delete old image if it exists
+                image_path = save_image(request.files['product_image'], product.id, 'product_image')
+                if image_path != app.config['DEFAULT_IMAGE']:
+                    # An image at the same path is replaced once the upload is processed
+                    if product.product_image and product.product_image != image_path:
                         try:
-                            # Use absolute path for file operations
-                            workspace_root = os.getcwd()
-                            old_image_path = os.path.join(workspace_root, 'static', product.product_image)
-                            if os.path.exists(old_image_path):
-                                os.remove(old_image_path)
-                                app.logger.info(f"Deleted old product image: {old_image_path}")
+                            blob_store.release(product.product_image)
+                            app.logger.info(f"Deleted old product image: {product.product_image}")
                         except OSError as e:
                             app.logger.error(f"Failed to delete old product image: {str(e)}")
                             pass
-                    product.product_image = save_image(file, product.id, 'product_image')
+                    product.product_image = image_path
 
             # Handle COA PDF upload with improved path handling
             if 'coa_pdf' in request.files and request.files['coa_pdf'].filename:
@@ -1169,10 +1370,8 @@ def edit_product(product_id):
                     # Delete old PDF if it exists
                     if product.coa_pdf:
                         try:
-                            old_pdf_path = os.path.join(workspace_root, 'static', product.coa_pdf)
-                            if os.path.exists(old_pdf_path):
-                                os.remove(old_pdf_path)
-                                app.logger.info(f"Deleted old PDF: {old_pdf_path}")
+                            blob_store.release(product.coa_pdf)
+                            app.logger.info(f"Deleted old PDF: {product.coa_pdf}")
                         except OSError as e:
                             app.logger.error(f"Failed to delete old PDF: {str(e)}")
                             pass
@@ -1182,15 +1381,10 @@ def edit_product(product_id):
                         batch_dir = os.path.join('pdfs', product.batch_number)
                         filepath = os.path.join(batch_dir, filename)
 
-                        # Create directory with absolute path
-                        full_dir = os.path.join(workspace_root, 'static', batch_dir)
-                        os.makedirs(full_dir, exist_ok=True)
-                        app.logger.info(f"Created or verified directory: {full_dir}")
-
                         # Save file with absolute path
                         full_filepath = os.path.join(workspace_root, 'static', filepath)
                         app.logger.info(f"Saving PDF to: {full_filepath}")
-                        coa_pdf.save(full_filepath)
+                        blob_store.store(coa_pdf.stream, filepath)
 
                         # Verify file exists after saving
                         if os.path.exists(full_filepath):
@@ -1201,22 +1395,25 @@ def edit_product(product_id):
 
             # Handle label image with improved path handling
             if 'label_image' in request.files and request.files['label_image'].filename:
-                file = request.files['label_image']
-                if file and is_valid_image(file):
-                    if product.label_image:  # Delete old image if it exists
+                image_path = save_image(request.files['label_image'], product.id, 'label_image')
+                if image_path != app.config['DEFAULT_IMAGE']:
+                    # An image at the same path is replaced once the upload is processed
+                    if product.label_image and product.label_image != image_path:
                         try:
-                            # Use absolute path for file operations
-                            workspace_root = os.getcwd()
-                            old_image_path = os.path.join(workspace_root, 'static', product.label_image)
-                            if os.path.exists(old_image_path):
-                                os.remove(old_image_path)
-                                app.logger.info(f"Deleted old label image: {old_image_path}")
+                            blob_store.release(product.label_image)
+                            app.logger.info(f"Deleted old label image: {product.label_image}")
                         except OSError as e:
                             app.logger.error(f"Failed to delete old label image: {str(e)}")
                             pass
-                    product.label_image = save_image(file, product.id, 'label_image')
+                    product.label_image = image_path
 
+            search_index.index_product(product)
             db.session.commit()
+            public_pages.invalidate_product(product.id)
+            public_pages.invalidate(product.batch_number)
+            suggestions.index_product(product)
+            catalog_stats.invalidate()
+            image_worker.submit_deferred()
 
             # If this is running in production, trigger sync to development
             is_deployment = os.environ.get("REPLIT_DEPLOYMENT", "0") == "1"
@@ -1258,8 +1455,11 @@ def edit_product(product_id):
 def inject_settings():
     """Make settings available to all templates."""
     return {
-        'settings': models.Settings.get_settings(),
+        'settings': settings_cache.get(),
         'get_safe_image_path': get_safe_image_path,
+        'image_sources': image_pipeline.image_sources,
+        'current_variants': image_pipeline.current_variants,
+        'resize_sizes': app.config['RESIZE_SIZES'],
         'is_production': os.environ.get("REPLIT_DEPLOYMENT", "0") == "1"
     }
 
@@ -1286,7 +1486,9 @@ def settings():
             # Update CraftMyPDF settings
             settings.craftmypdf_api_key = request.form.get('craftmypdf_api_key')
 
+            settings.version = (settings.version or 0) + 1
             db.session.commit()
+            settings_cache.invalidate()
             flash('Settings updated successfully!', 'success')
             return redirect(url_for('settings'))
 
@@ -1307,9 +1509,8 @@ def delete_batch_history(history_id):
         batch_dir_rel = os.path.join('pdfs', history.batch_number)
         batch_dir = os.path.join(workspace_root, 'static', batch_dir_rel)
         if os.path.exists(batch_dir):
-            import shutil
             app.logger.info(f"Deleting batch directory: {batch_dir}")
-            shutil.rmtree(batch_dir)
+            blob_store.release_tree(batch_dir_rel)
             app.logger.info(f"Successfully deleted batch directory")
 
         # Delete historical COA if exists and it's not in the batch directory
@@ -1317,7 +1518,7 @@ def delete_batch_history(history_id):
             coa_path = os.path.join(workspace_root, 'static', history.coa_pdf)
             if os.path.exists(coa_path) and history.coa_pdf.find(batch_dir_rel) == -1:
                 app.logger.info(f"Deleting historical COA file: {coa_path}")
-                os.remove(coa_path)
+                blob_store.release(history.coa_pdf)
                 app.logger.info(f"Successfully deleted COA file")
 
         # Delete PDF records
@@ -1328,8 +1529,14 @@ def delete_batch_history(history_id):
         for pdf in pdfs:
             db.session.delete(pdf)
 
+        product_id = history.product_id
+        batch_registry.unregister_history(history.id)
+        search_index.remove_history(history.id)
         db.session.delete(history)
         db.session.commit()
+        public_pages.invalidate_product(product_id)
+        suggestions.remove_history(history_id)
+        catalog_stats.invalidate()
         app.logger.info(f"Successfully deleted batch history ID {history_id}")
         return jsonify({'success': True})
     except Exception as e:
@@ -1351,7 +1558,7 @@ def delete_coa(product_id):
             file_path = os.path.join(workspace_root, 'static', product.coa_pdf)
             if os.path.exists(file_path):
                 app.logger.info(f"Deleting COA file: {file_path}")
-                os.remove(file_path)
+                blob_store.release(product.coa_pdf)
                 app.logger.info(f"Successfully deleted COA file")
             else:
                 app.logger.warning(f"COA file not found for deletion: {file_path}")
@@ -1359,6 +1566,7 @@ def delete_coa(product_id):
             # Clear database reference
             product.coa_pdf = None
             db.session.commit()
+            public_pages.invalidate_product(product.id)
             app.logger.info(f"Successfully cleared COA reference for product ID {product_id}")
         return jsonify({'success': True})
     except Exception as e:
@@ -1369,20 +1577,129 @@ def delete_coa(product_id):
         app.logger.error(f"Stack trace: {traceback.format_exc()}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/products/bulk_edit', methods=['POST'])
+@login_required
+@admin_required
+def bulk_edit_products():
+    """
+    Apply one patch to many products in a single transaction.
+
+    Body: {"product_ids": [...]} or {"filters": {"q": ..., "category": ..., "square": ...}},
+    plus {"patch": {"price", "cost", "label_qty", "category_id", "attributes", "remove_attributes"}}
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        patch = bulk_edit.parse_patch(data.get('patch'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if 'product_ids' in data:
+        try:
+            product_ids = [int(product_id) for product_id in data['product_ids']]
+        except (TypeError, ValueError):
+            return jsonify({'error': 'product_ids must be a list of integers'}), 400
+    elif isinstance(data.get('filters'), dict):
+        filters = product_listing.parse_filters(MultiDict(data['filters']))
+        query = product_listing.apply_filters(db.session.query(models.Product.id), filters)
+        product_ids = [product_id for (product_id,) in query.order_by(models.Product.id)]
+    else:
+        return jsonify({'error': 'Either product_ids or filters is required'}), 400
+
+    if not product_ids:
+        return jsonify({'error': 'No products selected'}), 400
+    limit = app.config['BULK_EDIT_LIMIT']
+    if len(product_ids) > limit:
+        return jsonify({'error': f'At most {limit} products can be edited at once'}), 400
+
+    try:
+        results = bulk_edit.apply_patch(product_ids, patch)
+        updated_ids = [result['id'] for result in results if result['status'] == 'updated']
+
+        # Attributes are part of the search document
+        if updated_ids and ('attributes' in patch or 'remove_attributes' in patch):
+            search_index.index_products(models.Product.query.populate_existing()
+                                        .filter(models.Product.id.in_(updated_ids)).all())
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error applying bulk edit to {len(product_ids)} products: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+    for product_id in updated_ids:
+        public_pages.invalidate_product(product_id)
+    catalog_stats.invalidate()
+    app.logger.info(f"Bulk edit changed {len(updated_ids)} of {len(product_ids)} products: {sorted(patch)}")
+
+    return jsonify({
+        'success': True,
+        'updated': len(updated_ids),
+        'unchanged': sum(1 for result in results if result['status'] == 'unchanged'),
+        'not_found': sum(1 for result in results if result['status'] == 'not_found'),
+        'square_synced': sum(1 for result in results if result['status'] == 'updated' and result['square_synced']),
+        'results': results,
+    })
+
+
+@app.route('/api/products/import', methods=['POST'])
+@login_required
+@admin_required
+def import_products():
+    """Import products from an uploaded CSV or NDJSON file and report per-row errors."""
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'No file uploaded'}), 400
+
+    fmt = request.form.get('format') or catalog_import.detect_format(upload.filename)
+    if fmt not in catalog_import.FORMATS:
+        return jsonify({'error': f'Unsupported format {fmt}'}), 400
+
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    try:
+        report = catalog_import.import_products(stream, fmt)
+    except UnicodeDecodeError:
+        db.session.rollback()
+        return jsonify({'error': 'File must be UTF-8 encoded'}), 400
+
+    app.logger.info(f"Imported {report.created} of {report.rows} products from {upload.filename}")
+    return jsonify({'success': report.failed == 0, **report.to_dict()})
+
+
+@app.route('/api/products/export')
+@login_required
+@admin_required
+def export_products():
+    """Stream the whole catalog with batch history and PDF URLs as CSV or NDJSON."""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in catalog_export.FORMATS:
+        return jsonify({'error': f'Unsupported format {fmt}'}), 400
+    compress = request.args.get('gzip') == '1'
+
+    filename = f"catalog-{datetime.datetime.now():%Y%m%d_%H%M%S}.{fmt}" + ('.gz' if compress else '')
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    if compress:
+        mimetype = 'application/gzip'
+
+    app.logger.info(f"Exporting catalog as {filename}")
+    response = Response(stream_with_context(catalog_export.iter_bytes(fmt, compress)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
 @app.route('/api/duplicate_product/<int:product_id>', methods=['POST'])
 @login_required
 @admin_required
 def duplicate_product(product_id):
     try:
-        from utils import generate_batch_number, generate_sku, generate_upc_barcode
         original = models.Product.query.get_or_404(product_id)
 
-        # Create new product with copied attributes
+        # Create new product with copied attributes and freshly allocated identifiers
+        new_identifiers = identifiers.allocate_product_identifiers()[0]
         new_product = models.Product()
         new_product.title = f"{original.title} - Copy"
-        new_product.batch_number = generate_batch_number()
-        new_product.sku = generate_sku()
-        new_product.barcode = generate_upc_barcode()
+        new_product.batch_number = new_identifiers['batch_number']
+        new_product.sku = new_identifiers['sku']
+        new_product.barcode = new_identifiers['barcode']
         new_product.cost = original.cost
         new_product.price = original.price
         new_product.set_attributes(original.get_attributes())
@@ -1397,32 +1714,30 @@ def duplicate_product(product_id):
 
         db.session.add(new_product)
         db.session.flush()  # Get the new product ID
+        batch_registry.register_product(new_product)
+
+        # Images and their derivatives are shared with the original through the
+        # blob store: new paths are linked to the same content, nothing is copied
+        for image_type in image_pipeline.IMAGE_TYPES:
+            source = getattr(original, image_type)
+            if not source or not os.path.exists(os.path.join('static', source)):
+                continue
+            ext = os.path.splitext(source)[1]
+            copied = os.path.join('uploads', str(new_product.id), f'{image_type}_{new_product.id}{ext}')
+            blob_store.share(source, copied)
+            setattr(new_product, image_type, copied)
+
+            # Keep the original upload too, for rebuilding derivatives later
+            upload = image_worker.original_path(original.id, image_type, ext)
+            if os.path.isfile(upload):
+                blob_store.link_file(upload, image_worker.original_path(new_product.id, image_type, ext))
+
+            variants = image_pipeline.current_variants(original, image_type)
+            if variants and all(assets.exists(variant.path) for variant in variants):
+                image_pipeline.share_variants(variants, new_product.id, image_type, copied)
+            else:
+                image_worker.defer(new_product.id, image_type, os.path.join(app.static_folder, copied))
 
-        # Create product directory after we have the ID
-        product_dir = os.path.join('static', 'uploads', str(new_product.id))
-        os.makedirs(product_dir, exist_ok=True)
-
-        # Handle product image duplication
-        if original.product_image:
-            original_path = os.path.join('static', original.product_image)
-            if os.path.exists(original_path):
-                ext = os.path.splitext(original.product_image)[1]
-                new_filename = f'product_image_{new_product.id}{ext}'
-                new_path = os.path.join(product_dir, new_filename)
-                import shutil
-                shutil.copy2(original_path, new_path)
-                new_product.product_image = os.path.join('uploads', str(new_product.id), new_filename)
-
-        # Handle label image duplication
-        if original.label_image:
-            original_path = os.path.join('static', original.label_image)
-            if os.path.exists(original_path):
-                ext = os.path.splitext(original.label_image)[1]
-                new_filename = f'label_image_{new_product.id}{ext}'
-                new_path = os.path.join(product_dir, new_filename)
-                import shutil
-                shutil.copy2(original_path, new_path)
-                new_product.label_image = os.path.join('uploads', str(new_product.id), new_filename)
         new_product.craftmypdf_template_id = original.craftmypdf_template_id
         new_product.label_qty = original.label_qty
 
@@ -1432,7 +1747,12 @@ def duplicate_product(product_id):
 
         db.session.add(new_product)
         db.session.flush()  # Flush to get the new ID without committing
+        search_index.index_product(new_product)
         db.session.commit()
+        public_pages.invalidate(new_product.batch_number)
+        suggestions.index_product(new_product)
+        catalog_stats.invalidate()
+        image_worker.submit_deferred()
 
         app.logger.info(f"Successfully duplicated product {product_id} to {new_product.id}")
         return jsonify({'success': True, 'new_product_id': new_product.id})
@@ -1451,13 +1771,6 @@ def delete_product(product_id):
         product = models.Product.query.get_or_404(product_id)
         batch_number = product.batch_number
 
-        # Use absolute paths for file operations
-        workspace_root = os.getcwd()
-        product_dir_rel = os.path.join('static', 'uploads', str(product.id))
-        pdf_dir_rel = os.path.join('static', 'pdfs', batch_number)
-        product_dir = os.path.join(workspace_root, product_dir_rel)
-        pdf_dir = os.path.join(workspace_root, pdf_dir_rel)
-
         # If product has Square ID, remove from Square first
         if product.square_catalog_id:
             from square_product_sync import delete_product_from_square
@@ -1471,35 +1784,32 @@ def delete_product(product_id):
                 product_categories.delete().where(product_categories.c.product_id == product_id)
             )
 
-            # Delete batch histories and PDFs
+            # Delete registry and search entries, batch histories and PDFs
+            batch_registry.unregister_product(product_id)
+            search_index.remove_product(product)
+            history_batches = [batch for (batch,) in db.session.query(models.BatchHistory.batch_number)
+                               .filter_by(product_id=product_id)]
             models.BatchHistory.query.filter_by(product_id=product_id).delete()
             models.GeneratedPDF.query.filter_by(product_id=product_id).delete()
 
             # Delete the product
             db.session.delete(product)
 
+            # Drop the links of its files, whether or not they are still on
+            # disk; the blobs they shared with other products stay until
+            # nothing links to them
+            app.logger.info(f"Deleting PDF and product directories of product ID {product_id}")
+            for batch in [batch_number] + history_batches:
+                blob_store.release_tree(os.path.join('pdfs', batch))
+            blob_store.release_tree(os.path.join('uploads', str(product_id)))
+
         # Commit the transaction
         db.session.commit()
-        app.logger.info(f"Successfully deleted product ID {product_id} from database")
-
-        # Clean up files after successful database operations
-        if os.path.exists(pdf_dir):
-            try:
-                import shutil
-                app.logger.info(f"Deleting PDF directory: {pdf_dir}")
-                shutil.rmtree(pdf_dir)
-                app.logger.info(f"Successfully deleted PDF directory")
-            except OSError as e:
-                app.logger.warning(f"Error deleting PDF directory: {e}")
-
-        if os.path.exists(product_dir):
-            try:
-                import shutil
-                app.logger.info(f"Deleting product directory: {product_dir}")
-                shutil.rmtree(product_dir)
-                app.logger.info(f"Successfully deleted product directory")
-            except OSError as e:
-                app.logger.warning(f"Error deleting product directory: {e}")
+        public_pages.invalidate_product(product_id)
+        suggestions.remove_product(product_id)
+        catalog_stats.invalidate()
+        image_worker.remove_originals(product_id)
+        app.logger.info(f"Successfully deleted product ID {product_id}")
 
         return jsonify({'success': True})
     except Exception as e:
@@ -1516,7 +1826,7 @@ def delete_product(product_id):
 def generate_json(product_id):
     try:
         product = models.Product.query.get_or_404(product_id)
-        settings = models.Settings.get_settings()
+        settings = settings_cache.get()
 
         # Check if we're in development mode - use production URL for generated PDFs
         is_development = os.environ.get("REPLIT_DEPLOYMENT", "0") != "1"
@@ -1573,6 +1883,7 @@ def sync_single_product(product_id):
         from square_product_sync import sync_product_to_square
         product = models.Product.query.get_or_404(product_id)
         result = sync_product_to_square(product)
+        catalog_stats.invalidate()
 
         if 'error' in result:
             return jsonify({
@@ -1596,13 +1907,17 @@ def save_image(file, product_id, image_type):
     """
     Save an uploaded image file for a product with improved cross-environment compatibility.
 
+    The upload is stored as an original and processed by image_worker after
+    the request commits; call image_worker.submit_deferred() then.
+
     Args:
         file: The uploaded file object
         product_id: The product ID to associate with this image
         image_type: Type of image (product_image, label_image, etc.)
 
     Returns:
-        The relative path to the saved image
+        The relative path the processed image will have, or the default image
+        when the upload is not an image or too large to decode
     """
     try:
         # Check if we're in deployment or development - useful for logging
@@ -1659,29 +1974,15 @@ def save_image(file, product_id, image_type):
         filepath = os.path.join(product_dir, filename)
         full_filepath = os.path.join(workspace_root, 'static', filepath)
 
-        # Process and save image
-        img = Image.open(file)
-
-        # Resize to reasonable dimensions to save space and ensure consistency
-        img.thumbnail((800, 800))  # Consistent size across environments
-
-        # Ensure the image is in a web-friendly format
-        if img.mode not in ('RGB', 'RGBA'):
-            img = img.convert('RGBA')
+        # The header alone rejects files that are not images or have too many
+        # pixels to decode; the upload stays in Werkzeug's spooled temp file
+        image_pipeline.inspect(file.stream)
 
-        # Log before saving
-        app.logger.info(f"Saving image to: {full_filepath}")
-
-        # Save with explicit format
-        format_type = 'PNG' if ext.lower() == '.png' else 'JPEG'
-        img.save(full_filepath, format=format_type, quality=85)  # Consistent quality
-
-        # Verify file exists after saving
-        if os.path.exists(full_filepath):
-            app.logger.info(f"Successfully saved image: {full_filepath} ({os.path.getsize(full_filepath)} bytes)")
-        else:
-            app.logger.error(f"Failed to save image: {full_filepath} does not exist after save operation")
-            return 'img/no-image.png'
+        # Land the upload as received; the 800px image and its derivatives are
+        # produced in the background once the product is committed
+        original_path = image_worker.store_original(file, product_id, image_type, ext)
+        image_worker.defer(product_id, image_type, original_path, filepath)
+        app.logger.info(f"Queued {original_path} for processing into {full_filepath}")
 
         # Return path relative to static directory for proper URL generation
         return filepath
@@ -1691,6 +1992,17 @@ def save_image(file, product_id, image_type):
         app.logger.error(f"Stack trace: {traceback.format_exc()}")
         return 'img/no-image.png'
 
+@app.route('/api/images/status/<int:product_id>')
+@login_required
+def image_status(product_id):
+    """Processing status of a product's uploaded images, polled while they are being processed."""
+    product = models.Product.query.get_or_404(product_id)
+    return jsonify({
+        'product_id': product.id,
+        'images': {image_type: image_worker.status(product.id, image_type, getattr(product, image_type))
+                   for image_type in image_pipeline.IMAGE_TYPES if getattr(product, image_type)},
+    })
+
 @app.route('/api/square/clear-id/<int:product_id>', methods=['POST']) 
 @login_required
 @admin_required
@@ -1700,6 +2012,7 @@ def clear_square_id(product_id):
         product = models.Product.query.get_or_404(product_id)
         product.square_catalog_id = None
         db.session.commit()
+        catalog_stats.invalidate()
         return jsonify({'success': True})
     except Exception as e:
         db.session.rollback()
@@ -1714,6 +2027,7 @@ def unsync_product(product_id):
         from square_product_sync import delete_product_from_square
         product = models.Product.query.get_or_404(product_id)
         result = delete_product_from_square(product)
+        catalog_stats.invalidate()
 
         if 'error' in result:
             return jsonify({
@@ -1769,6 +2083,7 @@ def sync_images_api():
 
         # Execute sync for specified products only - this will download from production to development
         sync_product_images(product_ids)
+        assets.refresh()
 
         return jsonify({'success': True, 'message': f'Synced images for product IDs: {product_ids}'})
 
@@ -1802,6 +2117,7 @@ def sync_pdfs_api():
 
         # Execute sync for specified products only - this will download from production to development
         sync_product_pdfs(product_ids)
+        assets.refresh()
 
         return jsonify({'success': True, 'message': f'Synced PDFs for product IDs: {product_ids}'})
 
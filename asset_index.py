@@ -0,0 +1,164 @@
+"""
+In-memory index of the files under the static folder: uploads, PDFs and the
+app's own images, CSS and JavaScript.
+
+Templates ask for every product image whether it exists so a missing one can
+fall back to the placeholder, and static URLs carry a version derived from
+each file's mtime and size. Answering both from a dict of
+path -> (mtime_ns, size) makes a product list with hundreds of cards cost no
+filesystem calls at all.
+
+The index is built by walking the roots at startup. The app's own write
+paths (uploads, image processing, PDF generation, deletes) update it as they
+go, and a background thread rescans every ``poll_interval`` seconds to pick
+up files written by other processes, such as the sync scripts.
+
+Missing files are logged once per path per ``report_interval`` rather than
+on every render.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ROOTS = ('uploads', 'pdfs', 'img', 'css', 'js')
+
+
+def normalize(path):
+    """A path relative to the static folder, with forward slashes."""
+    return os.path.normpath(path).replace(os.sep, '/').lstrip('/')
+
+
+class AssetIndex:
+    def __init__(self, roots=ROOTS, poll_interval=60, report_interval=300):
+        self.roots = roots
+        self.poll_interval = poll_interval
+        self.report_interval = report_interval
+        self.static_folder = None
+        self._lock = threading.Lock()
+        self._files = {}        # relative path -> (mtime_ns, size)
+        self._touched = None    # paths changed while a rescan is walking, else None
+        self._reported = {}     # missing path -> when it was last logged
+        self._poller = None
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.poll_interval = app.config.get('ASSET_INDEX_POLL_INTERVAL', self.poll_interval)
+        self.refresh()
+        if self.poll_interval and self._poller is None:
+            self._poller = threading.Thread(target=self._poll, name='asset-index', daemon=True)
+            self._poller.start()
+
+    def indexed(self, path):
+        """Whether ``path`` lies under one of the indexed roots."""
+        return normalize(path).split('/', 1)[0] in self.roots
+
+    def _walk(self):
+        files = {}
+        for root in self.roots:
+            stack = [os.path.join(self.static_folder, root)]
+            while stack:
+                try:
+                    entries = list(os.scandir(stack.pop()))
+                except OSError:
+                    continue
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file():
+                            stat = entry.stat()
+                            relative = os.path.relpath(entry.path, self.static_folder)
+                            files[normalize(relative)] = (stat.st_mtime_ns, stat.st_size)
+                    except OSError:
+                        continue
+        return files
+
+    def refresh(self):
+        """Rebuild the index from disk; returns the number of files found."""
+        started = time.perf_counter()
+        with self._lock:
+            self._touched = set()
+        files = self._walk()
+        with self._lock:
+            # Writes reported during the walk may have been missed by it
+            for path in self._touched:
+                self._stat_into(files, path)
+            self._files = files
+            self._touched = None
+        logger.debug(f"Indexed {len(files)} static files in {time.perf_counter() - started:.3f}s")
+        return len(files)
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing asset index: {str(e)}")
+
+    def _stat_into(self, files, path):
+        try:
+            stat = os.stat(os.path.join(self.static_folder, path))
+        except OSError:
+            files.pop(path, None)
+        else:
+            files[path] = (stat.st_mtime_ns, stat.st_size)
+
+    def add(self, path):
+        """Record a file just written (or rewritten) under the static folder."""
+        if self.static_folder is None or not path or not self.indexed(path):
+            return
+        path = normalize(path)
+        with self._lock:
+            self._stat_into(self._files, path)
+            if self._touched is not None:
+                self._touched.add(path)
+
+    def discard(self, path):
+        """Forget a file just deleted."""
+        self.add(path)
+
+    def discard_tree(self, directory):
+        """Forget every file under a directory just deleted."""
+        if not directory:
+            return
+        prefix = normalize(directory) + '/'
+        with self._lock:
+            for path in [path for path in self._files if path.startswith(prefix)]:
+                del self._files[path]
+                if self._touched is not None:
+                    self._touched.add(path)
+
+    def stat(self, path):
+        """(mtime_ns, size) of an indexed file, None if it does not exist."""
+        if self.static_folder is None or not self.indexed(path):
+            try:
+                stat = os.stat(os.path.join(self.static_folder or 'static', path))
+            except OSError:
+                return None
+            return stat.st_mtime_ns, stat.st_size
+        return self._files.get(normalize(path))
+
+    def exists(self, path):
+        return bool(path) and self.stat(path) is not None
+
+    def report_missing(self, path):
+        """Log a missing file, at most once per path every report_interval seconds."""
+        now = time.monotonic()
+        with self._lock:
+            last = self._reported.get(path)
+            if last is not None and now - last < self.report_interval:
+                return
+            if len(self._reported) > 10000:
+                self._reported.clear()
+            self._reported[path] = now
+        logger.warning(f"Static file not found: {path}")
+
+    def __len__(self):
+        return len(self._files)
+
+
+assets = AssetIndex()
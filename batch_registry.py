@@ -0,0 +1,194 @@
+"""
+Unified batch number registry.
+
+Every batch number a customer can scan - the current batch of a product or any
+batch rotated into BatchHistory - has exactly one row in ``batch_registry``.
+The public resolver answers a batch code with a single lookup on the unique
+``batch_number`` index instead of scanning ``product`` and ``batch_history``.
+"""
+import logging
+from sqlalchemy.orm import joinedload
+from models import db, Product, BatchHistory, BatchRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class BatchNumberTaken(Exception):
+    """Raised when a batch number is already the current batch of another product."""
+
+
+def _upsert(batch_number, product_id, batch_history_id=None):
+    """
+    Point a batch number at a product (and optionally a history row).
+
+    Raises:
+        BatchNumberTaken: the code is another product's current batch
+    """
+    if not batch_number:
+        return None
+
+    entry = BatchRegistry.query.filter_by(batch_number=batch_number).first()
+    if entry is None:
+        entry = BatchRegistry(batch_number=batch_number)
+        db.session.add(entry)
+    elif entry.batch_history_id is None and entry.product_id != product_id:
+        raise BatchNumberTaken(f'Batch number {batch_number} is already in use by product {entry.product_id}')
+    entry.product_id = product_id
+    entry.batch_history_id = batch_history_id
+    return entry
+
+
+def register_product(product, previous_batch_number=None):
+    """
+    Register the current batch number of a product.
+
+    The current batch of a product always wins over a historical record that
+    happens to use the same code, matching the old lookup order. Pass
+    ``previous_batch_number`` when the batch changed without being rotated
+    into history so the stale code stops resolving.
+    """
+    if previous_batch_number and previous_batch_number != product.batch_number:
+        unregister(previous_batch_number, product_id=product.id)
+    return _upsert(product.batch_number, product.id)
+
+
+def register_new_products(products):
+    """
+    Register the current batch of many newly created products with one executemany INSERT.
+
+    The caller must have checked that none of the batch numbers is registered yet.
+    """
+    entries = [{'batch_number': product.batch_number, 'product_id': product.id, 'batch_history_id': None}
+               for product in products if product.batch_number]
+    if entries:
+        db.session.execute(BatchRegistry.__table__.insert(), entries)
+    return len(entries)
+
+
+def register_history(history):
+    """Register a batch number that was rotated into BatchHistory."""
+    entry = BatchRegistry.query.filter_by(batch_number=history.batch_number).first()
+    if entry is not None and entry.batch_history_id is None and entry.product_id != history.product_id:
+        # Another product currently uses this code; its current batch takes precedence
+        return entry
+    return _upsert(history.batch_number, history.product_id, history.id)
+
+
+def _remove(query, product_id=None, deleted_product_id=None, history_id=None):
+    """
+    Delete the registry entries matched by ``query``, then hand each code back
+    to whichever remaining row still uses it: a product's current batch, else
+    the newest BatchHistory record. Not considered are the current batch of
+    ``product_id`` (being changed), every row of ``deleted_product_id`` and the
+    ``history_id`` record (being deleted).
+    """
+    batch_numbers = [batch_number for (batch_number,) in query.with_entities(BatchRegistry.batch_number)]
+    if not batch_numbers:
+        return
+    query.delete(synchronize_session=False)
+
+    products = db.session.query(Product.id, Product.batch_number).filter(Product.batch_number.in_(batch_numbers))
+    histories = (db.session.query(BatchHistory.id, BatchHistory.product_id, BatchHistory.batch_number)
+                 .filter(BatchHistory.batch_number.in_(batch_numbers)))
+    for excluded in (product_id, deleted_product_id):
+        if excluded is not None:
+            products = products.filter(Product.id != excluded)
+    if deleted_product_id is not None:
+        histories = histories.filter(BatchHistory.product_id != deleted_product_id)
+    if history_id is not None:
+        histories = histories.filter(BatchHistory.id != history_id)
+
+    entries = {}
+    for other_history_id, other_product_id, batch_number in histories.order_by(BatchHistory.created_at,
+                                                                               BatchHistory.id):
+        entries[batch_number] = {'batch_number': batch_number, 'product_id': other_product_id,
+                                 'batch_history_id': other_history_id}
+    for other_product_id, batch_number in products:
+        entries[batch_number] = {'batch_number': batch_number, 'product_id': other_product_id,
+                                 'batch_history_id': None}
+    if entries:
+        db.session.execute(BatchRegistry.__table__.insert(), list(entries.values()))
+        logger.info(f"Reassigned batch numbers {sorted(entries)} to their remaining owners")
+
+
+def unregister(batch_number, product_id=None):
+    """Remove a batch number from the registry, optionally only if owned by product_id."""
+    query = BatchRegistry.query.filter_by(batch_number=batch_number)
+    if product_id is not None:
+        query = query.filter_by(product_id=product_id)
+    _remove(query, product_id=product_id)
+
+
+def unregister_product(product_id):
+    """Remove every batch number owned by a product (current and historical)."""
+    _remove(BatchRegistry.query.filter_by(product_id=product_id), deleted_product_id=product_id)
+
+
+def unregister_history(history_id):
+    """Remove the registry entry for a BatchHistory row."""
+    _remove(BatchRegistry.query.filter_by(batch_history_id=history_id), history_id=history_id)
+
+
+def resolve(batch_number):
+    """
+    Resolve a batch number with one indexed lookup.
+
+    Returns:
+        The BatchRegistry entry with ``product`` and ``batch_history`` loaded,
+        or None if the batch number is unknown.
+    """
+    return (BatchRegistry.query
+            .options(joinedload(BatchRegistry.product), joinedload(BatchRegistry.batch_history))
+            .filter(BatchRegistry.batch_number == batch_number)
+            .first())
+
+
+def resolve_many(batch_numbers):
+    """
+    Resolve many batch numbers with a single IN query on the unique index.
+
+    Returns:
+        dict of batch_number -> BatchRegistry entry for the codes that exist,
+        with ``product`` (and its categories) and ``batch_history`` loaded
+    """
+    if not batch_numbers:
+        return {}
+    entries = (BatchRegistry.query
+               .options(joinedload(BatchRegistry.product).selectinload(Product.categories),
+                        joinedload(BatchRegistry.batch_history))
+               .filter(BatchRegistry.batch_number.in_(list(batch_numbers))))
+    return {entry.batch_number: entry for entry in entries}
+
+
+def rebuild():
+    """
+    Rebuild the registry from the product and batch_history tables.
+
+    History rows are written first so that current product batches overwrite
+    any historical record sharing the same code.
+    """
+    entries = {}
+    for history_id, product_id, batch_number in db.session.query(
+            BatchHistory.id, BatchHistory.product_id, BatchHistory.batch_number
+    ).order_by(BatchHistory.created_at):
+        if batch_number:
+            entries[batch_number] = {'batch_number': batch_number, 'product_id': product_id,
+                                     'batch_history_id': history_id}
+
+    for product_id, batch_number in db.session.query(Product.id, Product.batch_number).order_by(Product.created_at):
+        if batch_number:
+            entries[batch_number] = {'batch_number': batch_number, 'product_id': product_id,
+                                     'batch_history_id': None}
+
+    BatchRegistry.query.delete(synchronize_session=False)
+    if entries:
+        db.session.execute(BatchRegistry.__table__.insert(), list(entries.values()))
+    db.session.commit()
+    logger.info(f"Rebuilt batch registry with {len(entries)} entries")
+    return len(entries)
+
+
+def ensure_populated():
+    """Backfill the registry when it is empty but products already exist."""
+    if BatchRegistry.query.first() is None and Product.query.first() is not None:
+        rebuild()
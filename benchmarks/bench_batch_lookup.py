@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for public batch number resolution.
+
+Compares the legacy lookup (product scan, then batch_history scan) with the
+indexed batch_registry lookup at several catalog sizes. Runs against a
+throwaway SQLite database built from the application's models.
+
+Usage:
+    python benchmarks/bench_batch_lookup.py [--sizes 10000 100000 1000000] [--lookups 2000]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select
+from models import db, Product, BatchHistory, BatchRegistry
+
+
+def random_batch(rng):
+    chars = string.ascii_uppercase + string.digits
+    return ''.join(rng.choice(chars) for _ in range(8))
+
+
+def build_database(engine, size, rng):
+    """Create `size` batches: a quarter on current products, the rest in history."""
+    db.metadata.create_all(engine)
+    product_count = max(1, size // 4)
+    batches = set()
+    while len(batches) < size:
+        batches.add(random_batch(rng))
+    batches = list(batches)
+
+    products = [{'id': i + 1, 'title': f'Product {i}', 'batch_number': batches[i], 'label_qty': 4}
+                for i in range(product_count)]
+    histories = [{'id': i + 1, 'product_id': rng.randint(1, product_count),
+                  'batch_number': batches[product_count + i]}
+                 for i in range(size - product_count)]
+    registry = ([{'batch_number': p['batch_number'], 'product_id': p['id'], 'batch_history_id': None}
+                 for p in products] +
+                [{'batch_number': h['batch_number'], 'product_id': h['product_id'], 'batch_history_id': h['id']}
+                 for h in histories])
+
+    with engine.begin() as conn:
+        conn.execute(Product.__table__.insert(), products)
+        if histories:
+            conn.execute(BatchHistory.__table__.insert(), histories)
+        conn.execute(BatchRegistry.__table__.insert(), registry)
+    return batches
+
+
+def time_lookups(conn, fn, codes):
+    start = time.perf_counter()
+    for code in codes:
+        fn(conn, code)
+    return (time.perf_counter() - start) / len(codes)
+
+
+def legacy_lookup(conn, code):
+    product = conn.execute(select(Product.id).where(Product.batch_number == code).limit(1)).first()
+    if product:
+        return product
+    return conn.execute(select(BatchHistory.id, BatchHistory.product_id)
+                        .where(BatchHistory.batch_number == code).limit(1)).first()
+
+
+def registry_lookup(conn, code):
+    return conn.execute(select(BatchRegistry.product_id, BatchRegistry.batch_history_id)
+                        .where(BatchRegistry.batch_number == code)).first()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark batch number resolution')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--lookups', type=int, default=2000, help='Registry lookups per size')
+    parser.add_argument('--legacy-lookups', type=int, default=50, help='Legacy lookups per size (they are slow)')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{'batches':>10} {'legacy (us)':>14} {'registry (us)':>14} {'speedup':>9}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+            batches = build_database(engine, size, rng)
+            # Historical codes are the legacy worst case: a full miss on product first
+            history_codes = batches[max(1, size // 4):] or batches
+            with engine.connect() as conn:
+                legacy = time_lookups(conn, legacy_lookup, rng.sample(history_codes, min(args.legacy_lookups, len(history_codes))))
+                registry = time_lookups(conn, registry_lookup, [rng.choice(batches) for _ in range(args.lookups)])
+            engine.dispose()
+        print(f"{size:>10} {legacy * 1e6:>14.1f} {registry * 1e6:>14.1f} {legacy / registry:>8.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark identifier allocation against a large catalog.
+
+Fills a throwaway SQLite database with ``--products`` products (each with a
+batch number, SKU and barcode, plus their batch registry rows) and measures
+identifiers.allocate() throughput and collision retry rates for single and
+bulk allocations, next to the naive approach of checking each candidate with
+its own query.
+
+Usage:
+    python benchmarks/bench_identifiers.py [--products 1000000] [--counts 1 100 1000 10000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from models import db, Product, BatchRegistry
+import identifiers
+from utils import generate_batch_number, generate_sku, generate_upc_barcode
+
+INSERT_CHUNK = 50_000
+
+
+def unique_values(generate, count):
+    values = set()
+    while len(values) < count:
+        values.add(generate())
+    return list(values)
+
+
+def build_database(size):
+    """Insert `size` products with distinct identifiers, in chunks."""
+    db.create_all()
+    batches = unique_values(generate_batch_number, size)
+    skus = unique_values(generate_sku, size)
+    barcodes = unique_values(generate_upc_barcode, size)
+    for start in range(0, size, INSERT_CHUNK):
+        stop = min(start + INSERT_CHUNK, size)
+        db.session.execute(Product.__table__.insert(), [
+            {'id': i + 1, 'title': f'Product {i}', 'batch_number': batches[i], 'sku': skus[i],
+             'barcode': barcodes[i], 'label_qty': 4}
+            for i in range(start, stop)
+        ])
+        db.session.execute(BatchRegistry.__table__.insert(), [
+            {'batch_number': batches[i], 'product_id': i + 1, 'batch_history_id': None}
+            for i in range(start, stop)
+        ])
+    db.session.commit()
+
+
+def naive_allocate(kind, count):
+    """One SELECT per candidate, the way a per-row uniqueness check would do it."""
+    column = Product.sku if kind == 'sku' else Product.barcode if kind == 'barcode' else BatchRegistry.batch_number
+    generate = identifiers.GENERATORS[kind]
+    allocated = set()
+    while len(allocated) < count:
+        value = generate()
+        if value not in allocated and db.session.query(column).filter(column == value).first() is None:
+            allocated.add(value)
+    return allocated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark identifier allocation')
+    parser.add_argument('--products', type=int, default=1_000_000, help='Existing products in the catalog')
+    parser.add_argument('--counts', type=int, nargs='+', default=[1, 100, 1000, 10000],
+                        help='Identifiers per allocate() call')
+    parser.add_argument('--total', type=int, default=20000, help='Identifiers allocated per measurement')
+    parser.add_argument('--naive', type=int, default=2000, help='Identifiers allocated with per-value queries')
+    args = parser.parse_args()
+
+    random.seed(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        db.init_app(app)
+        with app.app_context():
+            started = time.perf_counter()
+            build_database(args.products)
+            print(f"Built {args.products} products in {time.perf_counter() - started:.1f}s\n")
+
+            print(f"{'kind':>12} {'per call':>9} {'ids/sec':>10} {'rounds':>8} {'retry %':>9}")
+            for kind in identifiers.KINDS:
+                for count in args.counts:
+                    calls = max(1, args.total // count)
+                    stats = {}
+                    started = time.perf_counter()
+                    for _ in range(calls):
+                        identifiers.allocate(kind, count, stats=stats)
+                    seconds = time.perf_counter() - started
+                    # Reservations would only grow across measurements
+                    identifiers._reserved[kind].clear()
+                    allocated = calls * count
+                    retry = 100.0 * stats['collisions'] / stats['drawn']
+                    print(f"{kind:>12} {count:>9} {allocated / seconds:>10.0f} {stats['rounds']:>8} {retry:>8.3f}%")
+
+                started = time.perf_counter()
+                naive_allocate(kind, args.naive)
+                seconds = time.perf_counter() - started
+                print(f"{kind:>12} {'naive':>9} {args.naive / seconds:>10.0f} {'':>8} {'':>9}")
+
+
+if __name__ == '__main__':
+    main()
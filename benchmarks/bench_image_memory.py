@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark peak memory and time of processing one uploaded photo.
+
+Each photo is processed in a fresh child process, once the way uploads were
+decoded before (the full bitmap, then resized) and once through
+image_pipeline.process_upload(), which decodes JPEGs at reduced scale with
+draft(). Reported is the child's peak RSS, also net of an interpreter that
+has only imported the same modules.
+
+Without ``--photo``, 24-megapixel (6000x4000) sample JPEGs are generated, one
+landscape and one portrait tagged with EXIF orientation 6, as phones save them.
+
+Usage:
+    python benchmarks/bench_image_memory.py [--photo PATH ...] [--size 6000x4000]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODES = ('baseline', 'full decode', 'reduced')
+
+
+def photo(path, width, height, orientation=None):
+    """A noisy JPEG that compresses like a photo."""
+    from PIL import Image
+    image = Image.frombytes('RGB', (width // 40, height // 40), os.urandom((width // 40) * (height // 40) * 3))
+    image = image.resize((width, height), Image.BICUBIC)
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    image.save(path, 'JPEG', quality=90, exif=exif.tobytes())
+
+
+def child(mode, path, out):
+    import image_pipeline
+    from PIL import Image
+    started = time.perf_counter()
+    if mode == 'full decode':
+        # As uploads were processed before: whole bitmap, upright copy, master copy
+        with Image.open(path) as upload:
+            image = image_pipeline.prepare(upload)
+        master = image.copy()
+        master.thumbnail(image_pipeline.MASTER_SIZE)
+        image_pipeline.atomic_save(master, os.path.join(out, 'master.jpg'), format='JPEG', quality=85)
+        image_pipeline.write_variants(image, out, 1, 'product_image')
+    elif mode == 'reduced':
+        image_pipeline.process_upload(path, out, 1, 'product_image', 'master.jpg')
+    elapsed = time.perf_counter() - started
+    peak_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{peak_kib} {elapsed}")
+
+
+def measure(mode, path):
+    with tempfile.TemporaryDirectory() as out:
+        result = subprocess.run([sys.executable, __file__, '--child', mode, path, out],
+                                capture_output=True, text=True, check=True)
+    peak_kib, elapsed = result.stdout.split()
+    return int(peak_kib) / 1024, float(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark peak memory of upload image decoding')
+    parser.add_argument('--photo', action='append', help='Photo to process (repeatable)')
+    parser.add_argument('--size', default='6000x4000', help='Size of the generated sample photos')
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as root:
+        photos = args.photo
+        if not photos:
+            width, height = (int(value) for value in args.size.split('x'))
+            photos = [os.path.join(root, 'landscape.jpg'), os.path.join(root, 'portrait.jpg')]
+            photo(photos[0], width, height)
+            photo(photos[1], width, height, orientation=6)
+
+        print(f"{'photo':>16} {'mode':>12} {'peak MiB':>9} {'net MiB':>8} {'seconds':>8}")
+        for path in photos:
+            from PIL import Image
+            with Image.open(path) as image:
+                label = f"{image.width}x{image.height}"
+            baseline, _ = measure('baseline', path)
+            for mode in MODES[1:]:
+                peak, elapsed = measure(mode, path)
+                print(f"{label:>16} {mode:>12} {peak:>9.1f} {peak - baseline:>8.1f} {elapsed:>8.2f}")
+            print(f"{label:>16} {'baseline':>12} {baseline:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark request latency and throughput for concurrent image uploads.
+
+Runs an upload route shaped like create_product's image handling in a minimal
+Flask app, once with the images processed inside the request
+(IMAGE_WORKERS=0) and once with image_worker's process pool. ``--clients``
+threads upload ``--uploads`` phone-sized JPEGs in total. Reported are the
+request latencies, the rate requests are answered at, and how long until
+every master image and derivative has been written.
+
+Usage:
+    python benchmarks/bench_image_uploads.py [--uploads 48] [--clients 8] [--workers 2] [--size 4032x3024]
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, request
+from PIL import Image
+from models import db, Product
+import image_worker
+
+
+def build_app(root, workers):
+    app = Flask(__name__, static_folder=os.path.join(root, 'static'), instance_path=os.path.join(root, 'instance'))
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(root, 'bench.db')}"
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 60}}
+    app.config['IMAGE_WORKERS'] = workers
+    db.init_app(app)
+    image_worker.init_app(app)
+
+    @app.route('/upload', methods=['POST'])
+    def upload():
+        product = Product(title='Upload')
+        db.session.add(product)
+        db.session.flush()
+        file = request.files['product_image']
+        Image.open(file)
+        path = os.path.join('uploads', str(product.id), f'product_image_{product.id}.jpg')
+        original_path = image_worker.store_original(file, product.id, 'product_image', '.jpg')
+        image_worker.defer(product.id, 'product_image', original_path, path)
+        product.product_image = path
+        db.session.commit()
+        image_worker.submit_deferred()
+        return 'ok'
+
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def photo(width, height):
+    """A noisy JPEG that compresses like a photo."""
+    image = Image.frombytes('RGB', (width // 40, height // 40), os.urandom((width // 40) * (height // 40) * 3))
+    buffer = io.BytesIO()
+    image.resize((width, height), Image.BICUBIC).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def run(app, data, uploads, clients):
+    """Return (request latencies, seconds until all answered, seconds until all processed)."""
+    def post(_):
+        client = app.test_client()
+        started = time.perf_counter()
+        response = client.post('/upload', data={'product_image': (io.BytesIO(data), 'photo.jpg')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 200, response.status_code
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        latencies = list(pool.map(post, range(uploads)))
+    answered = time.perf_counter() - started
+    image_worker.wait()
+    return latencies, answered, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark inline and background image processing')
+    parser.add_argument('--uploads', type=int, default=48, help='Images uploaded per run')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent upload requests')
+    parser.add_argument('--workers', type=int, default=2, help='Image worker processes')
+    parser.add_argument('--size', default='4032x3024', help='Uploaded image size')
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.size.split('x'))
+    data = photo(width, height)
+    print(f"{args.uploads} uploads of {width}x{height} ({len(data) // 1024} KiB), {args.clients} clients\n")
+    print(f"{'mode':>12} {'p50 ms':>8} {'p95 ms':>8} {'req/s':>7} {'processed/s':>12}")
+
+    for label, workers in (('inline', 0), (f'{args.workers} workers', args.workers)):
+        with tempfile.TemporaryDirectory() as root:
+            app = build_app(root, workers)
+            if workers:
+                # Start the pool outside the measurement
+                run(app, data, 1, 1)
+            latencies, answered, processed = run(app, data, args.uploads, args.clients)
+            latencies.sort()
+            p50 = statistics.median(latencies) * 1000
+            p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+            print(f"{label:>12} {p50:>8.0f} {p95:>8.0f} {args.uploads / answered:>7.1f} "
+                  f"{args.uploads / processed:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark worker occupancy for concurrent COA downloads.
+
+Runs the same PDF route in a minimal Flask app with direct delivery and with
+X-Accel-Redirect offload. A fixed pool of "workers" handles the requests;
+each worker must push every body chunk to a slow mobile client before it can
+take the next request, which is what ties up a sync worker when Python
+streams the file. With offload the worker returns headers only and the front
+proxy does the streaming.
+
+Usage:
+    python benchmarks/bench_pdf_delivery.py [--downloads 64] [--workers 8] [--size-kb 2048] [--client-kbps 4000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, request
+import pdf_delivery
+
+
+def build_app(pdf_root, mode):
+    app = Flask(__name__)
+    app.config['PDF_DELIVERY'] = mode
+
+    @app.route('/static/pdfs/<path:filename>')
+    def serve_pdf(filename):
+        return pdf_delivery.send_pdf(app, request, pdf_root, filename, as_attachment=True)
+
+    return app
+
+
+def run(app, downloads, workers, client_bytes_per_sec):
+    """Return (wall seconds, total worker-busy seconds, bytes sent by workers)."""
+    environ_base = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/static/pdfs/BATCH/coa.pdf',
+                    'QUERY_STRING': '', 'SERVER_NAME': 'bench', 'SERVER_PORT': '80',
+                    'wsgi.url_scheme': 'http', 'wsgi.input': None, 'wsgi.errors': sys.stderr,
+                    'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False}
+
+    def handle(_):
+        start = time.perf_counter()
+        sent = 0
+        body = app.wsgi_app(dict(environ_base), lambda status, headers, exc_info=None: None)
+        try:
+            for chunk in body:
+                sent += len(chunk)
+                # The worker is blocked until the client has received the chunk
+                time.sleep(len(chunk) / client_bytes_per_sec)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        return time.perf_counter() - start, sent
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(handle, range(downloads)))
+    wall = time.perf_counter() - start
+    return wall, sum(r[0] for r in results), sum(r[1] for r in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark PDF delivery modes')
+    parser.add_argument('--downloads', type=int, default=64, help='Concurrent COA downloads')
+    parser.add_argument('--workers', type=int, default=8, help='Application worker threads')
+    parser.add_argument('--size-kb', type=int, default=2048, help='PDF size in KiB')
+    parser.add_argument('--client-kbps', type=int, default=4000, help='Per-client bandwidth in KiB/s')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pdf_root:
+        os.makedirs(os.path.join(pdf_root, 'BATCH'))
+        with open(os.path.join(pdf_root, 'BATCH', 'coa.pdf'), 'wb') as f:
+            f.write(b'%PDF-1.4\n' + os.urandom(args.size_kb * 1024))
+
+        print(f"{args.downloads} downloads of {args.size_kb} KiB, {args.workers} workers, "
+              f"clients at {args.client_kbps} KiB/s")
+        print(f"{'mode':>18} {'wall (s)':>10} {'worker-busy (s)':>16} {'per request (ms)':>17} {'bytes via worker':>17}")
+        for mode in (pdf_delivery.MODE_DIRECT, pdf_delivery.MODE_ACCEL_REDIRECT):
+            wall, busy, sent = run(build_app(pdf_root, mode), args.downloads, args.workers,
+                                   args.client_kbps * 1024)
+            print(f"{mode:>18} {wall:>10.2f} {busy:>16.2f} {busy / args.downloads * 1000:>17.1f} {sent:>17}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,393 @@
+"""
+Content-addressed storage for uploaded and generated files.
+
+Product and label images, their derivatives, COAs and label PDFs are stored
+once per distinct content, as a blob named by its SHA-256 under
+BLOB_STORE_FOLDER. The paths the app has always used under static
+(uploads/<id>/..., pdfs/<batch>/...) remain the public URLs: each is a hard
+link to its blob, recorded as a BlobLink row, so static serving, PDF delivery
+through a front proxy, Square uploads and the sync scripts keep reading
+ordinary files.
+
+Duplicating a product or moving a batch's PDFs into its history links new
+paths to the same blobs instead of copying bytes. A Blob counts the links to
+it; a link lives as long as a Product, BatchHistory, GeneratedPDF or
+ImageVariant row references its path and is released together with that
+reference. Blobs nobody links to are removed by garbage collection, after a
+grace period so that a request which has not committed yet never loses its
+file:
+
+    python blob_store.py gc [--dry-run] [--grace SECONDS] [--prune-links]
+
+Files written before the store existed, or by the sync scripts, are plain
+files until they are first shared; all of them are brought in with:
+
+    python blob_store.py adopt
+
+Every path sharing a blob shares its inode, so a linked file must be
+replaced (store(), or a temporary file renamed into place as
+image_pipeline.atomic_save does), never rewritten in place. Where hard links
+are unavailable (static and the store on different file systems) linking
+falls back to copying, which keeps the bookkeeping but not the space saving.
+"""
+import argparse
+import datetime
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from flask import current_app
+from sqlalchemy import func, select, update
+from models import db, Blob, BlobLink, Product, BatchHistory, GeneratedPDF, ImageVariant
+from asset_index import assets, normalize
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+_copy_warned = False
+
+
+def init_app(app):
+    app.config.setdefault('BLOB_STORE_FOLDER', os.path.join(app.instance_path, 'blobs'))
+    app.config.setdefault('BLOB_GC_GRACE', 24 * 3600)
+
+
+def blob_file(sha256):
+    """Absolute path of a blob's content."""
+    return os.path.join(current_app.config['BLOB_STORE_FOLDER'], sha256[:2], sha256)
+
+
+def _static(path):
+    return os.path.join(current_app.static_folder, path)
+
+
+def pdf_path(filename, batch_number):
+    """Path under static of a GeneratedPDF, stored as a bare name (current batch) or a full path (history)."""
+    return normalize(filename if '/' in filename else os.path.join('pdfs', batch_number, filename))
+
+
+def link_file(source, target):
+    """
+    Hard link ``source`` at ``target``, atomically replacing whatever is
+    there; copies where hard links are not supported.
+    """
+    global _copy_warned
+    directory = os.path.dirname(target)
+    os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(directory, f'.tmp-{os.getpid()}-{time.monotonic_ns()}')
+    try:
+        os.link(source, temp_path)
+    except FileNotFoundError:
+        raise
+    except OSError as e:
+        if not _copy_warned:
+            _copy_warned = True
+            logger.warning(f"Hard links unavailable ({e}); blob store files will be copied")
+        shutil.copyfile(source, temp_path)
+    try:
+        os.replace(temp_path, target)
+    finally:
+        # rename() is a no-op when both names are already links to the same file
+        if os.path.lexists(temp_path):
+            os.unlink(temp_path)
+
+
+def _same_file(a, b):
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+def _blob(sha256, size):
+    blob = db.session.get(Blob, sha256)
+    if blob is None:
+        blob = Blob(sha256=sha256, size=size, ref_count=0)
+        db.session.add(blob)
+        db.session.flush()
+    return blob
+
+
+def _adjust(sha256, delta):
+    db.session.execute(update(Blob).where(Blob.sha256 == sha256)
+                       .values(ref_count=Blob.ref_count + delta, updated_at=datetime.datetime.utcnow()))
+
+
+def _link(blob, path):
+    """Point ``path`` at ``blob``, on disk and in the link table."""
+    link = BlobLink.query.filter_by(path=path).first()
+    if link is None:
+        db.session.add(BlobLink(path=path, sha256=blob.sha256))
+        _adjust(blob.sha256, 1)
+    elif link.sha256 != blob.sha256:
+        _adjust(link.sha256, -1)
+        link.sha256 = blob.sha256
+        _adjust(blob.sha256, 1)
+    full_path = _static(path)
+    if not _same_file(blob_file(blob.sha256), full_path):
+        link_file(blob_file(blob.sha256), full_path)
+    assets.add(path)
+
+
+def _digest(f):
+    digest = hashlib.sha256()
+    size = 0
+    while chunk := f.read(CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def store(stream, path):
+    """
+    Write the content of a file-like object to ``path`` (relative to static)
+    through the store. The caller commits.
+
+    Returns:
+        the Blob
+    """
+    folder = current_app.config['BLOB_STORE_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.tmp-')
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while chunk := stream.read(CHUNK_SIZE):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        sha256 = digest.hexdigest()
+        if not os.path.exists(blob_file(sha256)):
+            os.makedirs(os.path.dirname(blob_file(sha256)), exist_ok=True)
+            os.replace(temp_path, blob_file(sha256))
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+    blob = _blob(sha256, size)
+    _link(blob, normalize(path))
+    return blob
+
+
+def adopt(path):
+    """
+    Bring a file already under static into the store: one written by image
+    processing, by the sync scripts, or before the store existed. A file
+    whose content is already stored is replaced by a link to that blob.
+    The caller commits.
+
+    Returns:
+        the Blob
+    """
+    path = normalize(path)
+    full_path = _static(path)
+    with open(full_path, 'rb') as f:
+        sha256, size = _digest(f)
+    if not os.path.exists(blob_file(sha256)):
+        link_file(full_path, blob_file(sha256))
+    blob = _blob(sha256, size)
+    _link(blob, path)
+    return blob
+
+
+def share(source_path, path):
+    """
+    Make ``path`` (relative to static) another public path of the content at
+    ``source_path``, without copying it. The caller commits.
+
+    Returns:
+        the Blob
+    """
+    source_path = normalize(source_path)
+    link = BlobLink.query.filter_by(path=source_path).first()
+    if link is not None and _same_file(blob_file(link.sha256), _static(source_path)):
+        blob = db.session.get(Blob, link.sha256)
+    else:
+        # Not linked yet, or replaced on disk since: hash what is there now
+        blob = adopt(source_path)
+    _link(blob, normalize(path))
+    return blob
+
+
+def move(source_path, path):
+    """Give the content at ``source_path`` a new public path and release the old one. The caller commits."""
+    blob = share(source_path, path)
+    if normalize(source_path) != normalize(path):
+        release(source_path)
+    return blob
+
+
+def release(path):
+    """Delete a file under static and drop its link, if any. The caller commits."""
+    if not path:
+        return
+    path = normalize(path)
+    link = BlobLink.query.filter_by(path=path).first()
+    if link is not None:
+        _adjust(link.sha256, -1)
+        db.session.delete(link)
+    try:
+        os.remove(_static(path))
+    except FileNotFoundError:
+        pass
+    assets.discard(path)
+
+
+def release_tree(directory):
+    """Delete a directory under static and drop the links of every file in it. The caller commits."""
+    directory = normalize(directory)
+    for link in BlobLink.query.filter(BlobLink.path.startswith(directory + '/', autoescape=True)):
+        _adjust(link.sha256, -1)
+        db.session.delete(link)
+    shutil.rmtree(_static(directory), ignore_errors=True)
+    assets.discard_tree(directory)
+
+
+def referenced_paths():
+    """Every path under static that a Product, BatchHistory, GeneratedPDF or ImageVariant row refers to."""
+    paths = set()
+    for column in (Product.product_image, Product.label_image, Product.coa_pdf,
+                   BatchHistory.coa_pdf, ImageVariant.path):
+        paths.update(normalize(path) for (path,) in db.session.query(column).filter(column.isnot(None)))
+    query = db.session.query(GeneratedPDF.filename, Product.batch_number).join(Product, GeneratedPDF.product_id == Product.id)
+    paths.update(pdf_path(filename, batch_number) for filename, batch_number in query if filename)
+    return paths
+
+
+def adopt_all(batch_size=200):
+    """
+    Adopt every referenced file that exists but is not linked to its blob.
+
+    Returns:
+        (files adopted, bytes stored once instead of per file)
+    """
+    adopted = 0
+    for count, path in enumerate(sorted(referenced_paths()), 1):
+        if not os.path.isfile(_static(path)):
+            continue
+        link = BlobLink.query.filter_by(path=path).first()
+        if link is None or not _same_file(blob_file(link.sha256), _static(path)):
+            adopt(path)
+            adopted += 1
+        if count % batch_size == 0:
+            db.session.commit()
+    db.session.commit()
+    return adopted, saved_bytes()
+
+
+def saved_bytes():
+    """Bytes the store saves over keeping one file per link."""
+    value = db.session.query(func.sum(Blob.size * (Blob.ref_count - 1))).filter(Blob.ref_count > 1).scalar()
+    return int(value or 0)
+
+
+def collect(grace=None, dry_run=False, prune_links=False):
+    """
+    Garbage-collect the store.
+
+    Reference counts are recomputed from the link table, links whose path no
+    row refers to any more are reported (and released with ``prune_links``),
+    and blobs without links that have not changed for ``grace`` seconds are
+    deleted, as are files in the store with no Blob row (left by requests
+    that rolled back).
+
+    Returns:
+        dict with the number of blobs and bytes freed, links pruned and stray files removed
+    """
+    if grace is None:
+        grace = current_app.config['BLOB_GC_GRACE']
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=grace)
+    result = {'blobs': 0, 'bytes': 0, 'links': 0, 'stray': 0}
+
+    counts = (select(func.count(BlobLink.id)).where(BlobLink.sha256 == Blob.sha256)
+              .correlate(Blob).scalar_subquery())
+    db.session.execute(update(Blob).where(Blob.ref_count != counts).values(ref_count=counts),
+                       execution_options={'synchronize_session': False})
+
+    referenced = referenced_paths()
+    for link in BlobLink.query.order_by(BlobLink.path):
+        if link.path not in referenced:
+            result['links'] += 1
+            logger.info(f"{'Pruning' if prune_links else 'Unreferenced'} link {link.path}")
+            if prune_links and not dry_run:
+                release(link.path)
+
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+
+    unused = db.session.query(Blob.sha256, Blob.size).filter(Blob.ref_count == 0, Blob.updated_at < cutoff).all()
+    for sha256, size in unused:
+        if not dry_run:
+            # Only if no request linked it in the meantime
+            deleted = db.session.execute(
+                Blob.__table__.delete().where(Blob.sha256 == sha256, Blob.ref_count == 0)).rowcount
+            db.session.commit()
+            if not deleted:
+                continue
+            try:
+                os.remove(blob_file(sha256))
+            except FileNotFoundError:
+                pass
+        result['blobs'] += 1
+        result['bytes'] += size
+
+    known = {sha256 for (sha256,) in db.session.query(Blob.sha256)}
+    folder = current_app.config['BLOB_STORE_FOLDER']
+    for root, _dirs, files in os.walk(folder):
+        for name in files:
+            full_path = os.path.join(root, name)
+            if name in known:
+                continue
+            try:
+                if os.path.getmtime(full_path) >= time.time() - grace:
+                    continue
+                if not dry_run:
+                    os.remove(full_path)
+            except OSError:
+                continue
+            result['stray'] += 1
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the content-addressed file store')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('adopt', help='Move referenced files that predate the store into it')
+    gc = commands.add_parser('gc', help='Delete blobs nothing links to')
+    gc.add_argument('--grace', type=int, help='Keep unlinked blobs changed within this many seconds')
+    gc.add_argument('--dry-run', action='store_true', help='Report what would be deleted')
+    gc.add_argument('--prune-links', action='store_true',
+                    help='Also release links to paths no product, batch history or PDF refers to')
+    commands.add_parser('stats', help='Report the size of the store')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from app import app
+
+    started = time.perf_counter()
+    with app.app_context():
+        if args.command == 'adopt':
+            adopted, saved = adopt_all()
+            logger.info(f"Adopted {adopted} files in {time.perf_counter() - started:.2f}s; "
+                        f"{saved} bytes stored once instead of per path")
+        elif args.command == 'gc':
+            result = collect(args.grace, dry_run=args.dry_run, prune_links=args.prune_links)
+            logger.info(f"{'Would free' if args.dry_run else 'Freed'} {result['blobs']} blobs "
+                        f"({result['bytes']} bytes), {result['links']} unreferenced links, "
+                        f"{result['stray']} stray files in {time.perf_counter() - started:.2f}s")
+        else:
+            blobs, size = db.session.query(func.count(Blob.sha256), func.sum(Blob.size)).one()
+            links = db.session.query(func.count(BlobLink.id)).scalar()
+            logger.info(f"{blobs} blobs ({size or 0} bytes) behind {links} paths; "
+                        f"{saved_bytes()} bytes saved by sharing")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
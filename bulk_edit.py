@@ -0,0 +1,168 @@
+"""
+Set-based bulk edits for the admin product list.
+
+A patch is applied to a whole set of products inside the caller's
+transaction: scalar fields with one ``UPDATE ... WHERE id IN (...)`` per
+chunk, the category with one DELETE and one executemany INSERT on
+``product_categories``, and attribute merges with a single executemany
+UPDATE of the changed rows only (plus their product_attribute rows).
+"""
+from sqlalchemy import bindparam, update
+from models import db, Product, Category, JSONType, product_categories
+import product_attributes
+
+CHUNK_SIZE = 500
+
+SCALAR_FIELDS = ('price', 'cost', 'label_qty')
+
+
+def _chunks(values, size=CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def parse_patch(data):
+    """
+    Validate a patch from the bulk edit request.
+
+    Accepted keys: price, cost (number or null), label_qty (positive integer),
+    category_id (id or null to clear), attributes (dict of name -> value to set)
+    and remove_attributes (list of names).
+
+    Raises:
+        ValueError: if the patch is empty or a value is invalid
+    """
+    if not isinstance(data, dict):
+        raise ValueError('patch must be an object')
+
+    patch = {}
+    for field in ('price', 'cost'):
+        if field in data:
+            value = data[field]
+            if value in (None, ''):
+                patch[field] = None
+            else:
+                try:
+                    patch[field] = float(value)
+                except (TypeError, ValueError):
+                    raise ValueError(f'{field} must be a number')
+                if patch[field] < 0:
+                    raise ValueError(f'{field} cannot be negative')
+
+    if 'label_qty' in data:
+        try:
+            patch['label_qty'] = int(data['label_qty'])
+        except (TypeError, ValueError):
+            raise ValueError('label_qty must be an integer')
+        if patch['label_qty'] < 1:
+            raise ValueError('label_qty must be at least 1')
+
+    if 'category_id' in data:
+        category_id = data['category_id']
+        if category_id in (None, ''):
+            patch['category_id'] = None
+        else:
+            try:
+                category_id = int(category_id)
+            except (TypeError, ValueError):
+                raise ValueError('category_id must be an integer')
+            if db.session.get(Category, category_id) is None:
+                raise ValueError(f'Category {category_id} does not exist')
+            patch['category_id'] = category_id
+
+    attributes = data.get('attributes') or {}
+    remove_attributes = data.get('remove_attributes') or []
+    if not isinstance(attributes, dict) or not isinstance(remove_attributes, list):
+        raise ValueError('attributes must be an object and remove_attributes a list')
+    attributes = {str(name).strip(): '' if value is None else str(value)
+                  for name, value in attributes.items() if str(name).strip()}
+    remove_attributes = [str(name).strip() for name in remove_attributes if str(name).strip()]
+    if attributes:
+        patch['attributes'] = attributes
+    if remove_attributes:
+        patch['remove_attributes'] = remove_attributes
+
+    if not patch:
+        raise ValueError('Nothing to change')
+    return patch
+
+
+def apply_patch(product_ids, patch):
+    """
+    Apply a validated patch to the given products without committing.
+
+    Returns:
+        list of per-row results, in product_ids order:
+        {'id', 'status' ('updated', 'unchanged' or 'not_found'), 'changed' (field names),
+         'square_synced'}
+    """
+    product_ids = list(dict.fromkeys(product_ids))
+    rows = {}
+    for chunk in _chunks(product_ids):
+        for row in db.session.query(Product.id, Product.attributes, Product.square_catalog_id,
+                                    Product.price, Product.cost, Product.label_qty).filter(Product.id.in_(chunk)):
+            rows[row.id] = row
+    existing = [product_id for product_id in product_ids if product_id in rows]
+    changed = {product_id: [] for product_id in existing}
+
+    # Scalar columns: one UPDATE per chunk for the whole set
+    values = {field: patch[field] for field in SCALAR_FIELDS if field in patch}
+    if values:
+        for chunk in _chunks(existing):
+            db.session.execute(update(Product).where(Product.id.in_(chunk)).values(**values)
+                               .execution_options(synchronize_session=False))
+        for product_id in existing:
+            changed[product_id].extend(field for field, value in values.items()
+                                       if getattr(rows[product_id], field) != value)
+
+    # Category: replace the association rows in bulk
+    if 'category_id' in patch:
+        current = {}
+        for chunk in _chunks(existing):
+            for product_id, category_id in db.session.query(
+                    product_categories.c.product_id, product_categories.c.category_id
+            ).filter(product_categories.c.product_id.in_(chunk)):
+                current.setdefault(product_id, set()).add(category_id)
+            db.session.execute(product_categories.delete().where(product_categories.c.product_id.in_(chunk)))
+        category_id = patch['category_id']
+        if category_id is not None:
+            db.session.execute(product_categories.insert(),
+                               [{'product_id': product_id, 'category_id': category_id} for product_id in existing])
+        wanted = {category_id} if category_id is not None else set()
+        for product_id in existing:
+            if current.get(product_id, set()) != wanted:
+                changed[product_id].append('category')
+
+    # Attributes: merge the dicts in Python and write only the rows that changed
+    if 'attributes' in patch or 'remove_attributes' in patch:
+        params = []
+        for product_id in existing:
+            attributes = rows[product_id].attributes
+            if not isinstance(attributes, dict):
+                attributes = {}
+            merged = dict(attributes)
+            merged.update(patch.get('attributes', {}))
+            for name in patch.get('remove_attributes', []):
+                merged.pop(name, None)
+            if merged != attributes:
+                params.append({'b_id': product_id, 'b_attributes': merged})
+                changed[product_id].append('attributes')
+        if params:
+            statement = (update(Product.__table__)
+                         .where(Product.__table__.c.id == bindparam('b_id'))
+                         .values(attributes=bindparam('b_attributes', type_=JSONType())))
+            db.session.execute(statement, params)
+            product_attributes.replace_rows({param['b_id']: param['b_attributes'] for param in params})
+
+    results = []
+    for product_id in product_ids:
+        if product_id not in rows:
+            results.append({'id': product_id, 'status': 'not_found', 'changed': [], 'square_synced': False})
+            continue
+        results.append({
+            'id': product_id,
+            'status': 'updated' if changed[product_id] else 'unchanged',
+            'changed': changed[product_id],
+            'square_synced': rows[product_id].square_catalog_id is not None,
+        })
+    return results
@@ -0,0 +1,115 @@
+"""
+HTTP caching policy.
+
+Static assets (CSS/JS, product images under static/uploads and PDFs under
+static/pdfs) are linked with a ``v`` query string holding a hash of the file
+contents, added automatically to every ``url_for('static', ...)``,
+``url_for('serve_pdf', ...)`` and ``url_for('resized_image', ...)`` call (the
+last hashing the source image). A request carrying the current hash is
+served as immutable for a year; any other static request is cacheable but
+must be revalidated with the ETag/Last-Modified validators set by send_file.
+
+The mtime and size that decide when a hash is recomputed come from the
+asset index rather than a stat() per URL.
+
+Public pages that set their own ``public`` Cache-Control are left alone and
+every other response (admin HTML, APIs) is sent with ``no-store``.
+"""
+import hashlib
+import os
+import threading
+from asset_index import assets
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+VERSION_PARAM = 'v'
+
+# Endpoint -> directory (relative to the static folder) its filename lives in
+STATIC_ENDPOINTS = {
+    'static': '',
+    'serve_pdf': 'pdfs',
+    'resized_image': '',
+}
+
+_lock = threading.Lock()
+_versions = {}  # path -> (mtime_ns, size, digest)
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def asset_version(static_folder, filename):
+    """Return a short content hash for a static file, or None if it does not exist."""
+    if not filename:
+        return None
+    path = os.path.join(static_folder, filename)
+    stat = _stat(static_folder, filename)
+    if stat is None:
+        return None
+
+    cached = _versions.get(path)
+    if cached and cached[:2] == stat:
+        return cached[2]
+
+    try:
+        digest = _file_digest(path)
+    except OSError:
+        return None
+    with _lock:
+        _versions[path] = stat + (digest,)
+    return digest
+
+
+def _stat(static_folder, filename):
+    # Indexed files are answered without a syscall
+    if assets.static_folder == static_folder and assets.indexed(filename):
+        return assets.stat(filename)
+    try:
+        stat = os.stat(os.path.join(static_folder, filename))
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _static_filename(endpoint, filename):
+    directory = STATIC_ENDPOINTS[endpoint]
+    return os.path.join(directory, filename) if directory else filename
+
+
+def init_app(app):
+    @app.url_defaults
+    def add_asset_version(endpoint, values):
+        """Append the content hash to static asset URLs."""
+        if endpoint not in STATIC_ENDPOINTS or VERSION_PARAM in values:
+            return
+        filename = values.get('filename')
+        version = asset_version(app.static_folder, _static_filename(endpoint, filename)) if filename else None
+        if version:
+            values[VERSION_PARAM] = version
+
+
+def apply(app, request, response):
+    """Set Cache-Control for a response according to the route that produced it."""
+    if request.endpoint in STATIC_ENDPOINTS and response.status_code in (200, 206, 304):
+        filename = (request.view_args or {}).get('filename')
+        requested = request.args.get(VERSION_PARAM)
+        current = asset_version(app.static_folder, _static_filename(request.endpoint, filename)) if filename else None
+        if requested and requested == current:
+            # The URL changes whenever the content does
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            # Unversioned or stale URL: cacheable, but revalidate with ETag/Last-Modified
+            response.headers['Cache-Control'] = 'public, no-cache'
+        return response
+
+    # Public pages opt into shared caching with validators; everything else stays uncached
+    if not response.cache_control.public:
+        response.headers['Cache-Control'] = 'no-store'
+    return response
@@ -0,0 +1,172 @@
+"""
+Streaming catalog export to CSV or NDJSON.
+
+Products are read with ``yield_per`` (a server-side cursor on PostgreSQL)
+and each chunk gets its batch history and PDFs from two queries through
+product_views, so memory stays bounded by the chunk size however large the
+catalog is. Output is produced incrementally and can be gzip-compressed on
+the fly, both for the HTTP endpoint and the CLI.
+
+Usage:
+    python catalog_export.py catalog.ndjson.gz [--format csv|ndjson] [--base-url https://viewmycoa.com]
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import sys
+import time
+import zlib
+from flask import url_for
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from models import db, Product
+import product_views
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'ndjson')
+DEFAULT_CHUNK_SIZE = 500
+
+CSV_COLUMNS = ['id', 'title', 'batch_number', 'sku', 'barcode', 'price', 'cost', 'label_qty', 'category',
+               'categories', 'attributes', 'square_catalog_id', 'created_at', 'coa_url', 'label_urls', 'history']
+
+
+def _pdf_url(batch_number, path, **kwargs):
+    if not batch_number or not path:
+        return None
+    # v=None skips content hashing of every PDF; exported links stay stable
+    return url_for('serve_pdf', filename=batch_number + '/' + path.split('/')[-1], v=None, _external=True, **kwargs)
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def product_record(product, view):
+    """Export record for a product with its batch history and PDF URLs."""
+    return {
+        'id': product.id,
+        'title': product.title,
+        'batch_number': product.batch_number,
+        'sku': product.sku,
+        'barcode': product.barcode,
+        'price': product.price,
+        'cost': product.cost,
+        'label_qty': product.label_qty,
+        'categories': [category.name for category in product.categories],
+        'attributes': product.get_attributes(),
+        'square_catalog_id': product.square_catalog_id,
+        'created_at': _isoformat(product.created_at),
+        'coa_url': _pdf_url(product.batch_number, product.coa_pdf, download=1),
+        'label_urls': [_pdf_url(product.batch_number, pdf.filename) for pdf in view.current_labels],
+        'history': [{
+            'batch_number': history.batch_number,
+            'created_at': _isoformat(history.created_at),
+            'coa_url': _pdf_url(history.batch_number, history.coa_pdf, download=1),
+            'label_urls': [_pdf_url(history.batch_number, pdf.filename)
+                           for pdf in view.history_labels.get(history.id, [])],
+        } for history in view.histories],
+    }
+
+
+def iter_records(chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield export records for every product, ordered by id, one chunk in memory at a time."""
+    statement = (select(Product)
+                 .options(selectinload(Product.categories))
+                 .order_by(Product.id)
+                 .execution_options(yield_per=chunk_size))
+    for products in db.session.execute(statement).scalars().partitions():
+        views = product_views.build_product_views(products)
+        for product in products:
+            yield product_record(product, views[product.id])
+        # Unmodified objects are weakly referenced by the session, so the
+        # finished chunk is released once these names are rebound
+        del products, views
+
+
+def _csv_row(record):
+    return [
+        record['id'], record['title'], record['batch_number'], record['sku'], record['barcode'],
+        record['price'], record['cost'], record['label_qty'],
+        record['categories'][0] if record['categories'] else '',
+        ';'.join(record['categories']),
+        json.dumps(record['attributes']),
+        record['square_catalog_id'], record['created_at'], record['coa_url'],
+        ' '.join(record['label_urls']),
+        json.dumps(record['history']),
+    ]
+
+
+def iter_lines(fmt='ndjson', chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the export as text, a few rows at a time."""
+    if fmt not in FORMATS:
+        raise ValueError(f'Unsupported format {fmt}')
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(CSV_COLUMNS)
+
+    for count, record in enumerate(iter_records(chunk_size), start=1):
+        if writer:
+            writer.writerow(_csv_row(record))
+        else:
+            buffer.write(json.dumps(record))
+            buffer.write('\n')
+        if count % 100 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_bytes(fmt='ndjson', compress=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the export as UTF-8 bytes, optionally as a gzip stream."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    for text in iter_lines(fmt, chunk_size):
+        data = text.encode('utf-8')
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the product catalog as CSV or NDJSON')
+    parser.add_argument('path', help="Output file; a .gz suffix enables gzip, '-' writes to stdout")
+    parser.add_argument('--format', choices=FORMATS, help='Output format (default: from the file name, else ndjson)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Products per database round trip')
+    parser.add_argument('--base-url', default='https://viewmycoa.com', help='Host used in exported PDF URLs')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from app import app
+
+    name = args.path[:-3] if args.path.endswith('.gz') else args.path
+    fmt = args.format or ('csv' if name.endswith('.csv') else 'ndjson')
+    compress = args.path.endswith('.gz')
+
+    started = time.perf_counter()
+    written = 0
+    output = sys.stdout.buffer if args.path == '-' else open(args.path, 'wb')
+    try:
+        with app.test_request_context(base_url=args.base_url):
+            for data in iter_bytes(fmt, compress, args.chunk_size):
+                output.write(data)
+                written += len(data)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+
+    seconds = time.perf_counter() - started
+    logger.info(f"Exported catalog to {args.path}: {written} bytes in {seconds:.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,352 @@
+"""
+Streaming product import from CSV or NDJSON.
+
+Rows are read one at a time from the uploaded file and processed in chunks:
+each chunk is validated, gets its batch numbers, SKUs and UPCs checked or
+allocated (see identifiers) with one IN query per identifier, is inserted
+with a single flush, has its categories and attribute index rows written
+with one executemany INSERT each and is committed.
+Memory use is bounded by the chunk size, not the file size.
+
+Columns (CSV header or NDJSON keys):
+    title (required), batch_number, sku, barcode, price, cost, label_qty,
+    category (name), attributes (JSON object) and, in CSV, one
+    ``attr:<Name>`` column per attribute.
+
+Usage:
+    python catalog_import.py products.csv [--format csv|ndjson] [--chunk-size 500]
+"""
+import argparse
+import csv
+import json
+import logging
+import sys
+import time
+from models import db, Product, Category, product_categories
+import batch_registry
+import catalog_stats
+import identifiers
+import product_attributes
+import search_index
+from suggest_index import suggestions
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'ndjson')
+DEFAULT_CHUNK_SIZE = 500
+ATTRIBUTE_PREFIX = 'attr:'
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.errors = []    # (line, message)
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def error(self, line, message):
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    @property
+    def failed(self):
+        return self.rows - self.created
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def to_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'failed': self.failed,
+            'seconds': round(self.seconds, 3),
+            'rows_per_sec': round(self.rows_per_sec, 1),
+            'errors': [{'line': line, 'error': message} for line, message in self.errors],
+        }
+
+
+def detect_format(filename, default='csv'):
+    if filename and filename.lower().endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    if filename and filename.lower().endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def iter_rows(stream, fmt):
+    """
+    Yield (line_number, row) from a text stream.
+
+    A row is a dict, or a ValueError describing why the line could not be read.
+    """
+    if fmt == 'ndjson':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, ValueError(f'Invalid JSON: {e.msg}')
+                continue
+            yield line_number, row if isinstance(row, dict) else ValueError('Row must be a JSON object')
+    else:
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # Header is line 1
+            yield reader.line_num, row
+
+
+def _text(value, max_length=None, field=None):
+    value = '' if value is None else str(value).strip()
+    if max_length and len(value) > max_length:
+        raise ValueError(f'{field} is longer than {max_length} characters')
+    return value or None
+
+
+def _number(value, field):
+    if value in (None, ''):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} must be a number')
+    if number < 0:
+        raise ValueError(f'{field} cannot be negative')
+    return number
+
+
+def validate_row(row):
+    """
+    Turn a raw row into clean product fields.
+
+    Raises:
+        ValueError: if the row is invalid
+    """
+    title = _text(row.get('title'), 200, 'title')
+    if not title:
+        raise ValueError('title is required')
+
+    attributes = row.get('attributes') or {}
+    if isinstance(attributes, str):
+        try:
+            attributes = json.loads(attributes)
+        except json.JSONDecodeError:
+            raise ValueError('attributes must be a JSON object')
+    if not isinstance(attributes, dict):
+        raise ValueError('attributes must be a JSON object')
+    attributes = {str(name): '' if value is None else value for name, value in attributes.items()}
+    for column, value in row.items():
+        if column and column.startswith(ATTRIBUTE_PREFIX) and value not in (None, ''):
+            attributes[column[len(ATTRIBUTE_PREFIX):].strip()] = value
+
+    label_qty = row.get('label_qty')
+    if label_qty in (None, ''):
+        label_qty = 4
+    else:
+        try:
+            label_qty = int(label_qty)
+        except (TypeError, ValueError):
+            raise ValueError('label_qty must be an integer')
+        if label_qty < 1:
+            raise ValueError('label_qty must be at least 1')
+
+    barcode = _text(row.get('barcode'), 12, 'barcode')
+    if barcode and not barcode.isdigit():
+        raise ValueError('barcode must be digits only')
+
+    return {
+        'title': title,
+        'batch_number': _text(row.get('batch_number'), 8, 'batch_number'),
+        'sku': _text(row.get('sku'), 8, 'sku'),
+        'barcode': barcode,
+        'price': _number(row.get('price'), 'price'),
+        'cost': _number(row.get('cost'), 'cost'),
+        'label_qty': label_qty,
+        'category': _text(row.get('category'), 100, 'category'),
+        'attributes': attributes,
+    }
+
+
+class _Importer:
+    def __init__(self, report, create_categories):
+        self.report = report
+        self.create_categories = create_categories
+        self.reload_categories()
+        # Identifiers used earlier in this job, so rows in different chunks cannot clash
+        self.seen = {'batch_number': set(), 'sku': set(), 'barcode': set()}
+        # Rows of the chunk being processed that have not been rejected
+        self.pending = []
+
+    def reload_categories(self):
+        self.categories = {name.lower(): category_id
+                           for category_id, name in db.session.query(Category.id, Category.name)}
+
+    def _assign_identifiers(self, rows):
+        for field in identifiers.KINDS:
+            seen = self.seen[field]
+
+            # Values given in the file must be free
+            given = {clean[field] for _, clean in rows if clean[field]}
+            taken = identifiers.taken(field, given) | (given & seen)
+            accepted = []
+            for line, clean in rows:
+                value = clean[field]
+                if value and (value in taken or value in seen):
+                    self.report.error(line, f'{field} {value} already exists')
+                    continue
+                if value:
+                    seen.add(value)
+                accepted.append((line, clean))
+            rows = self.pending = accepted
+
+            # Generated values come from the allocator in one bulk call
+            missing = [clean for _, clean in rows if not clean[field]]
+            if missing:
+                values = identifiers.allocate(field, len(missing), exclude=seen)
+                for clean, value in zip(missing, values):
+                    clean[field] = value
+                seen.update(values)
+        return rows
+
+    def _category_id(self, name):
+        category_id = self.categories.get(name.lower())
+        if category_id is None and self.create_categories:
+            category = Category(name=name)
+            db.session.add(category)
+            db.session.flush()
+            category_id = self.categories[name.lower()] = category.id
+        return category_id
+
+    def process(self, chunk):
+        rows = self.pending = []
+        for line, clean in chunk:
+            if clean['category'] and self.categories.get(clean['category'].lower()) is None \
+                    and not self.create_categories:
+                self.report.error(line, f"Unknown category {clean['category']}")
+                continue
+            rows.append((line, clean))
+        rows = self._assign_identifiers(rows)
+        if not rows:
+            return
+
+        products = []
+        for _, clean in rows:
+            product = Product(title=clean['title'], batch_number=clean['batch_number'], sku=clean['sku'],
+                              barcode=clean['barcode'], price=clean['price'], cost=clean['cost'],
+                              label_qty=clean['label_qty'], attributes=clean['attributes'])
+            products.append(product)
+        db.session.add_all(products)
+        db.session.flush()
+
+        # The attribute index rows go in with one executemany rather than through set_attributes()
+        product_attributes.replace_rows({product.id: clean['attributes'] for product, (_, clean) in zip(products, rows)})
+
+        associations = []
+        for product, (_, clean) in zip(products, rows):
+            if clean['category']:
+                associations.append({'product_id': product.id, 'category_id': self._category_id(clean['category'])})
+        if associations:
+            db.session.execute(product_categories.insert(), associations)
+
+        batch_registry.register_new_products(products)
+        search_index.index_products(products)
+        created = [(product.id, product.title, product.batch_number) for product in products]
+        db.session.commit()
+        self.pending = []
+        # Committed identifiers are guarded by the database from now on
+        for field in identifiers.KINDS:
+            identifiers.release(field, [clean[field] for _, clean in rows])
+        suggestions.index_new_products(created)
+        for product in products:
+            db.session.expunge(product)
+        self.report.created += len(products)
+
+    def fail(self, error):
+        """Report the rows of a chunk that failed to insert and free their identifiers."""
+        for line, _ in self.pending:
+            self.report.error(line, f'Chunk failed: {error}')
+        for field in identifiers.KINDS:
+            values = [clean[field] for _, clean in self.pending if clean[field]]
+            self.seen[field].difference_update(values)
+            identifiers.release(field, values)
+        self.pending = []
+
+
+def import_products(stream, fmt='csv', chunk_size=DEFAULT_CHUNK_SIZE, create_categories=True):
+    """
+    Import products from a text stream of CSV or NDJSON rows.
+
+    Each chunk is committed on its own; a chunk that fails to insert is
+    rolled back and reported against the rows it was inserting. Returns an
+    ImportReport.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'Unsupported format {fmt}')
+
+    report = ImportReport()
+    importer = _Importer(report, create_categories)
+
+    def flush(chunk):
+        try:
+            importer.process(chunk)
+        except Exception as e:
+            db.session.rollback()
+            importer.reload_categories()
+            logger.error(f"Import chunk starting at line {chunk[0][0]} failed: {str(e)}")
+            importer.fail(e)
+
+    chunk = []
+    for line, row in iter_rows(stream, fmt):
+        report.rows += 1
+        if isinstance(row, ValueError):
+            report.error(line, str(row))
+            continue
+        try:
+            chunk.append((line, validate_row(row)))
+        except ValueError as e:
+            report.error(line, str(e))
+            continue
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+
+    if report.created:
+        catalog_stats.invalidate()
+
+    report.seconds = time.perf_counter() - report.started
+    logger.info(f"Imported {report.created} of {report.rows} rows in {report.seconds:.2f}s "
+                f"({report.rows_per_sec:.0f} rows/sec, {report.failed} failed)")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import products from a CSV or NDJSON file')
+    parser.add_argument('path', help='File to import')
+    parser.add_argument('--format', choices=FORMATS, help='File format (default: from the file extension)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Rows per insert batch')
+    parser.add_argument('--no-create-categories', action='store_true',
+                        help='Reject rows with unknown categories instead of creating them')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from app import app
+
+    with app.app_context(), open(args.path, newline='', encoding='utf-8-sig') as f:
+        report = import_products(f, args.format or detect_format(args.path), args.chunk_size,
+                                 create_categories=not args.no_create_categories)
+
+    for line, message in report.errors:
+        print(f"line {line}: {message}")
+    print(f"{report.created} created, {report.failed} failed, {report.rows} rows "
+          f"in {report.seconds:.2f}s ({report.rows_per_sec:.0f} rows/sec)")
+    return 1 if report.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+Catalog counters for the admin overview and category pages.
+
+All counters come from three aggregate queries: one row of scalar counts for
+the totals, and two COUNTs grouped by category over ``product_categories``,
+joined to ``product`` and to ``batch_history``. The result is cached per
+process; write paths call invalidate() after committing and the cache also
+expires after ``ttl`` seconds so other worker processes catch up.
+"""
+import threading
+import time
+from collections import namedtuple
+from sqlalchemy import func, select
+from models import db, Product, Category, ProductTemplate, BatchHistory, product_categories
+
+CategoryStats = namedtuple('CategoryStats', ['product_count', 'square_synced_count', 'history_count'])
+CatalogStats = namedtuple('CatalogStats', ['product_count', 'square_synced_count', 'category_count',
+                                           'template_count', 'history_count', 'categories'])
+
+EMPTY_CATEGORY = CategoryStats(0, 0, 0)
+
+_lock = threading.Lock()
+_cached = None      # (CatalogStats, computed_at)
+_generation = 0     # bumped on every invalidation
+ttl = 60
+
+
+def compute():
+    """Compute every counter from the database."""
+    totals = db.session.execute(select(
+        select(func.count(Product.id)).scalar_subquery(),
+        select(func.count(Product.square_catalog_id)).scalar_subquery(),
+        select(func.count(Category.id)).scalar_subquery(),
+        select(func.count(ProductTemplate.id)).scalar_subquery(),
+        select(func.count(BatchHistory.id)).scalar_subquery(),
+    )).one()
+
+    rows = db.session.execute(
+        select(product_categories.c.category_id,
+               func.count(Product.id),
+               func.count(Product.square_catalog_id))
+        .join(Product, Product.id == product_categories.c.product_id)
+        .group_by(product_categories.c.category_id)
+    )
+    histories = dict(db.session.execute(
+        select(product_categories.c.category_id, func.count(BatchHistory.id))
+        .join(BatchHistory, BatchHistory.product_id == product_categories.c.product_id)
+        .group_by(product_categories.c.category_id)
+    ).all())
+    categories = {category_id: CategoryStats(count, synced, histories.get(category_id, 0))
+                  for category_id, count, synced in rows}
+    return CatalogStats(*totals, categories=categories)
+
+
+def get():
+    """Return the cached CatalogStats, recomputing them when stale."""
+    global _cached
+    cached = _cached
+    if cached is not None and (not ttl or time.monotonic() - cached[1] <= ttl):
+        return cached[0]
+
+    generation = _generation
+    stats = compute()
+    with _lock:
+        # Do not cache a result that raced with a write
+        if generation == _generation:
+            _cached = (stats, time.monotonic())
+    return stats
+
+
+def for_category(category_id):
+    return get().categories.get(category_id, EMPTY_CATEGORY)
+
+
+def invalidate():
+    """Drop the cached counters. Call after committing a catalog write."""
+    global _cached, _generation
+    with _lock:
+        _cached = None
+        _generation += 1
@@ -0,0 +1,179 @@
+"""
+Collision-free allocation of batch numbers, SKUs and UPC-A barcodes.
+
+utils draws random identifiers; this module makes sure they are free.
+allocate() draws all N candidates up front and checks them with one IN query,
+redrawing only the few that collided, so a bulk allocation costs one round
+trip in the common case. Batch numbers are checked against the batch
+registry, which covers current and historical batches; SKUs and barcodes
+against their unique product columns.
+
+Values handed out are also reserved in this process until they have had
+time to be committed, so two requests cannot be given the same identifier
+before either has written it. Across processes the unique constraints on
+``product.sku``, ``product.barcode`` and ``batch_registry.batch_number``
+remain the final guard.
+"""
+import threading
+import time
+from models import db, Product, BatchRegistry
+from utils import generate_batch_number, generate_sku, generate_upc_barcode
+
+KINDS = ('batch_number', 'sku', 'barcode')
+
+LABELS = {
+    'batch_number': 'Batch number',
+    'sku': 'SKU',
+    'barcode': 'Barcode',
+}
+
+GENERATORS = {
+    'batch_number': generate_batch_number,
+    'sku': generate_sku,
+    'barcode': generate_upc_barcode,
+}
+
+# Bound parameters per IN query, well below SQLite's (32766) and PostgreSQL's (65535) limits
+QUERY_CHUNK_SIZE = 5000
+MAX_ROUNDS = 20
+RESERVATION_TTL = 600
+
+_lock = threading.Lock()
+_reserved = {kind: {} for kind in KINDS}   # kind -> {value: reserved_at}
+
+
+class AllocationError(Exception):
+    """Raised when free identifiers could not be found (the key space is nearly exhausted)."""
+
+
+def _column(kind):
+    if kind == 'batch_number':
+        return BatchRegistry.batch_number
+    if kind in ('sku', 'barcode'):
+        return getattr(Product, kind)
+    raise ValueError(f'Unknown identifier kind {kind}')
+
+
+def taken(kind, values, product_id=None):
+    """
+    The given identifiers that already exist in the database, not counting
+    those held by ``product_id`` (its current and historical batches).
+    """
+    column = _column(kind)
+    values = list(values)
+    existing = set()
+    for start in range(0, len(values), QUERY_CHUNK_SIZE):
+        chunk = values[start:start + QUERY_CHUNK_SIZE]
+        query = db.session.query(column).filter(column.in_(chunk))
+        if product_id is not None:
+            owner = BatchRegistry.product_id if kind == 'batch_number' else Product.id
+            query = query.filter(owner != product_id)
+        existing.update(value for (value,) in query)
+    return existing
+
+
+def conflicts(values, product_id=None):
+    """
+    Manually entered identifiers that are already in use, so a form can
+    report them instead of failing on a unique constraint.
+
+    Args:
+        values: {kind: value}; empty values are skipped
+        product_id: the product being edited, whose own identifiers are not conflicts
+
+    Returns:
+        list of (kind, value)
+    """
+    return [(kind, value) for kind, value in values.items()
+            if value and taken(kind, [value], product_id)]
+
+
+def _prune(reserved, now):
+    # Reservations are kept in insertion order, so the expired ones are at the front
+    while reserved:
+        value, reserved_at = next(iter(reserved.items()))
+        if now - reserved_at <= RESERVATION_TTL:
+            break
+        del reserved[value]
+
+
+def allocate(kind, count=1, exclude=(), stats=None):
+    """
+    Allocate ``count`` distinct identifiers of ``kind`` that are not in the
+    database, not in ``exclude`` and not recently handed out by this process.
+
+    Args:
+        stats: optional dict; 'rounds', 'drawn' and 'collisions' are added to it
+
+    Raises:
+        AllocationError: if MAX_ROUNDS draws still collide
+    """
+    if kind not in GENERATORS:
+        raise ValueError(f'Unknown identifier kind {kind}')
+    generate = GENERATORS[kind]
+    exclude = set(exclude)
+    allocated = []
+    rounds = drawn = collisions = 0
+
+    while len(allocated) < count:
+        if rounds == MAX_ROUNDS:
+            raise AllocationError(f'Could not allocate {count} free {kind} values')
+        rounds += 1
+
+        with _lock:
+            reserved = _reserved[kind]
+            candidates = set()
+            while len(candidates) < count - len(allocated):
+                value = generate()
+                drawn += 1
+                if value in exclude or value in reserved or value in candidates:
+                    collisions += 1
+                    continue
+                candidates.add(value)
+            # Hold the candidates while they are checked so concurrent callers skip them
+            now = time.monotonic()
+            for value in candidates:
+                reserved[value] = now
+
+        existing = taken(kind, candidates)
+        collisions += len(existing)
+        with _lock:
+            for value in existing:
+                _reserved[kind].pop(value, None)
+        fresh = [value for value in candidates if value not in existing]
+        allocated.extend(fresh)
+        exclude.update(fresh)
+
+    with _lock:
+        _prune(_reserved[kind], time.monotonic())
+
+    if stats is not None:
+        stats['rounds'] = stats.get('rounds', 0) + rounds
+        stats['drawn'] = stats.get('drawn', 0) + drawn
+        stats['collisions'] = stats.get('collisions', 0) + collisions
+    return allocated
+
+
+def allocate_one(kind):
+    """Allocate a single free identifier of ``kind``."""
+    return allocate(kind, 1)[0]
+
+
+def allocate_product_identifiers(count=1):
+    """
+    Allocate batch number, SKU and barcode for ``count`` new products: three
+    queries in total however large ``count`` is.
+
+    Returns:
+        list of {'batch_number', 'sku', 'barcode'} dicts
+    """
+    columns = {kind: allocate(kind, count) for kind in KINDS}
+    return [{kind: columns[kind][index] for kind in KINDS} for index in range(count)]
+
+
+def release(kind, values):
+    """Drop reservations early, once the rows holding the values are committed or rolled back."""
+    with _lock:
+        reserved = _reserved[kind]
+        for value in values:
+            reserved.pop(value, None)
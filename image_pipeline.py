@@ -0,0 +1,341 @@
+"""
+Responsive derivatives of product and label images.
+
+An upload is stored once as the 800px image the rest of the app (Square
+sync, image sync) works with, and once per width in WIDTHS as a derivative
+for the browser: web-optimized JPEG (PNG when the image has transparency),
+WebP and, when Pillow was built with it, AVIF. EXIF orientation is applied
+before resizing and no metadata is written, so phone photos come out upright
+and without location data.
+
+Each derivative is recorded as an ImageVariant row, and the image macros in
+_image_helper.html turn them into ``<picture>`` sources with ``srcset`` and
+``sizes``, letting a list card fetch a 320px WebP instead of the full image.
+
+process_upload() and write_variants() only touch files, so uploads are
+processed in image_worker's process pool; record_variants() then stores the
+rows, and the files in the blob store, from the web process.
+
+Derivatives of images uploaded before this existed are built with:
+    python image_pipeline.py [--product-id ID]
+"""
+import argparse
+import logging
+import math
+import os
+import sys
+import tempfile
+import time
+from flask import current_app, url_for
+from PIL import ExifTags, Image, ImageOps, features
+from models import db, Product, ImageVariant
+import blob_store
+
+logger = logging.getLogger(__name__)
+
+IMAGE_TYPES = ('product_image', 'label_image')
+WIDTHS = (160, 320, 640, 1280)
+VARIANT_DIR = 'variants'
+MASTER_SIZE = (800, 800)
+# Uploads with more pixels are rejected from their header, before any decoding
+MAX_PIXELS = 50 * 1000 * 1000
+# Resampling first shrinks by an integer factor with reduce() to within this
+# factor of the target size, which is much faster than LANCZOS over the whole image
+REDUCING_GAP = 3.0
+
+EXTENSIONS = {'jpeg': '.jpg', 'png': '.png', 'webp': '.webp', 'avif': '.avif'}
+MIME_TYPES = {'jpeg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp', 'avif': 'image/avif'}
+SAVE_OPTIONS = {
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+    'png': {'format': 'PNG', 'optimize': True},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'avif': {'format': 'AVIF', 'quality': 60, 'speed': 8},
+}
+
+# Most compact first: the browser takes the first <source> type it supports
+MODERN_FORMATS = tuple(fmt for fmt in ('avif', 'webp') if features.check(fmt))
+
+
+def formats_for(image):
+    """Formats to encode an image in; the last one is the universally supported fallback."""
+    return MODERN_FORMATS + ('png' if image.mode == 'RGBA' else 'jpeg',)
+
+
+def prepare(image):
+    """Upright, RGB or RGBA copy of an image, with transparency kept only where it is used."""
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        if image.getchannel('A').getextrema()[0] == 255:
+            image = image.convert('RGB')
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+
+def check_pixels(image):
+    """Reject an opened (not yet decoded) image over MAX_PIXELS."""
+    if image.width * image.height > MAX_PIXELS:
+        raise Image.DecompressionBombError(
+            f"{image.width}x{image.height} image exceeds the limit of {MAX_PIXELS} pixels")
+
+
+def inspect(stream):
+    """
+    Validate an uploaded image from its header, without decoding any pixels.
+    The stream is left at its start.
+
+    Returns:
+        (format, (width, height))
+
+    Raises:
+        UnidentifiedImageError: the file is not an image Pillow can read
+        DecompressionBombError: the image has more than MAX_PIXELS pixels
+    """
+    stream.seek(0)
+    try:
+        with Image.open(stream) as image:
+            check_pixels(image)
+            return image.format, image.size
+    finally:
+        stream.seek(0)
+
+
+def _reduction(size, width, height):
+    # How many times larger than needed to cover width x height (None: unconstrained) an image is
+    factors = [size[0] / width if width else None, size[1] / height if height else None]
+    return min(factor for factor in factors if factor is not None)
+
+
+def open_reduced(path, width=WIDTHS[-1], height=None):
+    """
+    Decode an image at no more than the resolution needed to cover an output
+    ``width`` by ``height`` pixels (either may be None), and prepare() it.
+
+    JPEGs are decoded with draft(), which has libjpeg scale by 1/2, 1/4 or 1/8
+    while decompressing, so a 24-megapixel photo never exists in memory at
+    full size. Other formats are decoded in full, which check_pixels() bounds,
+    and reduced with REDUCING_GAP.
+    """
+    with Image.open(path) as image:
+        check_pixels(image)
+        displayed = image.size
+        if image.getexif().get(ExifTags.Base.Orientation, 1) in (5, 6, 7, 8):
+            displayed = displayed[::-1]
+        reduction = _reduction(displayed, width, height)
+        if reduction > 1:
+            size = tuple(max(1, math.ceil(side / reduction)) for side in displayed)
+            image.draft(None, size if displayed == image.size else size[::-1])
+        image = prepare(image)
+    reduction = _reduction(image.size, width, height)
+    if reduction > 1:
+        size = tuple(max(1, math.ceil(side / reduction)) for side in image.size)
+        image.thumbnail(size, Image.LANCZOS, reducing_gap=REDUCING_GAP)
+    return image
+
+
+def target_widths(width):
+    """Widths to derive for an image ``width`` pixels wide, never upscaling."""
+    widths = [target for target in WIDTHS if target < width]
+    if width <= WIDTHS[-1]:
+        widths.append(width)
+    return widths
+
+
+def variant_path(product_id, image_type, width, fmt):
+    """Path of a derivative, relative to the static folder."""
+    return os.path.join('uploads', str(product_id), VARIANT_DIR, f"{image_type}_{width}{EXTENSIONS[fmt]}")
+
+
+def atomic_save(image, full_path, **options):
+    """Encode to a temporary file beside ``full_path`` and rename it into place."""
+    directory = os.path.dirname(full_path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix=os.path.splitext(full_path)[1])
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            image.save(f, **options)
+        os.replace(temp_path, full_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _save(image, fmt, full_path):
+    options = dict(SAVE_OPTIONS[fmt])
+    icc_profile = image.info.get('icc_profile')
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    atomic_save(image, full_path, **options)
+
+
+def write_variants(image, static_folder, product_id, image_type):
+    """
+    Write the derivatives of a prepared image. Touches no database, so it can
+    run in a worker process.
+
+    Returns:
+        list of {'path', 'format', 'width', 'height', 'size'} dicts
+    """
+    written = []
+    resized = image
+    # Largest first, each width resampled from the previous one
+    for width in sorted(target_widths(image.width), reverse=True):
+        height = max(1, round(resized.height * width / resized.width))
+        if width != resized.width:
+            resized = resized.resize((width, height), Image.LANCZOS)
+        for fmt in formats_for(resized):
+            path = variant_path(product_id, image_type, width, fmt)
+            full_path = os.path.join(static_folder, path)
+            _save(resized, fmt, full_path)
+            written.append({'path': path, 'format': fmt, 'width': width, 'height': height,
+                            'size': os.path.getsize(full_path)})
+    return written
+
+
+def process_upload(original_path, static_folder, product_id, image_type, master_path=None):
+    """
+    Produce everything served for an uploaded original: the MASTER_SIZE image
+    at ``master_path`` (skipped when None) and the derivatives. The original
+    is only decoded at the resolution of the widest derivative.
+
+    Returns:
+        the derivatives, as write_variants()
+    """
+    image = open_reduced(original_path)
+    if master_path:
+        master = image.copy()
+        master.thumbnail(MASTER_SIZE)
+        if master_path.lower().endswith('.png'):
+            atomic_save(master, os.path.join(static_folder, master_path), format='PNG')
+        else:
+            atomic_save(master.convert('RGB'), os.path.join(static_folder, master_path), format='JPEG', quality=85)
+    return write_variants(image, static_folder, product_id, image_type)
+
+
+def record_variants(product_id, image_type, source_path, written):
+    """
+    Replace the product's ImageVariant rows for ``image_type`` with the
+    derivatives just written, deleting files the previous upload left behind.
+    The caller commits.
+    """
+    variants = [ImageVariant(product_id=product_id, image_type=image_type, source_path=source_path, **values)
+                for values in written]
+    kept = {variant.path for variant in variants}
+    for old in ImageVariant.query.filter_by(product_id=product_id, image_type=image_type):
+        if old.path not in kept:
+            blob_store.release(old.path)
+        db.session.delete(old)
+    db.session.add_all(variants)
+    for variant in variants:
+        blob_store.adopt(variant.path)
+    logger.info(f"Recorded {len(variants)} derivatives of {source_path} "
+                f"({sum(variant.size for variant in variants)} bytes)")
+    return variants
+
+
+def create_variants(image, product_id, image_type, source_path):
+    """
+    Write the derivatives of an image and record them, in this process.
+    The caller commits.
+
+    Args:
+        image: opened PIL image, at the best resolution available
+        source_path: the stored image the derivatives stand in for, relative to static
+
+    Returns:
+        the new ImageVariant rows
+    """
+    written = write_variants(prepare(image), current_app.static_folder, product_id, image_type)
+    return record_variants(product_id, image_type, source_path, written)
+
+
+def create_variants_from_file(product_id, image_type, source_path):
+    """Derive variants from an image already stored under the static folder."""
+    image = open_reduced(os.path.join(current_app.static_folder, source_path))
+    written = write_variants(image, current_app.static_folder, product_id, image_type)
+    return record_variants(product_id, image_type, source_path, written)
+
+
+def share_variants(variants, product_id, image_type, source_path):
+    """
+    Give another product the same derivatives, linking their files in the
+    blob store rather than encoding or copying them. The caller commits.
+
+    Returns:
+        the new ImageVariant rows
+    """
+    shared = []
+    for variant in variants:
+        path = variant_path(product_id, image_type, variant.width, variant.format)
+        blob_store.share(variant.path, path)
+        shared.append(ImageVariant(product_id=product_id, image_type=image_type, source_path=source_path,
+                                   path=path, format=variant.format, width=variant.width,
+                                   height=variant.height, size=variant.size))
+    db.session.add_all(shared)
+    return shared
+
+
+def current_variants(product, image_type='product_image'):
+    """The product's derivatives of its current ``image_type`` image, narrowest first."""
+    source_path = getattr(product, image_type)
+    if not source_path:
+        return []
+    return sorted((variant for variant in product.image_variants
+                   if variant.image_type == image_type and variant.source_path == source_path),
+                  key=lambda variant: variant.width)
+
+
+def image_sources(variants):
+    """
+    ``<picture>`` sources for a set of derivatives.
+
+    Returns:
+        list of (mime type, srcset) ordered as formats_for(), fallback last;
+        empty when there are no derivatives
+    """
+    by_format = {}
+    for variant in variants:
+        by_format.setdefault(variant.format, []).append(variant)
+    order = list(MODERN_FORMATS) + ['jpeg', 'png']
+    return [(MIME_TYPES[fmt], ', '.join(f"{url_for('static', filename=variant.path)} {variant.width}w"
+                                         for variant in by_format[fmt]))
+            for fmt in order if fmt in by_format]
+
+
+def rebuild(product_ids=None):
+    """Regenerate the derivatives of every stored image, or of the given products'."""
+    query = Product.query.order_by(Product.id)
+    if product_ids:
+        query = query.filter(Product.id.in_(product_ids))
+    count = 0
+    for product in query:
+        for image_type in IMAGE_TYPES:
+            source_path = getattr(product, image_type)
+            if not source_path or not os.path.isfile(os.path.join(current_app.static_folder, source_path)):
+                continue
+            try:
+                count += len(create_variants_from_file(product.id, image_type, source_path))
+            except (OSError, Image.DecompressionBombError) as e:
+                logger.warning(f"Could not derive variants of {source_path}: {e}")
+        db.session.commit()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build responsive derivatives of stored product and label images')
+    parser.add_argument('--product-id', type=int, action='append', help='Only this product (repeatable)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from app import app
+
+    started = time.perf_counter()
+    with app.app_context():
+        count = rebuild(args.product_id)
+    logger.info(f"Wrote {count} derivatives in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""
+On-demand resized product images, served at /img/<width>x<height>/<path>.
+
+A layout asks for exactly the box it shows an image in instead of the
+nearest of the fixed widths image_pipeline derives at upload. The boxes are
+named in RESIZE_SIZES, and the ``size`` argument of the _image_helper.html
+macros takes one of those names. Only those boxes and their 2x are served;
+any other size is a 404, so the URL space, and with it the work and the
+cache entries a client can cause, is bounded by the layouts.
+``<w>x<h>`` crops to fill the box, like CSS ``object-fit: cover``; a 0 for
+either side keeps the aspect ratio. Images are never enlarged, and are
+encoded as AVIF or WebP when the browser's Accept header allows, else as
+JPEG (PNG for PNG sources).
+
+Results are kept in a disk cache of at most RESIZE_CACHE_MAX_BYTES that
+evicts the least recently used. A cached file is named by a hash of the
+source path, its mtime and size, the box, the format and the encoder, and
+that name is the response's strong ETag: it always holds the same bytes.
+Concurrent requests for a result being produced wait for that one resize
+instead of starting their own, and at most RESIZE_CONCURRENCY resizes run at
+once.
+
+The LRU index is per process. Files written by other processes are picked up
+from disk when requested and counted from then on, so with several workers
+the cache can briefly exceed its bound.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+import PIL
+from PIL import Image, ImageOps
+import image_pipeline
+from asset_index import assets, normalize
+
+logger = logging.getLogger(__name__)
+
+# Only product and label images are resized
+SOURCE_ROOT = 'uploads/'
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+# Layout name -> (width, height) of the box it shows images in
+SIZES = {
+    'card': (400, 200),     # .card-img-top
+}
+DENSITIES = (1, 2)
+
+_boxes = set()      # every (width, height) that may be requested
+
+
+class ResizeCache:
+    def __init__(self, max_bytes=256 * 1024 * 1024, concurrency=2):
+        self.folder = None
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (path, size), least recently used first
+        self._bytes = 0
+        self._inflight = {}             # key -> Future of the resize producing it
+        self._slots = threading.BoundedSemaphore(concurrency)
+
+    def init_app(self, app):
+        app.config.setdefault('RESIZE_CACHE_FOLDER', os.path.join(app.instance_path, 'resized'))
+        app.config.setdefault('RESIZE_CACHE_MAX_BYTES', self.max_bytes)
+        app.config.setdefault('RESIZE_CONCURRENCY', os.cpu_count() or 1)
+        self.folder = app.config['RESIZE_CACHE_FOLDER']
+        self.max_bytes = app.config['RESIZE_CACHE_MAX_BYTES']
+        self._slots = threading.BoundedSemaphore(app.config['RESIZE_CONCURRENCY'])
+        self._load()
+
+    def _load(self):
+        """Index what earlier runs left on disk, least recently used first."""
+        found = []
+        for root, _dirs, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if name.startswith('.tmp-'):
+                        os.remove(path)
+                        continue
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_atime, name.split('.')[0], path, stat.st_size))
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            for _atime, key, path, size in sorted(found):
+                self._entries[key] = (path, size)
+                self._bytes += size
+            self._evict()
+        logger.debug(f"Indexed {len(self._entries)} resized images ({self._bytes} bytes)")
+
+    def path(self, key, ext):
+        return os.path.join(self.folder, key[:2], key + ext)
+
+    def _evict(self):
+        # Called with _lock held; the newest entry always stays
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _key, (path, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _add(self, key, path, size):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (path, size)
+            self._bytes += size
+            self._evict()
+
+    def discard(self, key):
+        """Forget an entry whose file has gone (evicted by another process)."""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+    def get(self, key, ext, produce):
+        """
+        Path of the cached file for ``key``, calling ``produce(path)`` to write
+        it when it is not cached. Concurrent callers for the same key share
+        one call.
+        """
+        path = self.path(key, ext)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return path
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            try:
+                # Written by another process?
+                size = os.path.getsize(path)
+            except OSError:
+                with self._slots:
+                    started = time.perf_counter()
+                    produce(path)
+                size = os.path.getsize(path)
+                logger.debug(f"Resized {os.path.basename(path)} ({size} bytes) "
+                             f"in {time.perf_counter() - started:.3f}s")
+            self._add(key, path, size)
+            future.set_result(path)
+            return path
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+cache = ResizeCache()
+
+
+def init_app(app):
+    app.config.setdefault('RESIZE_SIZES', SIZES)
+    _boxes.clear()
+    _boxes.update((width * density, height * density)
+                  for width, height in app.config['RESIZE_SIZES'].values() for density in DENSITIES)
+    cache.init_app(app)
+
+
+def negotiate(filename, accept_mimetypes):
+    """Format to send an image in, given the request's Accept header."""
+    # Only types the browser names; "*/*" does not promise AVIF support
+    named = {value for value, quality in accept_mimetypes if quality > 0}
+    for fmt in image_pipeline.MODERN_FORMATS:
+        if image_pipeline.MIME_TYPES[fmt] in named:
+            return fmt
+    return 'png' if filename.lower().endswith('.png') else 'jpeg'
+
+
+def cache_key(filename, stat, width, height, fmt):
+    identity = '\0'.join([filename, str(stat[0]), str(stat[1]), f'{width}x{height}', fmt,
+                          PIL.__version__, repr(sorted(image_pipeline.SAVE_OPTIONS[fmt].items()))])
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()[:32]
+
+
+def _render(source, width, height, fmt, path):
+    image = image_pipeline.open_reduced(source, width or None, height or None)
+    if width and height:
+        # Shrink the box rather than enlarge the image
+        factor = min(1, image.width / width, image.height / height)
+        box = (max(1, round(width * factor)), max(1, round(height * factor)))
+        image = ImageOps.fit(image, box, Image.LANCZOS)
+    else:
+        image.thumbnail((width or image.width, height or image.height), Image.LANCZOS)
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    image_pipeline.atomic_save(image, path, **image_pipeline.SAVE_OPTIONS[fmt])
+
+
+def open_resized(static_folder, filename, width, height, accept_mimetypes):
+    """
+    Open the resized image for a request.
+
+    Returns:
+        (open file, mime type, ETag)
+
+    Raises:
+        ValueError: the size is not one of the RESIZE_SIZES boxes (or their 2x)
+        FileNotFoundError: the source is missing or is not a resizable upload
+    """
+    if (width, height) not in _boxes:
+        raise ValueError(f'Unsupported size {width}x{height}')
+    filename = normalize(filename)
+    if not filename.startswith(SOURCE_ROOT) or not filename.lower().endswith(SOURCE_EXTENSIONS):
+        raise FileNotFoundError(filename)
+    stat = assets.stat(filename)
+    if stat is None:
+        raise FileNotFoundError(filename)
+
+    fmt = negotiate(filename, accept_mimetypes)
+    key = cache_key(filename, stat, width, height, fmt)
+    source = os.path.join(static_folder, filename)
+    for attempt in range(2):
+        path = cache.get(key, image_pipeline.EXTENSIONS[fmt],
+                         lambda path: _render(source, width, height, fmt, path))
+        try:
+            return open(path, 'rb'), image_pipeline.MIME_TYPES[fmt], key
+        except FileNotFoundError:
+            # Evicted by another process since; produce it again
+            cache.discard(key)
+    raise FileNotFoundError(path)
@@ -0,0 +1,283 @@
+"""
+Background processing of uploaded images.
+
+An upload request only writes the file it received, atomically, to the
+originals folder (outside static, since originals keep their EXIF data) and
+queues a job that starts once the product is committed. The product already
+points at the path its 800px image will have, and pages show the placeholder
+image until it exists. Decoding, resizing and encoding run in a bounded pool
+of worker processes (spawned, so they share no locks or database connections
+with the web process), and the finished derivatives are recorded from the
+web process.
+
+Jobs are tracked per (product, image type). A new upload for an image that is
+still being processed waits for the running job instead of racing it for the
+same output files. Jobs beyond the pool's size queue in the executor and
+report ``pending`` meanwhile, so a burst of uploads never makes a request do
+the work itself. Only when IMAGE_WORKERS is 0 does the job run in the
+request, as before.
+
+status() reports a job's progress to /api/images/status/<product_id>; it is
+kept in memory, so once forgotten (or in another web process) the status is
+read from the files on disk.
+"""
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from concurrent.futures.process import BrokenProcessPool
+from flask import g
+import blob_store
+import image_pipeline
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+MISSING = 'missing'
+
+# Finished jobs are reported for this long, then forgotten
+STATUS_TTL = 3600
+
+_app = None
+_executor = None
+_lock = threading.Lock()
+_jobs = {}      # (product_id, image_type) -> latest Job
+_running = {}   # (product_id, image_type) -> Job in the pool
+_waiting = {}   # (product_id, image_type) -> Job to start when the running one finishes
+
+
+class Job:
+    def __init__(self, product_id, image_type, original_path, master_path):
+        self.product_id = product_id
+        self.image_type = image_type
+        self.original_path = original_path
+        self.master_path = master_path
+        self.state = PENDING
+        self.error = None
+        self.variants = 0
+        self.submitted_at = time.time()
+        self.finished_at = None
+
+    @property
+    def key(self):
+        return self.product_id, self.image_type
+
+    def as_dict(self):
+        return {
+            'state': self.state,
+            'path': self.master_path,
+            'variants': self.variants,
+            'error': self.error,
+            'seconds': round((self.finished_at or time.time()) - self.submitted_at, 3),
+        }
+
+
+def init_app(app):
+    global _app
+    _app = app
+    app.config.setdefault('IMAGE_WORKERS', min(2, os.cpu_count() or 1))
+    app.config.setdefault('IMAGE_ORIGINALS_FOLDER', os.path.join(app.instance_path, 'originals'))
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=_app.config['IMAGE_WORKERS'],
+                                        mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def original_dir(product_id):
+    return os.path.join(_app.config['IMAGE_ORIGINALS_FOLDER'], str(product_id))
+
+
+def original_path(product_id, image_type, ext):
+    return os.path.join(original_dir(product_id), f"{image_type}_{product_id}{ext}")
+
+
+def store_original(file, product_id, image_type, ext):
+    """Write an uploaded file to the originals folder atomically; returns its absolute path."""
+    directory = original_dir(product_id)
+    os.makedirs(directory, exist_ok=True)
+    path = original_path(product_id, image_type, ext)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix=ext)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            file.stream.seek(0)
+            shutil.copyfileobj(file.stream, f, 64 * 1024)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return path
+
+
+def remove_originals(product_id):
+    shutil.rmtree(original_dir(product_id), ignore_errors=True)
+
+
+def defer(product_id, image_type, original_path, master_path=None):
+    """
+    Queue an original for processing once the request has committed the
+    product (see submit_deferred()); a worker cannot see uncommitted rows.
+    """
+    g.setdefault('image_jobs', []).append((product_id, image_type, original_path, master_path))
+
+
+def submit_deferred():
+    """Submit the jobs deferred by this request; call after its commit."""
+    return [submit(*args) for args in g.pop('image_jobs', [])]
+
+
+def submit(product_id, image_type, original_path, master_path=None):
+    """
+    Queue an original for processing into the master image (at ``master_path``,
+    relative to static; None keeps the existing one) and its derivatives.
+
+    Returns:
+        the Job; already finished when it ran in the calling thread
+    """
+    job = Job(product_id, image_type, original_path, master_path)
+    with _lock:
+        _forget_finished()
+        _jobs[job.key] = job
+        if job.key in _running:
+            _waiting[job.key] = job
+            return job
+        background = _app.config['IMAGE_WORKERS'] > 0
+        if background:
+            _start(job)
+    if not background:
+        try:
+            written = image_pipeline.process_upload(job.original_path, _app.static_folder,
+                                                    job.product_id, job.image_type, job.master_path)
+        except Exception as e:
+            _fail(job, e)
+        else:
+            _store(job, written)
+    return job
+
+
+@contextmanager
+def _without_main():
+    # A spawned worker re-imports the parent's __main__ (main.py, and with it
+    # the whole app) but only needs image_pipeline, so hide it while the
+    # executor starts processes, which it does inside submit()
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = types.ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main
+
+
+def _start(job):
+    # Called with _lock held
+    with _without_main():
+        future = _get_executor().submit(image_pipeline.process_upload, job.original_path, _app.static_folder,
+                                        job.product_id, job.image_type, job.master_path)
+    _running[job.key] = job
+    future.add_done_callback(lambda future: _finished(job, future))
+
+
+def _finished(job, future):
+    global _executor
+    try:
+        written = future.result()
+    except BrokenProcessPool as e:
+        # A worker died (killed, out of memory); later jobs get a fresh pool
+        with _lock:
+            _executor = None
+        _fail(job, e)
+    except Exception as e:
+        _fail(job, e)
+    else:
+        with _app.app_context():
+            _store(job, written)
+    finally:
+        with _lock:
+            _running.pop(job.key, None)
+            waiting = _waiting.pop(job.key, None)
+            if waiting is not None:
+                _start(waiting)
+
+
+def _store(job, written):
+    from models import db
+    from page_cache import public_pages
+    try:
+        if _record(job, written):
+            db.session.commit()
+            public_pages.invalidate_product(job.product_id)
+    except Exception as e:
+        db.session.rollback()
+        _fail(job, e)
+
+
+def _record(job, written):
+    from models import db, Product
+    product = db.session.get(Product, job.product_id)
+    if product is None:
+        # Deleted while the job ran: drop what the job wrote after the delete cleaned up
+        blob_store.release_tree(os.path.join('uploads', str(job.product_id)))
+        db.session.commit()
+        job.state = FAILED
+        job.error = 'Product no longer exists'
+        job.finished_at = time.time()
+        return False
+    if job.master_path:
+        blob_store.adopt(job.master_path)
+    source_path = job.master_path or getattr(product, job.image_type)
+    image_pipeline.record_variants(job.product_id, job.image_type, source_path, written)
+    job.variants = len(written)
+    job.state = DONE
+    job.finished_at = time.time()
+    logger.info(f"Processed {job.image_type} of product {job.product_id} "
+                f"in {job.finished_at - job.submitted_at:.2f}s")
+    return True
+
+
+def _fail(job, error):
+    job.state = FAILED
+    job.error = str(error)
+    job.finished_at = time.time()
+    logger.error(f"Error processing {job.image_type} of product {job.product_id}: {error}")
+
+
+def _forget_finished():
+    # Called with _lock held
+    cutoff = time.time() - STATUS_TTL
+    for key, job in list(_jobs.items()):
+        if job.finished_at is not None and job.finished_at < cutoff:
+            del _jobs[key]
+
+
+def status(product_id, image_type, master_path):
+    """Processing status of a product image as a JSON-ready dict."""
+    job = _jobs.get((product_id, image_type))
+    if job is not None and job.master_path in (None, master_path):
+        return job.as_dict()
+    exists = bool(master_path) and os.path.isfile(os.path.join(_app.static_folder, master_path))
+    return {'state': DONE if exists else MISSING, 'path': master_path, 'variants': None,
+            'error': None, 'seconds': None}
+
+
+def wait(timeout=None):
+    """Block until every queued job has finished; for scripts and benchmarks."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        with _lock:
+            if not _running and not _waiting:
+                return True
+        if deadline is not None and time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
@@ -0,0 +1,71 @@
+"""Add batch_registry table
+
+Revision ID: 3b8e2f4a9d10
+Revises: c7901f193a36
+Create Date: 2026-10-18 09:12:04.318220
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8e2f4a9d10'
+down_revision = 'c7901f193a36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    connection = op.get_bind()
+    # The app's startup db.create_all() may already have created (and filled) the table
+    if sa.inspect(connection).has_table('batch_registry'):
+        if connection.execute(sa.text("SELECT id FROM batch_registry LIMIT 1")).first() is not None:
+            return
+    else:
+        _create_table()
+    _backfill(connection)
+
+
+def _create_table():
+    op.create_table('batch_registry',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('batch_number', sa.String(length=8), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('batch_history_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['batch_history_id'], ['batch_history.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('batch_registry', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_batch_registry_batch_number'), ['batch_number'], unique=True)
+
+
+def _backfill(connection):
+    # History first, then current products so they take precedence
+    entries = {}
+    for history_id, product_id, batch_number in connection.execute(sa.text(
+            "SELECT id, product_id, batch_number FROM batch_history ORDER BY created_at")):
+        if batch_number:
+            entries[batch_number] = (product_id, history_id)
+    for product_id, batch_number in connection.execute(sa.text(
+            "SELECT id, batch_number FROM product ORDER BY created_at")):
+        if batch_number:
+            entries[batch_number] = (product_id, None)
+
+    if entries:
+        registry = sa.table('batch_registry',
+                            sa.column('batch_number', sa.String),
+                            sa.column('product_id', sa.Integer),
+                            sa.column('batch_history_id', sa.Integer))
+        op.bulk_insert(registry, [
+            {'batch_number': batch_number, 'product_id': product_id, 'batch_history_id': history_id}
+            for batch_number, (product_id, history_id) in entries.items()
+        ])
+
+
+def downgrade():
+    with op.batch_alter_table('batch_registry', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_batch_registry_batch_number'))
+
+    op.drop_table('batch_registry')
@@ -0,0 +1,30 @@
+"""Add (created_at, id) index to product
+
+Revision ID: 5d1c7a2e8b43
+Revises: 3b8e2f4a9d10
+Create Date: 2026-10-18 11:40:27.905113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d1c7a2e8b43'
+down_revision = '3b8e2f4a9d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The app's startup db.create_all() may already have created the index
+    indexes = sa.inspect(op.get_bind()).get_indexes('product')
+    if any(index['name'] == 'ix_product_created_at_id' for index in indexes):
+        return
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.create_index('ix_product_created_at_id', ['created_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_index('ix_product_created_at_id')
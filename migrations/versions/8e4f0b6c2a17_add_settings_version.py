@@ -0,0 +1,30 @@
+"""Add version column to settings
+
+Revision ID: 8e4f0b6c2a17
+Revises: 5d1c7a2e8b43
+Create Date: 2026-10-18 13:05:51.227604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4f0b6c2a17'
+down_revision = '5d1c7a2e8b43'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The app's startup db.create_all() may already have created the column
+    columns = sa.inspect(op.get_bind()).get_columns('settings')
+    if any(column['name'] == 'version' for column in columns):
+        return
+    with op.batch_alter_table('settings', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('settings', schema=None) as batch_op:
+        batch_op.drop_column('version')
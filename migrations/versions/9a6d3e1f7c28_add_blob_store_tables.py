@@ -0,0 +1,50 @@
+"""Add blob and blob_link tables
+
+Revision ID: 9a6d3e1f7c28
+Revises: f3a7c2e9b614
+Create Date: 2026-10-18 21:14:08.520417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a6d3e1f7c28'
+down_revision = 'f3a7c2e9b614'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The app's startup db.create_all() may already have created the tables.
+    # Existing files are moved into the store by `python blob_store.py adopt`.
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('blob'):
+        op.create_table('blob',
+            sa.Column('sha256', sa.String(length=64), nullable=False),
+            sa.Column('size', sa.BigInteger(), nullable=False),
+            sa.Column('ref_count', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('sha256')
+        )
+    if not inspector.has_table('blob_link'):
+        op.create_table('blob_link',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('path', sa.String(length=500), nullable=False),
+            sa.Column('sha256', sa.String(length=64), nullable=False),
+            sa.ForeignKeyConstraint(['sha256'], ['blob.sha256'], ),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('path')
+        )
+        with op.batch_alter_table('blob_link', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_blob_link_sha256'), ['sha256'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('blob_link', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_blob_link_sha256'))
+
+    op.drop_table('blob_link')
+    op.drop_table('blob')
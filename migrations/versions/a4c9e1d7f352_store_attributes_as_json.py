@@ -0,0 +1,89 @@
+"""Store attributes as native JSON
+
+Revision ID: a4c9e1d7f352
+Revises: 8e4f0b6c2a17
+Create Date: 2026-10-18 15:42:10.518306
+
+"""
+import json
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c9e1d7f352'
+down_revision = '8e4f0b6c2a17'
+branch_labels = None
+depends_on = None
+
+TABLES = ('product', 'product_template', 'batch_history')
+BATCH_SIZE = 1000
+
+# JSONB on PostgreSQL; other databases keep JSON text, normalized below
+JSONType = sa.Text().with_variant(postgresql.JSONB(), 'postgresql')
+
+
+def _parse(value):
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return {}
+    if isinstance(value, list):
+        return {name: "" for name in value}
+    return value if isinstance(value, dict) else {}
+
+
+def _to_json(value):
+    parsed = _parse(value)
+    if op.get_bind().dialect.name == 'postgresql':
+        return parsed
+    return json.dumps(parsed)
+
+
+def _to_text(value):
+    return json.dumps(_parse(value))
+
+
+def _copy_in_batches(table_name, source_type, target_type, convert):
+    """Copy attributes into attributes_new, BATCH_SIZE rows per statement."""
+    connection = op.get_bind()
+    table = sa.table(table_name,
+                     sa.column('id', sa.Integer),
+                     sa.column('attributes', source_type),
+                     sa.column('attributes_new', target_type))
+    update = (table.update()
+              .where(table.c.id == sa.bindparam('b_id'))
+              .values(attributes_new=sa.bindparam('b_value', type_=target_type)))
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(table.c.id, table.c.attributes)
+            .where(table.c.id > last_id)
+            .order_by(table.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        connection.execute(update, [{'b_id': row_id, 'b_value': convert(value)} for row_id, value in rows])
+        last_id = rows[-1][0]
+
+
+def _swap_columns(table_name, old_type, new_type, convert):
+    with op.batch_alter_table(table_name, schema=None) as batch_op:
+        batch_op.add_column(sa.Column('attributes_new', new_type, nullable=True))
+    _copy_in_batches(table_name, old_type, new_type, convert)
+    with op.batch_alter_table(table_name, schema=None) as batch_op:
+        batch_op.drop_column('attributes')
+        batch_op.alter_column('attributes_new', new_column_name='attributes', existing_type=new_type)
+
+
+def upgrade():
+    for table_name in TABLES:
+        _swap_columns(table_name, sa.Text(), JSONType, _to_json)
+
+
+def downgrade():
+    for table_name in TABLES:
+        _swap_columns(table_name, JSONType, sa.Text(), _to_text)
@@ -0,0 +1,105 @@
+"""Add product_attribute table
+
+Revision ID: d2b6f8a31c95
+Revises: a4c9e1d7f352
+Create Date: 2026-10-18 17:20:37.904512
+
+"""
+import json
+import re
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2b6f8a31c95'
+down_revision = 'a4c9e1d7f352'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+_NUMBER_RE = re.compile(r'\s*([-+]?(?:\d+(?:\.\d*)?|\.\d+))')
+
+
+def _rows_for(product_id, attributes):
+    # Same normalization as product_attributes.rows_for
+    if isinstance(attributes, str):
+        try:
+            attributes = json.loads(attributes)
+        except json.JSONDecodeError:
+            return []
+    if not isinstance(attributes, dict):
+        return []
+    rows = {}
+    for name, value in attributes.items():
+        key = str(name).strip().lower()[:100]
+        if not key or key in rows:
+            continue
+        if isinstance(value, bool):
+            number = None
+        elif isinstance(value, (int, float)):
+            number = float(value)
+        else:
+            match = _NUMBER_RE.match('' if value is None else str(value))
+            number = float(match.group(1)) if match else None
+        rows[key] = {'product_id': product_id, 'name': key,
+                     'value': ('' if value is None else str(value)).strip().lower()[:255],
+                     'numeric_value': number}
+    return list(rows.values())
+
+
+def upgrade():
+    connection = op.get_bind()
+    # The app's startup db.create_all() may already have created (and filled) the table
+    if sa.inspect(connection).has_table('product_attribute'):
+        if connection.execute(sa.text("SELECT id FROM product_attribute LIMIT 1")).first() is not None:
+            return
+    else:
+        _create_table()
+    _backfill(connection)
+
+
+def _create_table():
+    op.create_table('product_attribute',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('value', sa.String(length=255), nullable=False),
+        sa.Column('numeric_value', sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('product_attribute', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_product_attribute_product_id'), ['product_id'], unique=False)
+        batch_op.create_index('ix_product_attribute_name_value', ['name', 'value', 'product_id'], unique=False)
+        batch_op.create_index('ix_product_attribute_name_numeric', ['name', 'numeric_value', 'product_id'], unique=False)
+
+
+def _backfill(connection):
+    # Rows come from the attributes JSON, in batches keyed on id
+    attribute_table = sa.table('product_attribute',
+                               sa.column('product_id', sa.Integer),
+                               sa.column('name', sa.String),
+                               sa.column('value', sa.String),
+                               sa.column('numeric_value', sa.Float))
+    last_id = 0
+    while True:
+        products = connection.execute(sa.text(
+            "SELECT id, attributes FROM product WHERE id > :last_id ORDER BY id LIMIT :limit"
+        ), {'last_id': last_id, 'limit': BATCH_SIZE}).all()
+        if not products:
+            break
+        rows = [row for product_id, attributes in products for row in _rows_for(product_id, attributes)]
+        if rows:
+            op.bulk_insert(attribute_table, rows)
+        last_id = products[-1][0]
+
+
+def downgrade():
+    with op.batch_alter_table('product_attribute', schema=None) as batch_op:
+        batch_op.drop_index('ix_product_attribute_name_numeric')
+        batch_op.drop_index('ix_product_attribute_name_value')
+        batch_op.drop_index(batch_op.f('ix_product_attribute_product_id'))
+
+    op.drop_table('product_attribute')
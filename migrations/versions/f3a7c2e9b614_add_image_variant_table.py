@@ -0,0 +1,45 @@
+"""Add image_variant table
+
+Revision ID: f3a7c2e9b614
+Revises: d2b6f8a31c95
+Create Date: 2026-10-18 19:05:12.336104
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a7c2e9b614'
+down_revision = 'd2b6f8a31c95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The app's startup db.create_all() may already have created the table.
+    # Derivatives of existing images are built by `python image_pipeline.py`.
+    if sa.inspect(op.get_bind()).has_table('image_variant'):
+        return
+    op.create_table('image_variant',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('image_type', sa.String(length=50), nullable=False),
+        sa.Column('source_path', sa.String(length=500), nullable=False),
+        sa.Column('path', sa.String(length=500), nullable=False),
+        sa.Column('format', sa.String(length=10), nullable=False),
+        sa.Column('width', sa.Integer(), nullable=False),
+        sa.Column('height', sa.Integer(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('image_variant', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_image_variant_product_id'), ['product_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('image_variant', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_image_variant_product_id'))
+
+    op.drop_table('image_variant')
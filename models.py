@@ -1,5 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase, relationship
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.dialects.postgresql import JSONB
 from flask_login import UserMixin
 import datetime
 import json
@@ -10,6 +12,73 @@ class Base(DeclarativeBase):
 
 db = SQLAlchemy(model_class=Base)
 
+class JSONType(TypeDecorator):
+    """JSONB on PostgreSQL, JSON text elsewhere.
+
+    Values are decoded once when the row is loaded. Text that is not valid
+    JSON (written before the column held native JSON) reads as an empty
+    object instead of failing the whole query.
+    """
+    impl = db.Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(JSONB())
+        return dialect.type_descriptor(db.Text())
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name == 'postgresql':
+            return value
+        return json.dumps(value)
+
+    def process_result_value(self, value, dialect):
+        if not isinstance(value, str):
+            return value
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return {}
+
+
+def _normalize_attributes(attrs):
+    """Coerce attribute input (dict, list of names or JSON text) to a new dict."""
+    if isinstance(attrs, str):
+        try:
+            attrs = json.loads(attrs)
+        except json.JSONDecodeError:
+            return {}
+    if isinstance(attrs, list):
+        # Convert simple name list to dict with optional values
+        return {name: "" for name in attrs}
+    if isinstance(attrs, dict):
+        return dict(attrs)
+    return {}
+
+
+class AttributesMixin:
+    """get/set access to an ``attributes`` JSON column.
+
+    The JSON column is decoded once when the row loads; get_attributes()
+    memoizes the normalized dict per instance so templates and helpers that
+    call it repeatedly share one copy. set_attributes() drops the memo, and
+    the memo is also ignored if ``attributes`` is assigned directly.
+    """
+
+    def set_attributes(self, attrs):
+        self.attributes = _normalize_attributes(attrs)
+        self._attributes_memo = None
+
+    def get_attributes(self):
+        raw = self.attributes
+        memo = getattr(self, '_attributes_memo', None)
+        if memo is not None and memo[0] is raw:
+            return memo[1]
+        attrs = _normalize_attributes(raw) if raw else {}
+        self._attributes_memo = (raw, attrs)
+        return attrs
+
+
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(100), unique=True, nullable=False)
@@ -24,39 +93,12 @@ class User(db.Model, UserMixin):
     def check_password(self, password):
         return werkzeug.security.check_password_hash(self.password_hash, password)
 
-class ProductTemplate(db.Model):
+class ProductTemplate(AttributesMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
-    attributes = db.Column(db.Text)  # Stored as JSON
+    attributes = db.Column(JSONType)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
-    def set_attributes(self, attrs):
-        if attrs is None:
-            self.attributes = json.dumps({})
-        elif isinstance(attrs, (dict, list)):
-            # Convert simple name list to dict with optional values
-            if isinstance(attrs, list):
-                attrs = {name: "" for name in attrs}
-            self.attributes = json.dumps(attrs)
-        elif isinstance(attrs, str):
-            try:
-                parsed = json.loads(attrs)
-                if isinstance(parsed, list):
-                    parsed = {name: "" for name in parsed}
-                self.attributes = json.dumps(parsed)
-            except json.JSONDecodeError:
-                self.attributes = json.dumps({})
-        else:
-            self.attributes = json.dumps({})
-
-    def get_attributes(self):
-        if not self.attributes:
-            return {}
-        try:
-            return json.loads(self.attributes)
-        except json.JSONDecodeError:
-            return {}
-
 # Association table for Product-Category relationship
 product_categories = db.Table('product_categories',
     db.Column('product_id', db.Integer, db.ForeignKey('product.id', ondelete='CASCADE')),
@@ -71,13 +113,13 @@ class Category(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     products = db.relationship('Product', secondary=product_categories, back_populates='categories')
 
-class Product(db.Model):
+class Product(AttributesMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     batch_number = db.Column(db.String(8))
     sku = db.Column(db.String(8), unique=True)  # SKU format similar to batch number
     barcode = db.Column(db.String(12), unique=True)  # UPC-A is 12 digits
-    attributes = db.Column(db.Text)  # Stored as JSON
+    attributes = db.Column(JSONType)
     cost = db.Column(db.Float, nullable=True)  # Product cost (optional)
     price = db.Column(db.Float, nullable=True)  # Product price (optional)
     product_image = db.Column(db.String(500))  # URL/path to image
@@ -93,63 +135,72 @@ class Product(db.Model):
     generated_pdfs = db.relationship('GeneratedPDF', backref='product', lazy='dynamic')
     batch_history = db.relationship('BatchHistory', backref='product', lazy='dynamic')
     categories = relationship('Category', secondary=product_categories, back_populates='products')
+    attribute_rows = db.relationship('ProductAttribute', cascade='all, delete-orphan')
+    image_variants = db.relationship('ImageVariant', cascade='all, delete-orphan')
 
-    def set_attributes(self, attrs):
-        if attrs is None:
-            self.attributes = json.dumps({})
-        elif isinstance(attrs, (dict, list)):
-            # Convert simple name list to dict with optional values
-            if isinstance(attrs, list):
-                attrs = {name: "" for name in attrs}
-            self.attributes = json.dumps(attrs)
-        elif isinstance(attrs, str):
-            try:
-                parsed = json.loads(attrs)
-                if isinstance(parsed, list):
-                    parsed = {name: "" for name in parsed}
-                self.attributes = json.dumps(parsed)
-            except json.JSONDecodeError:
-                self.attributes = json.dumps({})
-        else:
-            self.attributes = json.dumps({})
+    # Keyset pagination and previous/next navigation walk products newest first
+    __table_args__ = (db.Index('ix_product_created_at_id', 'created_at', 'id'),)
 
-    def get_attributes(self):
-        if not self.attributes:
-            return {}
-        try:
-            return json.loads(self.attributes)
-        except json.JSONDecodeError:
-            return {}
+    def set_attributes(self, attrs):
+        super().set_attributes(attrs)
+        # Keep the normalized rows used for attribute filtering in step
+        from product_attributes import rows_for
+        wanted = {name: (value, number) for name, value, number in rows_for(self.attributes)}
+        rows = []
+        for row in self.attribute_rows:
+            if row.name in wanted:
+                row.value, row.numeric_value = wanted.pop(row.name)
+                rows.append(row)
+        rows.extend(ProductAttribute(name=name, value=value, numeric_value=number)
+                    for name, (value, number) in wanted.items())
+        self.attribute_rows = rows
 
-class BatchHistory(db.Model):
+class BatchHistory(AttributesMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False)
     batch_number = db.Column(db.String(8), nullable=False)
-    attributes = db.Column(db.Text)  # Stored as JSON
+    attributes = db.Column(JSONType)
     coa_pdf = db.Column(db.String(500))  # URL/path to COA PDF
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
-    
-    def set_attributes(self, attrs):
-        if attrs is None:
-            self.attributes = json.dumps({})
-        elif isinstance(attrs, (dict, list)):
-            self.attributes = json.dumps(attrs)
-        elif isinstance(attrs, str):
-            try:
-                parsed = json.loads(attrs)
-                self.attributes = json.dumps(parsed)
-            except json.JSONDecodeError:
-                self.attributes = json.dumps({})
-        else:
-            self.attributes = json.dumps({})
 
-    def get_attributes(self):
-        if not self.attributes:
-            return {}
-        try:
-            return json.loads(self.attributes)
-        except json.JSONDecodeError:
-            return {}
+class ProductAttribute(db.Model):
+    """One normalized attribute of a product, for indexed filtering and sorting."""
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False)    # lower-cased
+    value = db.Column(db.String(255), nullable=False)   # lower-cased
+    numeric_value = db.Column(db.Float, nullable=True)  # leading number of the value, if any
+
+    __table_args__ = (
+        db.Index('ix_product_attribute_name_value', 'name', 'value', 'product_id'),
+        db.Index('ix_product_attribute_name_numeric', 'name', 'numeric_value', 'product_id'),
+    )
+
+class ImageVariant(db.Model):
+    """A resized, re-encoded derivative of a product or label image (see image_pipeline)."""
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False, index=True)
+    image_type = db.Column(db.String(50), nullable=False)    # product_image or label_image
+    source_path = db.Column(db.String(500), nullable=False)  # stored image it was derived from
+    path = db.Column(db.String(500), nullable=False)         # relative to static
+    format = db.Column(db.String(10), nullable=False)        # jpeg, png, webp or avif
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    size = db.Column(db.Integer, nullable=False)             # bytes
+
+class Blob(db.Model):
+    """File content stored once in the blob store, named by its SHA-256 (see blob_store)."""
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)                # bytes
+    ref_count = db.Column(db.Integer, default=0, nullable=False)   # BlobLink rows pointing here
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)  # last link or release
+
+class BlobLink(db.Model):
+    """A public path under static whose content is a blob."""
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(500), nullable=False, unique=True)  # relative to static
+    sha256 = db.Column(db.String(64), db.ForeignKey('blob.sha256'), nullable=False, index=True)
 
 class GeneratedPDF(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -161,6 +212,20 @@ class GeneratedPDF(db.Model):
     batch_history = db.relationship('BatchHistory', backref='pdfs')
 
 
+class BatchRegistry(db.Model):
+    """Maps every batch number (current or historical) to the row that owns it."""
+    id = db.Column(db.Integer, primary_key=True)
+    batch_number = db.Column(db.String(8), nullable=False, unique=True, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False)
+    batch_history_id = db.Column(db.Integer, db.ForeignKey('batch_history.id', ondelete='CASCADE'), nullable=True)
+    product = db.relationship('Product')
+    batch_history = db.relationship('BatchHistory')
+
+    @property
+    def is_historical(self):
+        return self.batch_history_id is not None
+
+
 class Settings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     # Square integration settings
@@ -175,6 +240,9 @@ class Settings(db.Model):
     # CraftMyPDF integration settings - no sandbox mode
     craftmypdf_api_key = db.Column(db.String(255), nullable=True)
 
+    # Bumped on every save so cached copies in other processes can tell they are stale
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)
+
     @classmethod
     def get_settings(cls):
         """Get the settings instance, creating it if it doesn't exist."""
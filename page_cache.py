@@ -0,0 +1,113 @@
+"""
+Rendered page cache for the public batch pages.
+
+Customers hit /batch/<batch_number> by scanning labels, often the same code
+many times. Rendered pages are kept in a process-local LRU keyed by batch
+number and tagged with the owning product's version, so a repeat scan costs
+no database or Jinja work and can be answered with 304 Not Modified.
+
+A batch number can have several cached representations (the HTML page, the
+JSON record served by the bulk lookup API); each is stored under its own
+``variant`` and invalidating the batch number drops all of them.
+
+Write paths call invalidate_product() after committing, which bumps the
+product version and makes every cached page of that product stale. Entries
+also expire after ``ttl`` seconds to bound staleness in other worker
+processes, which do not see this process's invalidations.
+"""
+import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+CachedPage = namedtuple('CachedPage', ['body', 'etag', 'last_modified', 'product_id', 'version', 'stored_at'])
+
+
+class PageCache:
+    def __init__(self, max_entries=2000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()
+        self._versions = {}     # product_id -> version
+        self._generation = 0    # bumped on every invalidation
+
+    def begin(self):
+        """
+        Snapshot taken before reading from the database.
+
+        put() refuses to store a page if anything was invalidated after the
+        snapshot, so a render racing with a write can never be cached.
+        """
+        return self._generation
+
+    def get(self, key, variant='html'):
+        with self._lock:
+            page = self._pages.get((key, variant))
+            if page is None:
+                return None
+            expired = self.ttl and time.monotonic() - page.stored_at > self.ttl
+            if expired or self._versions.get(page.product_id, 0) != page.version:
+                del self._pages[(key, variant)]
+                return None
+            self._pages.move_to_end((key, variant))
+            return page
+
+    def put(self, key, product_id, body, token=None, variant='html'):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        with self._lock:
+            version = self._versions.get(product_id, 0)
+            page = CachedPage(
+                body=body,
+                etag=hashlib.sha256(body).hexdigest()[:32],
+                # HTTP dates have second resolution
+                last_modified=datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0),
+                product_id=product_id,
+                version=version,
+                stored_at=time.monotonic(),
+            )
+            if token is not None and token != self._generation:
+                return page
+            self._pages[(key, variant)] = page
+            self._pages.move_to_end((key, variant))
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+            return page
+
+    def invalidate_product(self, product_id):
+        """Mark every cached page of a product as stale."""
+        with self._lock:
+            self._versions[product_id] = self._versions.get(product_id, 0) + 1
+            self._generation += 1
+
+    def invalidate(self, key):
+        """Drop every cached variant of a key."""
+        with self._lock:
+            for cached_key in [cached_key for cached_key in self._pages if cached_key[0] == key]:
+                del self._pages[cached_key]
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._generation += 1
+
+    def __len__(self):
+        return len(self._pages)
+
+
+# Rendered /batch/<batch_number> pages and their bulk API records
+public_pages = PageCache()
+
+
+def conditional_response(app, request, page, mimetype='text/html'):
+    """Build a 200/304 response for a cached page with strong validators."""
+    response = app.response_class(page.body, mimetype=mimetype)
+    response.set_etag(page.etag)
+    response.last_modified = page.last_modified
+    # Shared caches may store the page but must revalidate before reuse
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
@@ -0,0 +1,73 @@
+"""
+PDF delivery for COA and label downloads.
+
+Three modes, selected with the PDF_DELIVERY config value:
+
+    direct            The worker streams the file with send_file. Byte-range
+                      requests are answered with 206 so mobile PDF viewers
+                      can fetch pages incrementally.
+    x-accel-redirect  The worker only sets X-Accel-Redirect and nginx serves
+                      the file (including ranges) from an internal location.
+    x-sendfile        The worker only sets X-Sendfile with the absolute path
+                      for Apache mod_xsendfile / lighttpd.
+
+In the offload modes the worker still answers conditional requests (304)
+itself, so unchanged PDFs never reach the proxy's file handling.
+"""
+import os
+from urllib.parse import quote
+from flask import send_file
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+MODE_DIRECT = 'direct'
+MODE_ACCEL_REDIRECT = 'x-accel-redirect'
+MODE_SENDFILE = 'x-sendfile'
+MODES = (MODE_DIRECT, MODE_ACCEL_REDIRECT, MODE_SENDFILE)
+
+PDF_MIMETYPE = 'application/pdf'
+
+
+def _etag(stat):
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def send_pdf(app, request, pdf_root, filename, as_attachment=False):
+    """
+    Send a PDF stored under pdf_root using the configured delivery mode.
+
+    Raises:
+        NotFound: if the path escapes pdf_root or the file does not exist
+    """
+    path = safe_join(pdf_root, filename)
+    if path is None:
+        raise NotFound()
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise NotFound()
+
+    mode = app.config.get('PDF_DELIVERY', MODE_DIRECT)
+    if mode not in (MODE_ACCEL_REDIRECT, MODE_SENDFILE):
+        return send_file(path, mimetype=PDF_MIMETYPE, as_attachment=as_attachment,
+                         etag=_etag(stat), last_modified=stat.st_mtime, conditional=True)
+
+    response = app.response_class(None, mimetype=PDF_MIMETYPE, direct_passthrough=True)
+    if mode == MODE_ACCEL_REDIRECT:
+        prefix = app.config.get('PDF_ACCEL_REDIRECT_PREFIX', '/internal-pdfs/')
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(filename)
+    else:
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+    if as_attachment:
+        response.headers['Content-Disposition'] = f"attachment; filename=\"{os.path.basename(path)}\""
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.content_length = stat.st_size
+    response.set_etag(_etag(stat))
+    response.last_modified = stat.st_mtime
+
+    # Ranges are left to the proxy; only validators are checked here
+    response = response.make_conditional(request)
+    if response.status_code == 304:
+        response.headers.pop('X-Accel-Redirect', None)
+        response.headers.pop('X-Sendfile', None)
+    return response
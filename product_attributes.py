@@ -0,0 +1,226 @@
+"""
+Normalized product attributes for indexed filtering and sorting.
+
+The attributes JSON column stays the source of truth for display. Each
+product's attributes are also stored as ``product_attribute`` rows of
+(product_id, name, value, numeric_value), with the name and value
+lower-cased and any leading number parsed out ("20.5%" -> 20.5). Indexes on
+(name, value) and (name, numeric_value) turn "Strain is Indica" or
+"THC between 15 and 25" into index range scans instead of parsing every
+product's JSON.
+
+Rows are kept in sync by Product.set_attributes(); set-based writes that
+bypass the ORM call replace_rows() instead.
+
+Filters are written as ``<name><op><value>`` with op one of ``=``, ``>=``
+or ``<=``, e.g. ``Strain=Indica`` or ``THC>=15``. Sorting by an attribute
+orders by its numeric value, or alphabetically by its value when it has no
+numbers at all (such as Strain).
+"""
+import logging
+import math
+import re
+from collections import namedtuple
+from sqlalchemy import func, select
+from models import db, ProductAttribute, Product
+
+logger = logging.getLogger(__name__)
+
+NAME_LENGTH = 100
+VALUE_LENGTH = 255
+MAX_FILTERS = 5
+
+AttributeFilter = namedtuple('AttributeFilter', ['name', 'op', 'value'])
+AttributeSort = namedtuple('AttributeSort', ['name', 'descending', 'numeric'])
+
+_NUMBER_RE = re.compile(r'\s*([-+]?(?:\d+(?:\.\d*)?|\.\d+))')
+_FILTER_RE = re.compile(r'^\s*(.+?)\s*(>=|<=|=)\s*(.*?)\s*$')
+
+
+def normalize_name(name):
+    return str(name).strip().lower()[:NAME_LENGTH]
+
+
+def normalize_value(value):
+    return ('' if value is None else str(value)).strip().lower()[:VALUE_LENGTH]
+
+
+def numeric_value(value):
+    """The number a value starts with, or None."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _NUMBER_RE.match('' if value is None else str(value))
+    return float(match.group(1)) if match else None
+
+
+def rows_for(attributes):
+    """Normalized (name, value, numeric_value) rows for an attributes dict, one per name."""
+    if not isinstance(attributes, dict):
+        return []
+    rows = {}
+    for name, value in attributes.items():
+        key = normalize_name(name)
+        if key and key not in rows:
+            rows[key] = (key, normalize_value(value), numeric_value(value))
+    return list(rows.values())
+
+
+def replace_rows(attributes_by_product):
+    """
+    Rewrite the attribute rows of many products with one DELETE per chunk and
+    one executemany INSERT. Use from set-based writes that bypass set_attributes().
+
+    Args:
+        attributes_by_product: {product_id: attributes dict}
+    """
+    product_ids = list(attributes_by_product)
+    for start in range(0, len(product_ids), 500):
+        chunk = product_ids[start:start + 500]
+        db.session.execute(ProductAttribute.__table__.delete().where(ProductAttribute.product_id.in_(chunk)))
+    params = [{'product_id': product_id, 'name': name, 'value': value, 'numeric_value': number}
+              for product_id, attributes in attributes_by_product.items()
+              for name, value, number in rows_for(attributes)]
+    if params:
+        db.session.execute(ProductAttribute.__table__.insert(), params)
+
+
+def rebuild(chunk_size=1000):
+    """Rebuild every attribute row from the products' attributes JSON."""
+    db.session.execute(ProductAttribute.__table__.delete())
+    count = 0
+    last_id = 0
+    while True:
+        products = (db.session.query(Product.id, Product.attributes)
+                    .filter(Product.id > last_id)
+                    .order_by(Product.id)
+                    .limit(chunk_size)
+                    .all())
+        if not products:
+            break
+        params = [{'product_id': product_id, 'name': name, 'value': value, 'numeric_value': number}
+                  for product_id, attributes in products
+                  for name, value, number in rows_for(attributes)]
+        if params:
+            db.session.execute(ProductAttribute.__table__.insert(), params)
+        count += len(params)
+        last_id = products[-1].id
+    db.session.commit()
+    logger.info(f"Rebuilt product attribute index with {count} rows")
+    return count
+
+
+def ensure_populated():
+    """Backfill the attribute rows when they are empty but products already exist."""
+    if ProductAttribute.query.first() is None and Product.query.first() is not None:
+        rebuild()
+
+
+def parse_filter(text):
+    """Parse ``Name=Value``, ``Name>=N`` or ``Name<=N``; returns None if invalid."""
+    match = _FILTER_RE.match(text or '')
+    if not match:
+        return None
+    name, op, value = match.groups()
+    name = normalize_name(name)
+    if not name:
+        return None
+    if op == '=':
+        return AttributeFilter(name, op, normalize_value(value))
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return AttributeFilter(name, op, number) if math.isfinite(number) else None
+
+
+def parse_filters(values):
+    """Parse filters from request values; each value may hold several separated by ';'."""
+    filters = []
+    for value in values:
+        for part in (value or '').split(';'):
+            parsed = parse_filter(part)
+            if parsed and parsed not in filters:
+                filters.append(parsed)
+    return tuple(filters[:MAX_FILTERS])
+
+
+def format_filter(attribute_filter):
+    value = attribute_filter.value
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return f"{attribute_filter.name}{attribute_filter.op}{value}"
+
+
+def format_filters(filters):
+    """Filters as one URL value, the inverse of parse_filters()."""
+    return '; '.join(format_filter(attribute_filter) for attribute_filter in filters)
+
+
+def _condition(attribute_filter):
+    if attribute_filter.op == '=':
+        return ProductAttribute.value == attribute_filter.value
+    if attribute_filter.op == '>=':
+        return ProductAttribute.numeric_value >= attribute_filter.value
+    return ProductAttribute.numeric_value <= attribute_filter.value
+
+
+def filter_clause(attribute_filter):
+    """Clause restricting a Product query to products matching the filter."""
+    return Product.id.in_(select(ProductAttribute.product_id).where(
+        ProductAttribute.name == attribute_filter.name, _condition(attribute_filter)))
+
+
+def filter_sql(filters, params, column='product_id'):
+    """
+    Raw SQL restricting ``column`` to products matching every filter, for the
+    text queries in search_index. Adds its bind values to ``params``.
+    """
+    clauses = []
+    for index, attribute_filter in enumerate(filters):
+        operator = attribute_filter.op
+        target = 'value' if operator == '=' else 'numeric_value'
+        params[f'attr_name_{index}'] = attribute_filter.name
+        params[f'attr_value_{index}'] = attribute_filter.value
+        clauses.append(f"{column} IN (SELECT product_id FROM product_attribute "
+                       f"WHERE name = :attr_name_{index} AND {target} {operator} :attr_value_{index})")
+    return ' AND '.join(clauses)
+
+
+def matching_product_ids(filters):
+    """Ids of the products matching every filter."""
+    query = db.session.query(Product.id)
+    for attribute_filter in filters:
+        query = query.filter(filter_clause(attribute_filter))
+    return {product_id for (product_id,) in query}
+
+
+def has_numeric_values(name):
+    """Whether any product has a number for the attribute; one probe of the (name, numeric_value) index."""
+    return db.session.query(ProductAttribute.id).filter(
+        ProductAttribute.name == name, ProductAttribute.numeric_value.isnot(None)).first() is not None
+
+
+def sort_by(name, descending):
+    """An AttributeSort for ``name``: numeric when the attribute has numbers, else by its text value."""
+    return AttributeSort(name, descending, has_numeric_values(name))
+
+
+def sort_column(sort, rows=ProductAttribute):
+    """The product_attribute column (of ``rows``, e.g. an alias) a sort orders by."""
+    return rows.numeric_value if sort.numeric else rows.value
+
+
+def sort_value(product_id, sort):
+    """The value a product is sorted by for the given AttributeSort."""
+    return db.session.query(sort_column(sort)).filter(
+        ProductAttribute.product_id == product_id, ProductAttribute.name == sort.name).scalar()
+
+
+def attribute_names(limit=200):
+    """Distinct attribute names, for filter and sort suggestions."""
+    return [name for (name,) in db.session.query(ProductAttribute.name)
+            .group_by(ProductAttribute.name)
+            .order_by(func.count().desc(), ProductAttribute.name)
+            .limit(limit)]
@@ -0,0 +1,195 @@
+"""
+Admin product listing: server-side filters and keyset pagination.
+
+The admin product pages list products newest first, or by one attribute when
+``sort`` is given (its numeric value, or its text for attributes without
+numbers). Pages are fetched with a keyset on
+``(sort key, id)`` rather than OFFSET, so every page costs the same, and the
+text, category, Square and attribute filters are applied in SQL instead of
+hiding cards in the browser. Attribute filters and sorting go through the
+indexed product_attribute rows (see product_attributes).
+"""
+import base64
+import datetime
+import json
+from collections import namedtuple
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import aliased, selectinload
+from models import Product, Category, ProductAttribute
+import product_attributes
+
+SQUARE_FILTERS = ('synced', 'unsynced')
+
+ProductFilters = namedtuple('ProductFilters', ['q', 'category_id', 'square', 'attributes', 'sort'])
+
+
+def parse_filters(args):
+    """Read the listing filters and sort order from request args, dropping invalid values."""
+    q = (args.get('q') or '').strip()[:100]
+    category_id = args.get('category', type=int)
+    square = args.get('square')
+    if square not in SQUARE_FILTERS:
+        square = None
+    attributes = product_attributes.parse_filters(args.getlist('attr'))
+    sort = product_attributes.normalize_name(args.get('sort') or '')
+    sort = product_attributes.sort_by(sort, args.get('order') != 'asc') if sort else None
+    return ProductFilters(q or None, category_id, square, attributes, sort)
+
+
+def filter_args(filters):
+    """The active filters and sort order as URL query arguments."""
+    args = {'q': filters.q, 'category': filters.category_id, 'square': filters.square,
+            'attr': product_attributes.format_filters(filters.attributes)}
+    if filters.sort:
+        args['sort'] = filters.sort.name
+        args['order'] = 'desc' if filters.sort.descending else 'asc'
+    return {name: value for name, value in args.items() if value}
+
+
+def has_filters(filters):
+    """Whether any filter narrows the list (the sort order does not)."""
+    return any((filters.q, filters.category_id, filters.square, filters.attributes))
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def apply_filters(query, filters):
+    """Restrict a Product query to the given filters."""
+    if filters.q:
+        pattern = f"%{_escape_like(filters.q)}%"
+        query = query.filter(or_(Product.title.ilike(pattern, escape='\\'),
+                                 Product.batch_number.ilike(pattern, escape='\\'),
+                                 Product.sku.ilike(pattern, escape='\\')))
+    if filters.category_id:
+        query = query.filter(Product.categories.any(Category.id == filters.category_id))
+    if filters.square == 'synced':
+        query = query.filter(Product.square_catalog_id.isnot(None))
+    elif filters.square == 'unsynced':
+        query = query.filter(Product.square_catalog_id.is_(None))
+    for attribute_filter in filters.attributes:
+        query = query.filter(product_attributes.filter_clause(attribute_filter))
+    return query
+
+
+def _sort_key(query, filters):
+    """
+    Join whatever the list is ordered by.
+
+    Returns:
+        (query, key column, descending) - ties on the key are broken by id, highest first
+    """
+    if filters.sort is None:
+        return query, Product.created_at, True
+    sort_rows = aliased(ProductAttribute)
+    query = query.outerjoin(sort_rows, and_(sort_rows.product_id == Product.id,
+                                            sort_rows.name == filters.sort.name))
+    return query, product_attributes.sort_column(filters.sort, sort_rows), filters.sort.descending
+
+
+def _ordering(key, descending, reverse=False):
+    """ORDER BY for the list (products without a key last), or its exact reverse."""
+    key_order = key.desc() if descending != reverse else key.asc()
+    key_order = key_order.nulls_first() if reverse else key_order.nulls_last()
+    return key_order, Product.id.asc() if reverse else Product.id.desc()
+
+
+def _after(key, descending, value, product_id):
+    """Rows listed after the row with this (key, id)."""
+    if value is None:
+        return and_(key.is_(None), Product.id < product_id)
+    return or_(key < value if descending else key > value,
+               and_(key == value, Product.id < product_id),
+               key.is_(None))
+
+
+def _before(key, descending, value, product_id):
+    """Rows listed before the row with this (key, id)."""
+    if value is None:
+        return or_(key.isnot(None), Product.id > product_id)
+    return or_(key > value if descending else key < value,
+               and_(key == value, Product.id > product_id))
+
+
+def encode_cursor(value, product_id):
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, product_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor, filters):
+    """Return (sort key, id) from a cursor, or None if it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        value, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if value is not None:
+            if filters.sort is None:
+                value = datetime.datetime.fromisoformat(value)
+            elif filters.sort.numeric:
+                value = float(value)
+            elif not isinstance(value, str):
+                return None
+        return value, int(product_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def page(filters, cursor=None, per_page=30):
+    """
+    Fetch one page of products in list order.
+
+    Returns:
+        (products, next_cursor) - next_cursor is None on the last page
+    """
+    query = apply_filters(Product.query, filters).options(selectinload(Product.categories),
+                                                          selectinload(Product.image_variants))
+    query, key, descending = _sort_key(query, filters)
+
+    after = decode_cursor(cursor, filters)
+    if after is not None:
+        query = query.filter(_after(key, descending, *after))
+
+    rows = (query.add_columns(key)
+            .order_by(*_ordering(key, descending))
+            .limit(per_page + 1)
+            .all())
+    next_cursor = None
+    if len(rows) > per_page:
+        last_product, last_value = rows[per_page - 1]
+        next_cursor = encode_cursor(last_value, last_product.id)
+    return [product for product, _ in rows[:per_page]], next_cursor
+
+
+def neighbours(product, filters):
+    """
+    Find the products listed immediately before and after ``product``.
+
+    Uses the same filters and order as page(): two LIMIT 1 queries on the
+    (created_at, id) or attribute index, whatever the catalog size.
+
+    Returns:
+        (previous_product, next_product) - either may be None
+    """
+    query, key, descending = _sort_key(apply_filters(Product.query, filters), filters)
+    if filters.sort is None:
+        value = product.created_at
+    else:
+        value = product_attributes.sort_value(product.id, filters.sort)
+
+    previous_product = (query.filter(_before(key, descending, value, product.id))
+                        .order_by(*_ordering(key, descending, reverse=True))
+                        .first())
+    next_product = (query.filter(_after(key, descending, value, product.id))
+                    .order_by(*_ordering(key, descending))
+                    .first())
+    return previous_product, next_product
+
+
+def matches(product, filters):
+    """Whether a product is part of the filtered list."""
+    if not has_filters(filters):
+        return True
+    return apply_filters(Product.query, filters).filter(Product.id == product.id).first() is not None
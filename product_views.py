@@ -0,0 +1,68 @@
+"""
+View models for pages that show a product with its batch history and PDFs.
+
+All batch history and GeneratedPDF rows for a set of products are fetched in
+two queries and grouped in Python, so a product with a long history renders
+with a constant number of queries and templates never scan the PDF list per
+history row.
+"""
+from collections import namedtuple
+from models import BatchHistory, GeneratedPDF
+
+ProductView = namedtuple('ProductView', ['histories', 'pdfs', 'current_labels', 'history_labels'])
+
+
+def _pdf_batch_number(pdf):
+    """Batch directory of a PDF stored as pdfs/<batch_number>/<file>, if any."""
+    parts = pdf.filename.split('/')
+    return parts[-2] if len(parts) >= 3 and parts[-3] == 'pdfs' else None
+
+
+def build_product_views(products):
+    """
+    Build a ProductView for each product.
+
+    Returns:
+        dict of product_id -> ProductView with
+            histories       BatchHistory rows, newest first
+            pdfs            every GeneratedPDF of the product, newest first
+            current_labels  label PDFs of the current batch
+            history_labels  dict of batch_history_id -> label PDFs of that batch
+    """
+    product_ids = [product.id for product in products]
+    if not product_ids:
+        return {}
+
+    histories = {product_id: [] for product_id in product_ids}
+    for history in (BatchHistory.query
+                    .filter(BatchHistory.product_id.in_(product_ids))
+                    .order_by(BatchHistory.created_at.desc())):
+        histories[history.product_id].append(history)
+
+    pdfs = {product_id: [] for product_id in product_ids}
+    for pdf in (GeneratedPDF.query
+                .filter(GeneratedPDF.product_id.in_(product_ids))
+                .order_by(GeneratedPDF.created_at.desc())):
+        pdfs[pdf.product_id].append(pdf)
+
+    views = {}
+    for product in products:
+        history_by_batch = {history.batch_number: history.id for history in histories[product.id]}
+        current_labels = []
+        history_labels = {history.id: [] for history in histories[product.id]}
+        for pdf in pdfs[product.id]:
+            if pdf.batch_history_id:
+                history_labels.setdefault(pdf.batch_history_id, []).append(pdf)
+            elif product.batch_number and pdf.filename.startswith('label_' + product.batch_number):
+                current_labels.append(pdf)
+            else:
+                # Older rotations moved the file into pdfs/<batch>/ without linking the history row
+                history_id = history_by_batch.get(_pdf_batch_number(pdf))
+                if history_id:
+                    history_labels[history_id].append(pdf)
+        views[product.id] = ProductView(histories[product.id], pdfs[product.id], current_labels, history_labels)
+    return views
+
+
+def build_product_view(product):
+    return build_product_views([product])[product.id]
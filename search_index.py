@@ -0,0 +1,428 @@
+"""
+Full-text search index for the public catalog search.
+
+Each product and each BatchHistory row is stored as one search document
+covering titles, batch numbers, SKU, barcode and attribute values. The
+backend is picked from the database dialect:
+
+    sqlite      FTS5 virtual table ranked with bm25()
+    postgresql  tsvector column with a GIN index ranked with ts_rank()
+    otherwise   in-memory inverted index (also used if FTS5 is unavailable)
+
+The in-memory index is rebuilt at startup and only sees writes made by the
+current process. Documents are kept up to date incrementally by calling
+index_product()/remove_product()/remove_history() from the write paths.
+"""
+import base64
+import bisect
+import json
+import logging
+import re
+import threading
+from collections import namedtuple
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from models import db, Product, BatchHistory
+import product_attributes
+
+logger = logging.getLogger(__name__)
+
+KIND_PRODUCT = 'product'
+KIND_HISTORY = 'history'
+
+# Relative weight of each document field when ranking matches
+FIELD_WEIGHTS = {
+    'title': 10.0,
+    'batch_numbers': 8.0,
+    'codes': 8.0,
+    'attributes': 2.0,
+}
+
+MAX_QUERY_TERMS = 8
+REBUILD_CHUNK_SIZE = 500
+
+SearchHit = namedtuple('SearchHit', ['kind', 'ref_id', 'product_id', 'score'])
+SearchResults = namedtuple('SearchResults', ['hits', 'total'])
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(value):
+    """Split free text into lowercase word tokens."""
+    if not value:
+        return []
+    return _TOKEN_RE.findall(str(value).lower())
+
+
+def _doc_id(kind, ref_id):
+    # Products and history rows share one id space: even for products, odd for history
+    return ref_id * 2 if kind == KIND_PRODUCT else ref_id * 2 + 1
+
+
+def _attribute_text(attributes):
+    return ' '.join(str(value) for value in attributes.values() if value not in (None, ''))
+
+
+def product_document(product):
+    """Build the search document for a product's current batch."""
+    return {
+        'doc_id': _doc_id(KIND_PRODUCT, product.id),
+        'kind': KIND_PRODUCT,
+        'ref_id': product.id,
+        'product_id': product.id,
+        'title': product.title or '',
+        'batch_numbers': product.batch_number or '',
+        'codes': ' '.join(code for code in (product.sku, product.barcode) if code),
+        'attributes': _attribute_text(product.get_attributes()),
+    }
+
+
+def history_document(history):
+    """Build the search document for a historical batch."""
+    return {
+        'doc_id': _doc_id(KIND_HISTORY, history.id),
+        'kind': KIND_HISTORY,
+        'ref_id': history.id,
+        'product_id': history.product_id,
+        'title': '',
+        'batch_numbers': history.batch_number or '',
+        'codes': '',
+        'attributes': _attribute_text(history.get_attributes()),
+    }
+
+
+def _attribute_clause(attributes, params):
+    """SQL appended to a backend's WHERE to apply attribute filters to the owning product."""
+    if not attributes:
+        return ''
+    return ' AND ' + product_attributes.filter_sql(attributes, params)
+
+
+def _keyset_clause(after, params):
+    """WHERE clause continuing a (score DESC, ref_id ASC) ordering after the given hit."""
+    if after is None:
+        return ''
+    params['after_score'], params['after_id'] = after
+    return "WHERE score < :after_score OR (score = :after_score AND ref_id > :after_id)"
+
+
+class _SQLiteBackend:
+    """FTS5 virtual table keyed by doc_id as rowid."""
+    name = 'fts5'
+
+    def ensure_schema(self):
+        db.session.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+            "kind UNINDEXED, ref_id UNINDEXED, product_id UNINDEXED, "
+            "title, batch_numbers, codes, attributes, "
+            "tokenize = 'unicode61', prefix = '2 3 4')"
+        ))
+        db.session.commit()
+
+    def is_empty(self):
+        return db.session.execute(text("SELECT rowid FROM search_fts LIMIT 1")).first() is None
+
+    def clear(self):
+        db.session.execute(text("DELETE FROM search_fts"))
+
+    def replace(self, documents):
+        if not documents:
+            return
+        self.delete([doc['doc_id'] for doc in documents])
+        db.session.execute(text(
+            "INSERT INTO search_fts (rowid, kind, ref_id, product_id, title, batch_numbers, codes, attributes) "
+            "VALUES (:doc_id, :kind, :ref_id, :product_id, :title, :batch_numbers, :codes, :attributes)"
+        ), documents)
+
+    def delete(self, doc_ids):
+        if doc_ids:
+            db.session.execute(text("DELETE FROM search_fts WHERE rowid = :doc_id"),
+                               [{'doc_id': doc_id} for doc_id in doc_ids])
+
+    def search(self, terms, kind, limit, after, attributes):
+        match = ' '.join(f'"{term}"*' for term in terms)
+        # bm25() takes one weight per column, including the UNINDEXED ones
+        weights = ', '.join(str(w) for w in (0, 0, 0, FIELD_WEIGHTS['title'], FIELD_WEIGHTS['batch_numbers'],
+                                             FIELD_WEIGHTS['codes'], FIELD_WEIGHTS['attributes']))
+        params = {'match': match, 'kind': kind, 'limit': limit}
+        restrict = _attribute_clause(attributes, params)
+        rows = db.session.execute(text(
+            f"SELECT ref_id, product_id, score FROM ("
+            f"SELECT ref_id, product_id, -bm25(search_fts, {weights}) AS score FROM search_fts "
+            f"WHERE search_fts MATCH :match AND kind = :kind{restrict}) "
+            f"{_keyset_clause(after, params)} "
+            "ORDER BY score DESC, ref_id LIMIT :limit"
+        ), params).all()
+        total = db.session.execute(text(
+            f"SELECT count(*) FROM search_fts WHERE search_fts MATCH :match AND kind = :kind{restrict}"
+        ), params).scalar()
+        return SearchResults([SearchHit(kind, row.ref_id, row.product_id, row.score) for row in rows], total)
+
+
+class _PostgresBackend:
+    """Weighted tsvector documents with a GIN index."""
+    name = 'tsvector'
+
+    def ensure_schema(self):
+        db.session.execute(text(
+            "CREATE TABLE IF NOT EXISTS search_document ("
+            "doc_id BIGINT PRIMARY KEY, kind VARCHAR(10) NOT NULL, ref_id INTEGER NOT NULL, "
+            "product_id INTEGER NOT NULL, document TSVECTOR NOT NULL)"
+        ))
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_search_document_document ON search_document USING GIN (document)"
+        ))
+        db.session.commit()
+
+    def is_empty(self):
+        return db.session.execute(text("SELECT doc_id FROM search_document LIMIT 1")).first() is None
+
+    def clear(self):
+        db.session.execute(text("DELETE FROM search_document"))
+
+    def replace(self, documents):
+        if not documents:
+            return
+        db.session.execute(text(
+            "INSERT INTO search_document (doc_id, kind, ref_id, product_id, document) "
+            "VALUES (:doc_id, :kind, :ref_id, :product_id, "
+            "setweight(to_tsvector('simple', :title), 'A') || "
+            "setweight(to_tsvector('simple', :batch_numbers), 'A') || "
+            "setweight(to_tsvector('simple', :codes), 'B') || "
+            "setweight(to_tsvector('simple', :attributes), 'C')) "
+            "ON CONFLICT (doc_id) DO UPDATE SET kind = EXCLUDED.kind, ref_id = EXCLUDED.ref_id, "
+            "product_id = EXCLUDED.product_id, document = EXCLUDED.document"
+        ), documents)
+
+    def delete(self, doc_ids):
+        if doc_ids:
+            db.session.execute(text("DELETE FROM search_document WHERE doc_id = ANY(:doc_ids)"),
+                               {'doc_ids': list(doc_ids)})
+
+    def search(self, terms, kind, limit, after, attributes):
+        # Terms are \w+ tokens, so they are safe to splice into a tsquery
+        params = {'query': ' & '.join(f'{term}:*' for term in terms), 'kind': kind, 'limit': limit}
+        restrict = _attribute_clause(attributes, params)
+        rows = db.session.execute(text(
+            "SELECT ref_id, product_id, score FROM ("
+            "SELECT ref_id, product_id, ts_rank(document, query) AS score "
+            "FROM search_document, to_tsquery('simple', :query) query "
+            f"WHERE document @@ query AND kind = :kind{restrict}) ranked "
+            f"{_keyset_clause(after, params)} "
+            "ORDER BY score DESC, ref_id LIMIT :limit"
+        ), params).all()
+        total = db.session.execute(text(
+            "SELECT count(*) FROM search_document "
+            f"WHERE document @@ to_tsquery('simple', :query) AND kind = :kind{restrict}"
+        ), params).scalar()
+        return SearchResults([SearchHit(kind, row.ref_id, row.product_id, row.score) for row in rows], total)
+
+
+class _MemoryBackend:
+    """Process-local inverted index with prefix lookup over a sorted token list."""
+    name = 'memory'
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._documents = {}   # doc_id -> (kind, ref_id, product_id, {token: weight})
+        self._postings = {}    # token -> {doc_id: weight}
+        self._tokens = []      # sorted list of every indexed token
+
+    def ensure_schema(self):
+        pass
+
+    def is_empty(self):
+        return not self._documents
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+            self._postings.clear()
+            self._tokens.clear()
+
+    def replace(self, documents):
+        with self._lock:
+            for doc in documents:
+                self._remove(doc['doc_id'])
+                weights = {}
+                for field, weight in FIELD_WEIGHTS.items():
+                    for token in tokenize(doc[field]):
+                        weights[token] = max(weights.get(token, 0), weight)
+                self._documents[doc['doc_id']] = (doc['kind'], doc['ref_id'], doc['product_id'], weights)
+                for token, weight in weights.items():
+                    if token not in self._postings:
+                        self._postings[token] = {}
+                        bisect.insort(self._tokens, token)
+                    self._postings[token][doc['doc_id']] = weight
+
+    def delete(self, doc_ids):
+        with self._lock:
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        document = self._documents.pop(doc_id, None)
+        if document is None:
+            return
+        for token in document[3]:
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[token]
+                index = bisect.bisect_left(self._tokens, token)
+                if index < len(self._tokens) and self._tokens[index] == token:
+                    del self._tokens[index]
+
+    def _prefix_matches(self, term):
+        """Return {doc_id: best weight} for every token starting with term."""
+        matches = {}
+        index = bisect.bisect_left(self._tokens, term)
+        while index < len(self._tokens) and self._tokens[index].startswith(term):
+            for doc_id, weight in self._postings[self._tokens[index]].items():
+                if weight > matches.get(doc_id, 0):
+                    matches[doc_id] = weight
+            index += 1
+        return matches
+
+    def search(self, terms, kind, limit, after, attributes):
+        allowed = product_attributes.matching_product_ids(attributes) if attributes else None
+        with self._lock:
+            scores = None
+            for term in terms:
+                matches = self._prefix_matches(term)
+                if scores is None:
+                    scores = {doc_id: weight for doc_id, weight in matches.items()
+                              if self._documents[doc_id][0] == kind}
+                else:
+                    scores = {doc_id: score + matches[doc_id] for doc_id, score in scores.items()
+                              if doc_id in matches}
+                if not scores:
+                    return SearchResults([], 0)
+
+            if allowed is not None:
+                scores = {doc_id: score for doc_id, score in scores.items()
+                          if self._documents[doc_id][2] in allowed}
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], self._documents[item[0]][1]))
+            if after is not None:
+                ranked_after = [(doc_id, score) for doc_id, score in ranked
+                                if (-score, self._documents[doc_id][1]) > (-after[0], after[1])]
+            else:
+                ranked_after = ranked
+            hits = [SearchHit(kind, self._documents[doc_id][1], self._documents[doc_id][2], score)
+                    for doc_id, score in ranked_after[:limit]]
+            return SearchResults(hits, len(ranked))
+
+
+_backend = _MemoryBackend()
+
+
+def backend_name():
+    return _backend.name
+
+
+def init_app(app):
+    """Pick a backend for the configured database and make sure it is populated."""
+    global _backend
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        candidate = _SQLiteBackend()
+    elif dialect == 'postgresql':
+        candidate = _PostgresBackend()
+    else:
+        candidate = _MemoryBackend()
+
+    try:
+        candidate.ensure_schema()
+    except OperationalError as e:
+        db.session.rollback()
+        app.logger.warning(f"Search backend '{candidate.name}' unavailable ({e}), using in-memory index")
+        candidate = _MemoryBackend()
+    _backend = candidate
+
+    if _backend.is_empty() and Product.query.first() is not None:
+        rebuild()
+    app.logger.info(f"Search index ready (backend: {_backend.name})")
+
+
+def rebuild():
+    """Re-index every product and historical batch."""
+    _backend.clear()
+    count = 0
+    for model, build in ((Product, product_document), (BatchHistory, history_document)):
+        chunk = []
+        for row in model.query.order_by(model.id).yield_per(REBUILD_CHUNK_SIZE):
+            chunk.append(build(row))
+            if len(chunk) >= REBUILD_CHUNK_SIZE:
+                _backend.replace(chunk)
+                count += len(chunk)
+                chunk = []
+        _backend.replace(chunk)
+        count += len(chunk)
+    db.session.commit()
+    logger.info(f"Rebuilt search index with {count} documents")
+    return count
+
+
+def index_product(product):
+    """Index a product's current batch and all of its historical batches."""
+    documents = [product_document(product)]
+    documents.extend(history_document(history) for history in product.batch_history)
+    _backend.replace(documents)
+
+
+def index_products(products):
+    """Re-index the current batch of many products (their history documents are left alone)."""
+    _backend.replace([product_document(product) for product in products])
+
+
+def index_history(history):
+    _backend.replace([history_document(history)])
+
+
+def remove_product(product):
+    """Drop a product and its history from the index. Call before deleting the rows."""
+    doc_ids = [_doc_id(KIND_PRODUCT, product.id)]
+    doc_ids.extend(_doc_id(KIND_HISTORY, history_id)
+                   for (history_id,) in db.session.query(BatchHistory.id).filter_by(product_id=product.id))
+    _backend.delete(doc_ids)
+
+
+def remove_history(history_id):
+    _backend.delete([_doc_id(KIND_HISTORY, history_id)])
+
+
+def search(query, kind=KIND_PRODUCT, limit=20, after=None, attributes=()):
+    """
+    Ranked prefix search. Every query term must match the start of a word.
+
+    Results are keyset paginated: pass the cursor of the last hit of the
+    previous page (see hit_cursor) as ``after`` to fetch the next page.
+    ``attributes`` (product_attributes.AttributeFilter tuples) restrict hits
+    to batches whose product currently matches every filter.
+
+    Returns:
+        SearchResults(hits, total) with hits ordered best first
+    """
+    terms = tokenize(query)[:MAX_QUERY_TERMS]
+    if not terms:
+        return SearchResults([], 0)
+    return _backend.search(terms, kind, limit, after, attributes)
+
+
+def hit_cursor(hit):
+    """Opaque, URL-safe cursor continuing a search after this hit."""
+    payload = json.dumps([hit.score, hit.ref_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def parse_cursor(cursor):
+    """Decode a cursor from hit_cursor(); returns None for a missing or invalid value."""
+    if not cursor:
+        return None
+    try:
+        score, ref_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return float(score), int(ref_id)
+    except (ValueError, TypeError):
+        return None
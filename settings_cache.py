@@ -0,0 +1,65 @@
+"""
+Process-local cache of the Settings row.
+
+The settings row is read on every rendered template and before every Square
+and CraftMyPDF call but changes only from the settings page. get() returns an
+immutable snapshot and re-checks the row's ``version`` column at most every
+``check_interval`` seconds. Saving the settings bumps the version, which
+invalidates this process immediately and every other worker at its next
+version check.
+"""
+import threading
+import time
+from collections import namedtuple
+from models import db, Settings
+
+_FIELDS = ['id', 'version', 'show_square_id_controls', 'show_square_image_id_controls',
+           'square_environment', 'square_sandbox_access_token', 'square_sandbox_location_id',
+           'square_production_access_token', 'square_production_location_id', 'craftmypdf_api_key']
+
+
+class SettingsSnapshot(namedtuple('SettingsSnapshot', _FIELDS)):
+    """Read-only copy of the Settings row with the same credential helpers."""
+    __slots__ = ()
+
+    get_active_square_credentials = Settings.get_active_square_credentials
+    get_craftmypdf_credentials = Settings.get_craftmypdf_credentials
+
+
+_lock = threading.Lock()
+_snapshot = None
+_checked_at = 0.0
+check_interval = 5
+
+
+def _take_snapshot():
+    settings = Settings.get_settings()
+    return SettingsSnapshot(*(getattr(settings, field) for field in _FIELDS))
+
+
+def get():
+    """Return the current settings snapshot, reloading it only when its version changed."""
+    global _snapshot, _checked_at
+    snapshot = _snapshot
+    now = time.monotonic()
+    if snapshot is not None and now - _checked_at < check_interval:
+        return snapshot
+
+    with _lock:
+        if _snapshot is not None and now - _checked_at < check_interval:
+            return _snapshot
+        if _snapshot is not None:
+            version = db.session.query(Settings.version).filter(Settings.id == _snapshot.id).scalar()
+            if version == _snapshot.version:
+                _checked_at = now
+                return _snapshot
+        _snapshot = _take_snapshot()
+        _checked_at = now
+        return _snapshot
+
+
+def invalidate():
+    """Forget the snapshot in this process. Call after committing a settings change."""
+    global _snapshot
+    with _lock:
+        _snapshot = None
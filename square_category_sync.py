@@ -2,12 +2,13 @@ import uuid
 import requests
 from flask import jsonify
 from app import app
-from models import db, Category, Settings
+from models import db, Category
+import settings_cache
 
 SQUARE_VERSION = "2024-12-18"
 
 def get_square_headers():
-    settings = Settings.get_settings()
+    settings = settings_cache.get()
     credentials = settings.get_active_square_credentials()
     return {
         'Square-Version': SQUARE_VERSION,
@@ -17,7 +18,7 @@ def get_square_headers():
 
 def sync_category_to_square(category):
     """Sync a single category to Square catalog"""
-    settings = Settings.get_settings()
+    settings = settings_cache.get()
     credentials = settings.get_active_square_credentials()
     
     if not credentials:
@@ -74,7 +75,7 @@ def delete_category_from_square(category):
         category.square_category_id = None
         db.session.commit()
 
-        settings = Settings.get_settings()
+        settings = settings_cache.get()
         credentials = settings.get_active_square_credentials()
 
         # Delete catalog item
@@ -5,7 +5,8 @@ import logging
 import datetime
 import os
 from typing import Optional
-from models import Product, db, Settings
+from models import Product, db
+import settings_cache
 from app import app
 
 def upload_product_image_to_square(product: Product) -> Optional[str]:
@@ -25,7 +26,7 @@ def upload_product_image_to_square(product: Product) -> Optional[str]:
         return None
 
     # Get Square API credentials from database
-    settings = Settings.get_settings()
+    settings = settings_cache.get()
     credentials = settings.get_active_square_credentials()
     url = f"{credentials['base_url']}/v2/catalog/images"
     headers = {
@@ -3,12 +3,13 @@ import json
 import requests
 from flask import jsonify
 from app import app
-from models import db, Product, Settings
+from models import db, Product
+import settings_cache
 
 SQUARE_VERSION = "2024-12-18"
 
 def get_square_headers():
-    settings = Settings.get_settings()
+    settings = settings_cache.get()
     credentials = settings.get_active_square_credentials()
     return {
         'Square-Version': SQUARE_VERSION,
@@ -29,7 +30,7 @@ def sync_product_to_square(product):
     """Sync a single product to Square catalog"""
     from square_category_sync import sync_category_to_square
 
-    settings = Settings.get_settings()
+    settings = settings_cache.get()
     credentials = settings.get_active_square_credentials()
 
     if not credentials:
@@ -232,7 +233,7 @@ def delete_product_from_square(product):
         # We intentionally do not clear category IDs here to preserve them
         db.session.commit()
 
-        settings = Settings.get_settings()
+        settings = settings_cache.get()
         credentials = settings.get_active_square_credentials()
 
         # Delete catalog item (will also delete associated images)
@@ -0,0 +1,243 @@
+"""
+In-memory type-ahead index for the public search box.
+
+Batch numbers (current and historical) and product titles are kept in one
+sorted array of ``(key, entry)`` pairs, so a keystroke is answered with a
+bisect and a short forward scan and never touches the database. Titles are
+indexed at every word boundary ("blue dream" and "dream") so a prefix of any
+word in the title matches.
+
+The index is built at startup and write paths update it after committing.
+Other worker processes do not see those updates, so a background thread also
+rebuilds the whole index every ``refresh_interval`` seconds; lookups never
+wait for it.
+"""
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import namedtuple
+from models import db, Product, BatchHistory
+
+logger = logging.getLogger(__name__)
+
+KIND_PRODUCT = 'product'
+KIND_HISTORY = 'history'
+
+Suggestion = namedtuple('Suggestion', ['kind', 'batch_number', 'title', 'product_id'])
+
+_WORD_START_RE = re.compile(r'(?:^|(?<=[^0-9a-z]))[0-9a-z]')
+
+
+def _normalize(value):
+    return ' '.join(str(value).lower().split()) if value else ''
+
+
+def _title_keys(title):
+    """Every suffix of the title that starts at a word boundary."""
+    title = _normalize(title)
+    return {title[match.start():] for match in _WORD_START_RE.finditer(title)}
+
+
+class SuggestIndex:
+    def __init__(self, refresh_interval=300, max_scan=500):
+        self.refresh_interval = refresh_interval
+        self.max_scan = max_scan
+        self._lock = threading.Lock()
+        self._keys = []         # sorted (key, entry_ref)
+        self._entries = {}      # entry_ref -> (kind, batch_number, product_id, keys)
+        self._by_product = {}   # product_id -> {entry_ref}
+        self._titles = {}       # product_id -> title
+        self._rebuilding = False
+        self._journal = None    # updates made while a rebuild is reading the tables, else None
+        self._refresher = None
+
+    def init_app(self, app):
+        """Build the index (inside an app context) and start the periodic rebuild."""
+        self.refresh_interval = app.config.get('SUGGEST_REFRESH_INTERVAL', self.refresh_interval)
+        self.rebuild()
+        if self.refresh_interval and self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh, args=(app,), name='suggest-index',
+                                               daemon=True)
+            self._refresher.start()
+
+    def _refresh(self, app):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                with app.app_context():
+                    self.rebuild()
+            except Exception as e:
+                logger.error(f"Error rebuilding suggestion index: {str(e)}")
+
+    def _entry_keys(self, kind, batch_number, title):
+        keys = set()
+        if batch_number:
+            keys.add(_normalize(batch_number))
+        if kind == KIND_PRODUCT:
+            keys.update(_title_keys(title))
+        return keys
+
+    def _put(self, entry_ref, kind, batch_number, product_id, title=None):
+        self._drop(entry_ref)
+        keys = self._entry_keys(kind, batch_number, title)
+        self._entries[entry_ref] = (kind, batch_number, product_id, keys)
+        self._by_product.setdefault(product_id, set()).add(entry_ref)
+        for key in keys:
+            insort(self._keys, (key, entry_ref))
+
+    def _drop(self, entry_ref):
+        entry = self._entries.pop(entry_ref, None)
+        if entry is None:
+            return
+        refs = self._by_product.get(entry[2])
+        if refs is not None:
+            refs.discard(entry_ref)
+            if not refs:
+                del self._by_product[entry[2]]
+        for key in entry[3]:
+            position = bisect_left(self._keys, (key, entry_ref))
+            if position < len(self._keys) and self._keys[position] == (key, entry_ref):
+                del self._keys[position]
+
+    def _apply(self, update):
+        # Called with _lock held
+        action, args = update[0], update[1:]
+        if action == 'product':
+            product_id, title, batch_number, histories = args
+            self._titles[product_id] = title
+            self._put((KIND_PRODUCT, product_id), KIND_PRODUCT, batch_number, product_id, title)
+            for history_id, history_batch_number in histories:
+                self._put((KIND_HISTORY, history_id), KIND_HISTORY, history_batch_number, product_id)
+        elif action == 'new_products':
+            products, = args
+            added = []
+            for product_id, title, batch_number in products:
+                entry_ref = (KIND_PRODUCT, product_id)
+                self._drop(entry_ref)
+                keys = self._entry_keys(KIND_PRODUCT, batch_number, title)
+                self._titles[product_id] = title
+                self._entries[entry_ref] = (KIND_PRODUCT, batch_number, product_id, keys)
+                self._by_product.setdefault(product_id, set()).add(entry_ref)
+                added.extend((key, entry_ref) for key in keys)
+            # One merge of two sorted runs instead of an insort per key
+            self._keys = sorted(self._keys + sorted(added))
+        elif action == 'remove_product':
+            product_id, = args
+            self._titles.pop(product_id, None)
+            for entry_ref in list(self._by_product.get(product_id, ())):
+                self._drop(entry_ref)
+        elif action == 'remove_history':
+            history_id, = args
+            self._drop((KIND_HISTORY, history_id))
+        if self._journal is not None:
+            self._journal.append(update)
+
+    def rebuild(self):
+        """
+        Rebuild the whole index from the product and batch_history tables.
+
+        The new index is built aside and swapped in, so lookups keep being
+        answered from the old one meanwhile. Returns None without reading
+        the tables when another rebuild is already running.
+        """
+        with self._lock:
+            if self._rebuilding:
+                return None
+            self._rebuilding = True
+            self._journal = []
+        try:
+            entries = {}
+            by_product = {}
+            titles = {}
+            for product_id, title, batch_number in db.session.query(Product.id, Product.title,
+                                                                    Product.batch_number):
+                titles[product_id] = title
+                entries[(KIND_PRODUCT, product_id)] = (KIND_PRODUCT, batch_number, product_id,
+                                                       self._entry_keys(KIND_PRODUCT, batch_number, title))
+                by_product.setdefault(product_id, set()).add((KIND_PRODUCT, product_id))
+            for history_id, product_id, batch_number in db.session.query(
+                    BatchHistory.id, BatchHistory.product_id, BatchHistory.batch_number):
+                entries[(KIND_HISTORY, history_id)] = (KIND_HISTORY, batch_number, product_id,
+                                                       self._entry_keys(KIND_HISTORY, batch_number, None))
+                by_product.setdefault(product_id, set()).add((KIND_HISTORY, history_id))
+            keys = sorted((key, entry_ref) for entry_ref, entry in entries.items() for key in entry[3])
+
+            with self._lock:
+                journal, self._journal = self._journal, None
+                self._entries = entries
+                self._by_product = by_product
+                self._titles = titles
+                self._keys = keys
+                # Updates committed while the tables were read may be missing from them
+                for update in journal:
+                    self._apply(update)
+        finally:
+            with self._lock:
+                self._rebuilding = False
+                self._journal = None
+        logger.info(f"Built suggestion index with {len(keys)} keys for {len(entries)} batches")
+        return len(entries)
+
+    def index_product(self, product):
+        """Index a product's current batch, title and all of its historical batches."""
+        histories = [(history.id, history.batch_number) for history in product.batch_history]
+        with self._lock:
+            self._apply(('product', product.id, product.title, product.batch_number, histories))
+
+    def index_new_products(self, products):
+        """
+        Index many just-created products, which have no history yet, at once.
+
+        Args:
+            products: (product_id, title, batch_number) tuples
+        """
+        products = list(products)
+        with self._lock:
+            self._apply(('new_products', products))
+
+    def remove_product(self, product_id):
+        """Drop a product and every historical batch that belonged to it."""
+        with self._lock:
+            self._apply(('remove_product', product_id))
+
+    def remove_history(self, history_id):
+        with self._lock:
+            self._apply(('remove_history', history_id))
+
+    def suggest(self, prefix, limit=8):
+        """
+        Return up to ``limit`` suggestions whose batch number or title word starts with prefix.
+
+        Current batches are listed before historical ones; each batch appears once.
+        """
+        prefix = _normalize(prefix)
+        if not prefix:
+            return []
+        limit = max(1, limit)
+
+        current, historical, seen = [], [], set()
+        with self._lock:
+            keys = self._keys
+            position = bisect_left(keys, (prefix,))
+            end = min(len(keys), position + self.max_scan)
+            while position < end and len(current) < limit and keys[position][0].startswith(prefix):
+                entry_ref = keys[position][1]
+                position += 1
+                if entry_ref in seen:
+                    continue
+                seen.add(entry_ref)
+                kind, batch_number, product_id, _ = self._entries[entry_ref]
+                if not batch_number:
+                    continue
+                suggestion = Suggestion(kind, batch_number, self._titles.get(product_id), product_id)
+                (current if kind == KIND_PRODUCT else historical).append(suggestion)
+        return (current + historical)[:limit]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Public search box suggestions
+suggestions = SuggestIndex()
@@ -6,7 +6,7 @@ import io
 from werkzeug.utils import secure_filename
 
 def generate_upc_barcode():
-    """Generate a random UPC-A barcode number"""
+    """Generate a random UPC-A barcode number; use identifiers.allocate() for one that is free"""
     digits = ''.join(random.choices(string.digits, k=11))
     return digits + calculate_upc_check_digit(digits)
 
@@ -19,7 +19,7 @@ def calculate_upc_check_digit(digits):
     return str(check_digit)
 
 def generate_sku():
-    """Generate a unique SKU"""
+    """Generate a random SKU; use identifiers.allocate() for one that is free"""
     prefix = ''.join(random.choices(string.ascii_uppercase, k=2))
     numbers = ''.join(random.choices(string.digits, k=6))
     return f"{prefix}{numbers}"
@@ -29,11 +29,12 @@ def clean_filename(filename):
     return secure_filename(filename)
 
 def is_valid_image(file):
-    """Check if file is a valid image"""
+    """Check if file is a valid image within image_pipeline's pixel limit, from its header alone"""
+    from image_pipeline import inspect
     try:
-        Image.open(file)
+        inspect(file.stream if hasattr(file, 'stream') else file)
         return True
-    except:
+    except Exception:
         return False
 
 def process_image(file):
@@ -45,6 +46,6 @@ def process_image(file):
     return output
 
 def generate_batch_number():
-    """Generate a unique batch number"""
+    """Generate a random batch number; use identifiers.allocate() for one that is free"""
     chars = string.ascii_uppercase + string.digits
     return ''.join(random.choice(chars) for _ in range(8))